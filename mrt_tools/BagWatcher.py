@@ -0,0 +1,145 @@
+import threading
+import time
+import re
+import os
+
+
+class BagWatcher(object):
+    """
+    Reports bags of a recording as soon as rosbag finished writing them.
+
+    rosbag writes into <name>.bag.active and renames the file to <name>.bag when it is closed. The watcher listens for
+    these renames with inotify, or polls the directory if pyinotify is not available. Split recordings produce several
+    bags (<name>_0.bag, <name>_1.bag, ...), each of them is reported as soon as it is closed, while the recording goes
+    on.
+    """
+
+    def __init__(self, output_name, callback, poll_interval=0.2):
+        """
+        :param output_name: Path of the recorded bag, as passed to 'rosbag record -O'
+        :param callback: Called with the path of every finished bag, from a background thread
+        :param poll_interval: Time in seconds between directory scans, if inotify is not used
+        """
+        output_name = os.path.abspath(output_name)
+        self.directory = os.path.dirname(output_name)
+        base = os.path.basename(output_name)
+        if base.endswith(".bag"):
+            base = base[:-len(".bag")]
+        self.pattern = re.compile(re.escape(base) + r"(_\d+)?\.bag$")
+        self.callback = callback
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.changed = threading.Event()
+        self.stopped = threading.Event()
+        self.reported = set()
+        self.existing = {}
+        self.notifier = None
+        self.thread = None
+
+    def start(self, use_inotify=True):
+        """Start watching. Bags, which already exist and are not written again, are not reported."""
+        self.existing = {path: os.path.getmtime(path) for path in self.list_bags()}
+        if use_inotify:
+            try:
+                import pyinotify
+            except ImportError:
+                pass
+            else:
+                watcher = self
+
+                class Handler(pyinotify.ProcessEvent):
+                    def process_default(self, event):
+                        watcher.on_event(event.pathname)
+
+                manager = pyinotify.WatchManager()
+                self.notifier = pyinotify.ThreadedNotifier(manager, Handler())
+                self.notifier.daemon = True
+                self.notifier.start()
+                manager.add_watch(self.directory, pyinotify.IN_MOVED_TO | pyinotify.IN_CLOSE_WRITE)
+        if self.notifier is None:
+            self.thread = threading.Thread(target=self.poll_loop)
+            self.thread.daemon = True
+            self.thread.start()
+        # Bags that were closed before the watch was set up
+        self.scan()
+
+    def list_bags(self):
+        """Returns all finished bags of this recording"""
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, f) for f in sorted(filenames) if self.pattern.match(f)]
+
+    def is_active(self):
+        """Whether rosbag is still writing to one of the bags of this recording"""
+        try:
+            filenames = os.listdir(self.directory)
+        except OSError:
+            return False
+        return any(f.endswith(".active") and self.pattern.match(f[:-len(".active")]) for f in filenames)
+
+    def on_event(self, path):
+        self.changed.set()
+        if os.path.dirname(path) == self.directory and self.pattern.match(os.path.basename(path)):
+            self.report(path)
+
+    def report(self, path):
+        with self.lock:
+            if path in self.reported or not os.path.isfile(path):
+                return
+            try:
+                if self.existing.get(path) == os.path.getmtime(path):
+                    return
+            except OSError:
+                return
+            self.reported.add(path)
+        self.callback(path)
+
+    def scan(self):
+        for path in self.list_bags():
+            self.report(path)
+
+    def poll_loop(self):
+        while not self.stopped.wait(self.poll_interval):
+            self.scan()
+            self.changed.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait until rosbag closed all bags of this recording, then stop watching
+        :param timeout: Maximum time to wait in seconds
+        :return: True if all bags were closed
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while self.is_active():
+            if deadline is not None and time.time() > deadline:
+                break
+            # Also wake up regularly, in case an event was missed
+            self.changed.wait(1.0)
+            self.changed.clear()
+        self.stop()
+        self.scan()
+        return not self.is_active()
+
+    def stop(self):
+        self.stopped.set()
+        if self.notifier is not None:
+            self.notifier.stop()
+            self.notifier = None
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    @staticmethod
+    def wait_until_closed(bagfile, timeout=None):
+        """
+        Wait until rosbag finished writing a bag
+        :param bagfile: Path to the bag
+        :param timeout: Maximum time to wait in seconds
+        :return: True if the bag was closed
+        """
+        watcher = BagWatcher(bagfile, lambda path: None)
+        watcher.pattern = re.compile(re.escape(os.path.basename(bagfile)) + "$")
+        watcher.start()
+        return watcher.wait(timeout)
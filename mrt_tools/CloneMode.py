@@ -0,0 +1,114 @@
+from mrt_tools.utilities import write_atomic, get_git_version
+from mrt_tools.settings import user_settings
+import click
+import json
+import sys
+
+# Oldest git, which can create partial clones (git clone --filter)
+FILTER_GIT_VERSION = (2, 19)
+
+
+class CloneMode(object):
+    """
+    How much of a repo is cloned.
+
+    A shallow clone (git clone --depth) only contains the last commits, a partial clone (git clone --filter) only
+    fetches the objects, which match the filter, e.g. no blobs with 'blob:none'. Missing blobs are downloaded by git on
+    demand, as soon as a commit is checked out that needs them. Both can be turned into a full clone later.
+    """
+
+    def __init__(self, depth=None, blob_filter=None):
+        """
+        :param depth: Number of commits to clone, None or 0 for the full history
+        :param blob_filter: Filter spec of a partial clone, e.g. 'blob:none' or 'blob:limit=1m'
+        """
+        self.depth = depth or None
+        self.blob_filter = blob_filter or None
+
+    def __eq__(self, other):
+        return isinstance(other, CloneMode) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __str__(self):
+        if self.is_full:
+            return "full"
+        parts = []
+        if self.depth:
+            parts.append("depth {}".format(self.depth))
+        if self.blob_filter:
+            parts.append("filter {}".format(self.blob_filter))
+        return ", ".join(parts)
+
+    @property
+    def is_full(self):
+        return not self.depth and not self.blob_filter
+
+    @staticmethod
+    def default():
+        """Clone mode of new repos, if none is requested explicitly"""
+        CloneMode.check_filter_support(user_settings['Gitlab']['CLONE_FILTER'])
+        return CloneMode(user_settings['Gitlab']['CLONE_DEPTH'], user_settings['Gitlab']['CLONE_FILTER'])
+
+    @staticmethod
+    def from_options(depth, blob_filter, full):
+        """
+        Clone mode requested on the command line
+        :return: CloneMode or None, if no option was given
+        """
+        if full:
+            return CloneMode()
+        if depth or blob_filter:
+            CloneMode.check_filter_support(blob_filter)
+            return CloneMode(depth, blob_filter)
+        return None
+
+    @staticmethod
+    def check_filter_support(blob_filter):
+        """Exit with an error if a partial clone is requested, but the installed git cannot create one"""
+        if not blob_filter:
+            return
+        version = get_git_version()
+        if version < FILTER_GIT_VERSION:
+            click.secho("Partial clones (filter {}) need git {} or newer, but git {} is installed. Clone without "
+                        "--filter or clear CLONE_FILTER in the settings.".format(
+                            blob_filter, ".".join(map(str, FILTER_GIT_VERSION)), ".".join(map(str, version))), fg="red")
+            sys.exit(1)
+
+    def get_clone_args(self):
+        """Arguments for git clone"""
+        args = []
+        if self.depth:
+            args += ["--depth", str(self.depth)]
+        if self.blob_filter:
+            args.append("--filter=" + self.blob_filter)
+        return args
+
+    def to_dict(self):
+        return {key: value for key, value in (("depth", self.depth), ("filter", self.blob_filter)) if value}
+
+    @staticmethod
+    def from_dict(data):
+        return CloneMode(data.get("depth"), data.get("filter"))
+
+    @staticmethod
+    def load(filename):
+        """
+        Read the clone modes of a workspace
+        :return: Dict {local name: CloneMode} of all repos, which are not cloned fully
+        """
+        try:
+            with open(filename, "r") as f:
+                return {name: CloneMode.from_dict(data) for name, data in json.load(f).items()}
+        except (IOError, ValueError, AttributeError):
+            return {}
+
+    @staticmethod
+    def save(filename, modes):
+        """
+        Write the clone modes of a workspace
+        :param modes: Dict {local name: CloneMode}. Full clones are not stored.
+        """
+        data = {name: mode.to_dict() for name, mode in modes.items() if not mode.is_full}
+        write_atomic(filename, json.dumps(data, indent=2, sort_keys=True) + "\n")
@@ -0,0 +1,140 @@
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from mrt_tools.utilities import get_job_count
+import click
+import time
+import sys
+
+
+class JobResult(object):
+    """Outcome of one job"""
+
+    def __init__(self, name):
+        self.name = name
+        self.duration = 0.0
+        self.output = None
+        self.error = None
+        self.skipped = False
+
+    @property
+    def success(self):
+        return self.error is None and not self.skipped
+
+
+class DagScheduler(object):
+    """
+    Runs jobs with dependencies between them in parallel.
+
+    A job is started as soon as all of its dependencies finished successfully. Jobs depending on a failed job are
+    skipped. While jobs are running, a status line lists them together with their runtime.
+    """
+
+    def __init__(self, jobs=None, label="build", quiet=False):
+        """
+        :param jobs: Number of parallel jobs, defaults to get_job_count
+        :param label: Prefix of the status output
+        :param quiet: Do not print the status line
+        """
+        self.jobs = jobs or get_job_count()
+        self.label = label
+        self.quiet = quiet
+        self.is_tty = sys.stdout.isatty()
+        self.status_line = ""
+
+    def run(self, dependencies, function):
+        """
+        Run all jobs
+        :param dependencies: Dict {job name: iterable of job names it depends on}. Other dependencies are ignored.
+        :param function: Called with the job name. Its return value is stored as output of the job.
+        :return: Dict {job name: JobResult}
+        """
+        pending = {name: set(deps) & set(dependencies) - {name} for name, deps in dependencies.items()}
+        results = {}
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while pending or running:
+                self.skip_failed_dependents(pending, results)
+                ready = sorted(name for name, deps in pending.items() if not deps - set(results))
+                if not ready and not running and pending:
+                    # Cyclic dependencies, run the remaining jobs in any order
+                    ready = sorted(pending)
+                for name in ready:
+                    del pending[name]
+                    running[executor.submit(self.run_job, function, name)] = (name, time.time())
+                    self.echo("Starting  " + click.style(">>>", fg="green", bold=True) + " " +
+                              click.style(name, fg="cyan", bold=True))
+
+                done, _ = wait(running.keys(), timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, _ = running.pop(future)
+                    result = future.result()
+                    results[name] = result
+                    self.report_result(result)
+                self.update_status(running, len(results), len(dependencies))
+        self.update_status({}, len(results), len(dependencies))
+        return results
+
+    @staticmethod
+    def run_job(function, name):
+        result = JobResult(name)
+        start = time.time()
+        try:
+            result.output = function(name)
+        except Exception as err:
+            result.error = getattr(err, "output", None) or str(err)
+        result.duration = time.time() - start
+        return result
+
+    def skip_failed_dependents(self, pending, results):
+        failed = set(name for name, result in results.items() if not result.success)
+        while failed:
+            skipped = [name for name, deps in pending.items() if deps & failed]
+            for name in skipped:
+                del pending[name]
+                results[name] = JobResult(name)
+                results[name].skipped = True
+                self.echo(click.style("Skipped   ", fg="yellow") + click.style(name, fg="cyan") +
+                          " (a dependency failed)")
+            failed = set(skipped)
+
+    def report_result(self, result):
+        if result.success:
+            self.echo(click.style("Finished  ", fg="black", bold=True) + click.style("<<<", fg="green") + " " +
+                      click.style(result.name, fg="cyan") + " [{:.1f}s]".format(result.duration))
+            if result.output:
+                self.echo(click.style(result.output, fg="yellow"))
+        else:
+            self.echo(click.style("Failed    ", fg="red", bold=True) + click.style("<<<", fg="red") + " " +
+                      click.style(result.name, fg="cyan") + " [{:.1f}s]".format(result.duration))
+            self.echo(result.error)
+
+    def echo(self, message):
+        """Print a message above the status line"""
+        if self.quiet:
+            return
+        if self.is_tty and self.status_line:
+            click.echo("\r\033[K", nl=False)
+        click.echo(message)
+        if self.is_tty and self.status_line:
+            click.echo(self.status_line, nl=False)
+
+    def update_status(self, running, finished, total):
+        """Redraw the status line listing all running jobs"""
+        if self.quiet or not self.is_tty:
+            return
+        now = time.time()
+        jobs = ", ".join("{0} ({1:.0f}s)".format(name, now - start) for name, start in sorted(running.values()))
+        status = "[{0}] {1}/{2} done".format(self.label, finished, total)
+        if jobs:
+            status += " | running: " + jobs
+        width = click.get_terminal_size()[0]
+        self.status_line = status[:width - 1]
+        click.echo("\r\033[K" + self.status_line, nl=not running)
+        if not running:
+            self.status_line = ""
+
+    def print_summary(self, results, count=None):
+        """Print the runtime of every job, slowest first"""
+        click.echo("[{}] Timing summary:".format(self.label))
+        for result in sorted(results.values(), key=lambda r: r.duration, reverse=True)[:count]:
+            state = "skipped" if result.skipped else "failed" if result.error else ""
+            click.echo("  {0:>8.1f}s  {1} {2}".format(result.duration, result.name, state).rstrip())
@@ -0,0 +1,207 @@
+from collections import OrderedDict
+
+# Maps dependency types to the corresponding attributes of catkin_pkg packages
+DEPENDENCY_TYPES = OrderedDict([
+    ("build", "build_depends"),
+    ("build_export", "build_export_depends"),
+    ("buildtool", "buildtool_depends"),
+    ("buildtool_export", "buildtool_export_depends"),
+    ("exec", "exec_depends"),
+    ("test", "test_depends"),
+    ("doc", "doc_depends"),
+])
+
+
+class DependencyGraph(object):
+    """
+    Dependency graph of all packages within a workspace.
+
+    Direct dependencies are stored as adjacency sets per dependency type. Transitive dependencies are computed once
+    for the whole workspace on the condensation of the graph, so diamond shaped or cyclic dependencies are resolved
+    without visiting any package twice.
+    """
+
+    def __init__(self, packages):
+        """
+        :param packages: Dict {path: package} as returned by Workspace.get_catkin_packages()
+        """
+        self.packages = packages
+        self.packages_by_name = {pkg.name: pkg for pkg in packages.values()}
+        self.paths = {pkg.name: path for path, pkg in packages.items()}
+        self.edges = {dep_type: {} for dep_type in DEPENDENCY_TYPES}
+        for name, pkg in self.packages_by_name.items():
+            for dep_type, attribute in DEPENDENCY_TYPES.items():
+                self.edges[dep_type][name] = {d.name for d in getattr(pkg, attribute)}
+        self._adjacency = {}
+        self._closures = {}
+        self._reverse = {}
+
+    @staticmethod
+    def _key(dep_types):
+        if not dep_types:
+            return tuple(DEPENDENCY_TYPES.keys())
+        return tuple(sorted(set(dep_types)))
+
+    def get_adjacency(self, dep_types=None):
+        """
+        Returns the direct dependencies of all workspace packages
+        :param dep_types: List of dependency types to consider, defaults to all
+        :return: Dict {name: set of dependency names}
+        """
+        key = self._key(dep_types)
+        if key not in self._adjacency:
+            adjacency = {name: set() for name in self.packages_by_name}
+            for dep_type in key:
+                for name, deps in self.edges[dep_type].items():
+                    adjacency[name] |= deps
+            self._adjacency[key] = adjacency
+        return self._adjacency[key]
+
+    def is_workspace_package(self, name):
+        return name in self.packages_by_name
+
+    def dependencies(self, name, dep_types=None):
+        """
+        Returns the direct dependencies of a package
+        :param name: Name of package
+        :param dep_types: List of dependency types to consider, defaults to all
+        :return: Set of names
+        """
+        return set(self.get_adjacency(dep_types).get(name, ()))
+
+    def transitive_dependencies(self, name, dep_types=None):
+        """
+        Returns all packages, a package depends on directly or indirectly
+        :param name: Name of package
+        :param dep_types: List of dependency types to consider, defaults to all
+        :return: Set of names
+        """
+        key = self._key(dep_types)
+        if key not in self._closures:
+            self._closures[key] = self._compute_closure(self.get_adjacency(key))
+        return self._closures[key].get(name, set()) - {name}
+
+    def reverse_dependencies(self, name, dep_types=None):
+        """
+        Returns the workspace packages, which directly depend on a package
+        :param name: Name of package
+        :param dep_types: List of dependency types to consider, defaults to all
+        :return: Set of names
+        """
+        key = self._key(dep_types)
+        if key not in self._reverse:
+            reverse = {n: set() for n in self.packages_by_name}
+            for parent, deps in self.get_adjacency(key).items():
+                for dep in deps:
+                    reverse.setdefault(dep, set()).add(parent)
+            self._reverse[key] = reverse
+        return set(self._reverse[key].get(name, ()))
+
+    def subgraph(self, names, dep_types=None):
+        """
+        Returns the adjacency of a set of packages and everything they depend on
+        :param names: List of package names
+        :param dep_types: List of dependency types to consider, defaults to all
+        :return: Dict {name: set of dependency names} for all workspace packages within the subgraph
+        """
+        adjacency = self.get_adjacency(dep_types)
+        nodes = set(names)
+        for name in names:
+            nodes |= self.transitive_dependencies(name, dep_types)
+        return {n: set(adjacency[n]) for n in nodes if n in adjacency}
+
+    def to_tree(self, name, dep_types=None):
+        """
+        Returns the dependencies of a package as nested dicts {name: {dependency: {...}}}.
+        Subtrees of packages that are reached several times are shared, cycles are cut.
+        :param name: Name of package
+        :param dep_types: List of dependency types to consider, defaults to all
+        """
+        adjacency = self.get_adjacency(dep_types)
+        trees = {}
+        in_progress = set()
+
+        def subtree(node):
+            if node in trees:
+                return trees[node]
+            if node in in_progress:
+                return {}
+            in_progress.add(node)
+            tree = {dep: subtree(dep) for dep in adjacency.get(node, ())}
+            in_progress.discard(node)
+            trees[node] = tree
+            return tree
+
+        return {name: subtree(name)}
+
+    @staticmethod
+    def _compute_closure(adjacency):
+        """
+        Computes the transitive closure for all nodes.
+        Strongly connected components are found first, so that each component is only processed once, after all
+        components it depends on.
+        """
+        closure = {}
+        for component in DependencyGraph._strongly_connected_components(adjacency):
+            reachable = set()
+            for node in component:
+                for dep in adjacency[node]:
+                    reachable.add(dep)
+                    if dep not in component:
+                        reachable |= closure.get(dep, set())
+            for node in component:
+                closure[node] = reachable
+        return closure
+
+    @staticmethod
+    def _strongly_connected_components(adjacency):
+        """
+        Tarjan's algorithm without recursion. Nodes not within adjacency are ignored.
+        :return: List of sets, in reverse topological order (dependencies first)
+        """
+        index = {}
+        lowlink = {}
+        stack = []
+        on_stack = set()
+        components = []
+        counter = 0
+
+        for root in adjacency:
+            if root in index:
+                continue
+            index[root] = lowlink[root] = counter
+            counter += 1
+            stack.append(root)
+            on_stack.add(root)
+            work = [(root, iter(adjacency[root]))]
+
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in adjacency:
+                        continue
+                    if child not in index:
+                        index[child] = lowlink[child] = counter
+                        counter += 1
+                        stack.append(child)
+                        on_stack.add(child)
+                        work.append((child, iter(adjacency[child])))
+                        break
+                    elif child in on_stack:
+                        lowlink[node] = min(lowlink[node], index[child])
+                else:
+                    # All children visited
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        lowlink[parent] = min(lowlink[parent], lowlink[node])
+                    if lowlink[node] == index[node]:
+                        component = set()
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.add(member)
+                            if member == node:
+                                break
+                        components.append(component)
+        return components
@@ -0,0 +1,179 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from mrt_tools.utilities import write_atomic
+import cPickle as pickle
+import threading
+import click
+import time
+import os
+
+MANIFEST_FILE = ".manifest"
+
+
+class RepoResult(object):
+    """Outcome of downloading the package.xml files of one repository"""
+
+    def __init__(self, name, prefix):
+        self.name = name
+        self.prefix = prefix
+        self.duration = 0.0
+        self.downloaded = 0
+        self.unchanged = 0
+        self.bytes = 0
+        self.error = None
+
+
+class DepsDownloader(object):
+    """
+    Downloads the package.xml of every branch of every repo into a local directory.
+
+    The blob SHA of each file is taken from the tree API and remembered in a manifest. Files whose SHA did not change
+    are not downloaded again, so an interrupted or repeated run only transfers what changed. Repos are processed by a
+    bounded pool of worker threads, which share the connection pool of the http backend.
+    """
+
+    def __init__(self, cache, target_dir, jobs=10, retries=3):
+        """
+        :param cache: GitlabCache, providing api access and cached branch lists
+        :param target_dir: Directory to write the files to
+        :param jobs: Number of concurrent requests
+        :param retries: How often to retry failed requests
+        """
+        self.cache = cache
+        self.backend = cache.backend
+        self.target_dir = target_dir
+        self.jobs = jobs
+        self.retries = retries
+        self.manifest_file = os.path.join(target_dir, MANIFEST_FILE)
+        self.manifest = self.load_manifest()
+        self.lock = threading.Lock()
+
+    def load_manifest(self):
+        """
+        :return: Dict {relative file path: blob sha}
+        """
+        try:
+            with open(self.manifest_file, "rb") as f:
+                return pickle.load(f)
+        except Exception:  # Without manifest everything is downloaded again
+            return {}
+
+    def save_manifest(self):
+        write_atomic(self.manifest_file, pickle.dumps(self.manifest, pickle.HIGHEST_PROTOCOL))
+
+    def request(self, method, resource, params=None):
+        """Send a request to the api, retrying on network and server errors"""
+        url = "{0}/{1}".format(self.cache.api_url, resource)
+        attempt = 0
+        while True:
+            try:
+                status, _, body = method(url, params=params, headers=self.cache.headers, auth=self.cache.auth)
+                if status < 500:
+                    return status, body
+                if attempt == self.retries:
+                    raise IOError("HTTP status {0} for {1}".format(status, resource))
+            except (IOError, ValueError):  # ValueError: Body is no json, e.g. the html error page of a proxy
+                if attempt == self.retries:
+                    raise
+            attempt += 1
+            time.sleep(2 ** attempt)
+
+    def update_repo(self, repo):
+        """
+        Download the changed package.xml files of all branches of a repo
+        :param repo: Project dict of gitlab
+        :return: Tuple (RepoResult, set of relative paths of all package.xml files of this repo)
+        """
+        result = RepoResult(repo['path_with_namespace'], os.path.join(repo['namespace']['name'], repo['name'], ""))
+        paths = set()
+        start = time.time()
+        try:
+            branches = self.cache.get_branches(repo['id'], max_age=0)
+            for branch in branches:
+                status, tree = self.request(self.backend.get, "projects/{}/repository/tree".format(repo['id']),
+                                            params={"ref_name": branch['name']})
+                if status != 200:
+                    continue  # Empty repo
+                sha = next((entry['id'] for entry in tree if entry['name'] == "package.xml" and
+                            entry['type'] == "blob"), None)
+                if sha is None:
+                    continue  # No catkin package on this branch
+
+                path = os.path.join(result.prefix, branch['name'], "package.xml")
+                paths.add(path)
+                with self.lock:
+                    unchanged = self.manifest.get(path) == sha
+                if unchanged and os.path.exists(os.path.join(self.target_dir, path)):
+                    result.unchanged += 1
+                    continue
+
+                status, content = self.request(self.backend.get_raw,
+                                               "projects/{0}/repository/raw_blobs/{1}".format(repo['id'], sha))
+                if status != 200:
+                    raise IOError("HTTP status {0} for {1}".format(status, path))
+                write_atomic(os.path.join(self.target_dir, path), content)
+                with self.lock:
+                    self.manifest[path] = sha
+                result.downloaded += 1
+                result.bytes += len(content)
+        except (IOError, ValueError) as err:
+            result.error = str(err)
+            paths = None
+        result.duration = time.time() - start
+        return result, paths
+
+    def run(self, repos):
+        """
+        Update the package.xml files of several repos
+        :param repos: List of project dicts of gitlab
+        :return: List of RepoResults
+        """
+        results = []
+        keep = set()
+        failed_prefixes = []
+        start = time.time()
+        try:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                futures = [executor.submit(self.update_repo, repo) for repo in repos]
+                with click.progressbar(as_completed(futures), length=len(futures)) as bar:
+                    for future in bar:
+                        result, paths = future.result()
+                        results.append(result)
+                        if paths is None:
+                            failed_prefixes.append(result.prefix)
+                        else:
+                            keep |= paths
+            self.remove_stale_files(keep, failed_prefixes)
+        finally:
+            # Everything downloaded so far is kept, even if the run was interrupted
+            self.save_manifest()
+        self.print_summary(results, time.time() - start)
+        return results
+
+    def remove_stale_files(self, keep, failed_prefixes):
+        """Remove files of branches and repos, which do not exist anymore"""
+        for path in list(self.manifest):
+            if path in keep or any(path.startswith(prefix) for prefix in failed_prefixes):
+                continue
+            del self.manifest[path]
+            try:
+                os.remove(os.path.join(self.target_dir, path))
+            except OSError:
+                pass
+
+    def print_summary(self, results, wall_time, count=5):
+        downloaded = sum(r.downloaded for r in results)
+        unchanged = sum(r.unchanged for r in results)
+        total = downloaded + unchanged
+        click.echo("")
+        click.echo("Processed {0} repos in {1:.1f}s".format(len(results), wall_time))
+        click.echo("Downloaded {0} files ({1} bytes), {2} files unchanged, cache hit rate {3:.0f}%".format(
+            downloaded, sum(r.bytes for r in results), unchanged, 100.0 * unchanged / total if total else 0))
+        click.echo("Transferred {} bytes in total".format(getattr(self.backend, "bytes_received", 0)))
+        click.echo("Slowest repos:")
+        for r in sorted(results, key=lambda r: r.duration, reverse=True)[:count]:
+            click.echo("  {0:.1f}s {1}".format(r.duration, r.name))
+        failed = sorted(r.name for r in results if r.error)
+        if failed:
+            click.echo("Skipped the following repos:")
+            for name in failed:
+                click.echo("- {}".format(name))
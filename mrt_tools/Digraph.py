@@ -8,9 +8,14 @@ import sys
 
 class Digraph(object):
     def __init__(self, deps, no_leafs=False):
+        """
+        :param deps: Dict {package: set of dependencies}. Dependencies which are no keys themselves are leafs.
+        :param no_leafs: Do not draw leafs
+        """
         # create a graph object
         self.graph = pydot.Dot(graph_type='digraph')
-        self.nodes = None
+        self.nodes = {}
+        self.edges = set()
         self.no_leafs = no_leafs
         # add nodes and edges to the root node
         sys.stdout.write("Creating graph")
@@ -23,6 +28,7 @@ class Digraph(object):
         else:
             node = pydot.Node(name, style="filled", fillcolor="green")
         self.graph.add_node(node)
+        self.nodes[name] = node
         return node
 
     def get_node(self, name, isleaf=False):
@@ -30,32 +36,23 @@ class Digraph(object):
         :param isleaf: Defines wether this Node has further children
         :param name: Name of node
         """
-
-        # check all of the graph nodes
-        for node in self.graph.get_nodes():
-            if name == node.get_name():
-                return node
-
+        if name in self.nodes:
+            return self.nodes[name]
         return self.create_node(name, isleaf=isleaf)
 
-    def add_nodes(self, deps, parent=None):
+    def add_nodes(self, deps):
         """Add several nodes
         :param deps: Dictionary of Dependencies
-        :param parent: The parent node to this dep
         """
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        for k, v in deps.iteritems():
-            if v:  # if the dict is not empty, then recurse
-                node = self.get_node(k, isleaf=False)
-                self.add_edge(parent, node)
-                self.add_nodes(v, parent=node)
-            else:
-                if self.no_leafs:
-                    pass
-                else:
-                    node = self.get_node(k, isleaf=True)
-                    self.add_edge(parent, node)
+        for name in sorted(deps):
+            sys.stdout.write('.')
+            sys.stdout.flush()
+            parent = self.get_node(name, isleaf=False)
+            for child in sorted(deps[name]):
+                if child in deps:
+                    self.add_edge(parent, self.get_node(child, isleaf=False))
+                elif not self.no_leafs:
+                    self.add_edge(parent, self.get_node(child, isleaf=True))
 
     def add_edge(self, a, b):
         """checks if the edge already exists, if not, creates one from a2b
@@ -64,12 +61,9 @@ class Digraph(object):
         """
         if a is None or b is None:
             return
-        for edge_obj in self.graph.get_edge_list():
-            if a.get_name() in edge_obj.obj_dict["points"] and \
-                            b.get_name() in edge_obj.obj_dict["points"]:
-                break
-        else:
+        if (a.get_name(), b.get_name()) not in self.edges:
             # such an edge doesn't exist. create it
+            self.edges.add((a.get_name(), b.get_name()))
             self.graph.add_edge(pydot.Edge(a, b))
 
     def plot(self, pkg_name, show=True):
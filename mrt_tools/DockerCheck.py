@@ -1,18 +1,39 @@
+from mrt_tools.MirrorCache import MirrorCache
+from mrt_tools.settings import user_settings
 import subprocess
+import shutil
 import os
 import pwd
 import grp
 
 
 def pkg(package_name):
-    _start_docker("mrt_build_check_pkg", [package_name])
+    # Share the mirror cache with the container, so that mrt tools inside clone from it
+    mirror_dir = MirrorCache().directory
+    _start_docker("mrt_build_check_pkg", [package_name], [(mirror_dir, "/tmp/mrt_mirrors")],
+                  {"MRT_MIRROR_DIR": "/tmp/mrt_mirrors"})
 
 
-def ws(workspace_folder, build_parameters = []):
-    _start_docker("mrt_build_check_ws", [workspace_folder] + build_parameters, [(os.path.join(workspace_folder, "src"), "/tmp/ws/src", "ro")])
+def ws(workspace_folder, build_parameters = [], clean=False):
+    # The build tree and ccache are kept between checks, so that only changed packages are compiled again
+    check_dir = os.path.join(workspace_folder, ".mrt_check")
+    if clean:
+        shutil.rmtree(check_dir, ignore_errors=True)
+    mounts = [(os.path.join(workspace_folder, "src"), "/tmp/ws/src", "ro")]
+    for name in ("build", "devel", "logs"):
+        mounts.append((_make_dir(os.path.join(check_dir, name)), "/tmp/ws/" + name))
+    mounts.append((_make_dir(user_settings['Check']['CCACHE_DIR']), "/tmp/ccache"))
+    _start_docker("mrt_build_check_ws", [workspace_folder] + build_parameters, mounts, {"CCACHE_DIR": "/tmp/ccache"})
 
 
-def _start_docker(docker_name, parameters, mounts = []):
+def _make_dir(path):
+    # Created before docker does, so that it belongs to the user
+    if not os.path.exists(path):
+        os.makedirs(path)
+    return path
+
+
+def _start_docker(docker_name, parameters, mounts = [], environment = {}):
     user_data = pwd.getpwuid(os.getuid())
     group_data = grp.getgrgid(user_data.pw_gid)
     user_parameters = [str(user_data.pw_uid), user_data.pw_name, str(user_data.pw_gid), group_data.gr_name]
@@ -30,8 +51,12 @@ def _start_docker(docker_name, parameters, mounts = []):
             
         mount_string += ["-v", s]
        
-    exec_string = ["sudo", "docker", "run", "-ti"] + cuda_device_string + mount_string + ["--rm=true", docker_name] + \
-                  user_parameters + parameters
+    env_string = []
+    for key, value in sorted(environment.items()):
+        env_string += ["-e", key + "=" + value]
+
+    exec_string = ["sudo", "docker", "run", "-ti"] + cuda_device_string + mount_string + env_string + \
+                  ["--rm=true", docker_name] + user_parameters + parameters
 
     # execute docker
     subprocess.check_call(exec_string)
@@ -3,6 +3,7 @@ from simplejson.scanner import JSONDecodeError
 from requests.exceptions import ConnectionError
 from mrt_tools.utilities import get_user_choice, get_gituserinfo
 from mrt_tools.settings import user_settings
+from mrt_tools.GitlabCache import GitlabCache, RequestsBackend
 from Crypto.PublicKey import RSA
 from builtins import object
 from builtins import next
@@ -21,6 +22,7 @@ class Git(object):
         self.use_ssh = user_settings['SSH']['USE_SSH']
         self.token = cm.credentialManager.get_token()
         self.server = None
+        self.cache = None
         self.ssh_key = None
 
         if quiet:
@@ -96,6 +98,11 @@ class Git(object):
                         click.secho("Created gitlab token: {}".format(self.token), fg="green")
                     cm.credentialManager.store('token', self.token)
 
+            # Metadata like project lists is served from a local cache
+            backend = RequestsBackend(verify=self.server.verify_ssl)
+            self.cache = GitlabCache(self.server.api_url, headers=getattr(self.server, "headers", None),
+                                     auth=getattr(self.server, "auth", None), backend=backend)
+
         except gitlab.exceptions.HttpError:
             click.secho("There was a problem logging in to gitlab. Did you use your correct credentials?", fg="red")
             sys.exit(1)
@@ -124,17 +131,42 @@ class Git(object):
     def get_namespaces(self):
         """Returns a dict {name:id} of all namespaces in Gitlab"""
         click.echo("Retrieving namespaces...")
-        namespaces = list(self.server.getall(self.server.getgroups, per_page=100))
-        namespaces = sorted(namespaces, key=lambda k: k['name'])
-        user_name = self.server.currentuser()['username']
+        namespaces = sorted(self.get_groups(), key=lambda k: k['name'])
+        user_name = self.get_current_user()['username']
         namespace_dict = {ns['name']: ns['id'] for ns in namespaces}
         if user_name not in list(namespace_dict.keys()):
             namespace_dict[user_name] = 0
         return namespace_dict
 
-    def get_repos(self):
+    def get_cached(self, getter, *args, **kwargs):
+        """Call a getter of the metadata cache and exit, if the server could not be reached
+        :param getter: Method of the GitlabCache
+        """
+        try:
+            return getter(*args, **kwargs)
+        except IOError as err:
+            click.secho("Could not retrieve data from gitlab: {}".format(err), fg="red")
+            sys.exit(1)
+
+    def get_repos(self, **kwargs):
         """Returns a list of all repositories in Gitlab"""
-        return list(self.server.getall(self.server.getprojects, per_page=100))
+        return self.get_cached(self.cache.get_projects, **kwargs)
+
+    def get_groups(self, **kwargs):
+        """Returns a list of all groups in Gitlab"""
+        return self.get_cached(self.cache.get_groups, **kwargs)
+
+    def get_users(self, **kwargs):
+        """Returns a list of all users in Gitlab"""
+        return self.get_cached(self.cache.get_users, **kwargs)
+
+    def get_branches(self, repo_id, **kwargs):
+        """Returns a list of all branches of a repository"""
+        return self.get_cached(self.cache.get_branches, repo_id, **kwargs)
+
+    def get_current_user(self):
+        """Returns the logged in user"""
+        return self.get_cached(self.cache.get_current_user)
 
     def find_repo(self, pkg_name, ns=None):
         """Search for a repository within gitlab.
@@ -142,8 +174,11 @@ class Git(object):
         :param pkg_name: Name of the repo
         """
         click.secho("Search for package " + pkg_name, fg='red')
-        # Results is a dict or a list of dicts, depending on how many results were found
-        results = list(self.server.getall(self.server.searchproject, pkg_name, per_page=100))
+        # Look into the cached projects of the user first, then search all visible projects
+        results = [r for r in self.get_repos() if r["name"] == pkg_name and
+                   (not ns or r["path_with_namespace"] == str(ns) + "/" + pkg_name)]
+        if not results:
+            results = self.get_cached(self.cache.search_projects, pkg_name)
 
         # If we declared a namespace, there will only be one result with this name in this namespace
         if ns:
@@ -201,6 +236,7 @@ class Git(object):
         if not response:
             click.secho("There was a problem with creating the repo.", fg='red')
             sys.exit(1)
+        self.cache.evict("projects")
 
         # Return URL
         click.echo("Repository URL is: " + response[self.get_url_string()])
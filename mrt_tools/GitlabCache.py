@@ -0,0 +1,222 @@
+from mrt_tools.utilities import write_atomic
+from mrt_tools.settings import user_settings
+import cPickle as pickle
+import threading
+import hashlib
+import urllib
+import click
+import time
+import os
+
+CACHE_VERSION = 1
+
+
+class RequestsBackend(object):
+    """HTTP backend, which sends requests with the requests library"""
+
+    def __init__(self, verify=True, timeout=30, pool_size=10):
+        """
+        :param verify: Verify ssl certificates
+        :param timeout: Timeout of requests in seconds
+        :param pool_size: Maximum number of connections kept open to the server
+        """
+        import requests
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.verify = verify
+        self.timeout = timeout
+        self.bytes_received = 0
+        self.lock = threading.Lock()
+
+    def request(self, url, params=None, headers=None, auth=None):
+        response = self.session.get(url, params=params, headers=headers, auth=auth, verify=self.verify,
+                                    timeout=self.timeout)
+        with self.lock:
+            self.bytes_received += len(response.content)
+        return response
+
+    def get(self, url, params=None, headers=None, auth=None):
+        """
+        Send a GET request
+        :return: Tuple (status code, response headers, decoded json body or None)
+        """
+        response = self.request(url, params=params, headers=headers, auth=auth)
+        body = response.json() if response.status_code == 200 else None
+        return response.status_code, response.headers, body
+
+    def get_raw(self, url, params=None, headers=None, auth=None):
+        """
+        Send a GET request
+        :return: Tuple (status code, response headers, raw body)
+        """
+        response = self.request(url, params=params, headers=headers, auth=auth)
+        return response.status_code, response.headers, response.content
+
+
+class GitlabCache(object):
+    """
+    Persistent cache for paginated Gitlab API collections (projects, groups, users, branches...).
+
+    Collections younger than the TTL are served without any request. Older ones are revalidated page by page with
+    conditional requests (If-None-Match), so unchanged pages are not transferred again. If the server can not be
+    reached, stale data is served as long as there is any.
+    """
+
+    def __init__(self, api_url, headers=None, auth=None, cache_dir=None, ttl=None, backend=None, per_page=100):
+        """
+        :param api_url: Base url of the api, e.g. https://host/api/v3
+        :param headers: Headers sent with every request, e.g. the private token
+        :param auth: Optional (username, password) tuple
+        :param cache_dir: Directory to store cached collections in
+        :param ttl: Time in seconds, for which cached collections are used without revalidation
+        :param backend: Object with a get(url, params, headers, auth) method, defaults to RequestsBackend
+        :param per_page: Page size of requests
+        """
+        self.api_url = api_url.rstrip("/")
+        self.headers = dict(headers or {})
+        self.auth = auth
+        self.cache_dir = cache_dir or user_settings['Cache']['GITLAB_CACHE_DIR']
+        self.ttl = user_settings['Cache']['GITLAB_CACHE_TTL'] if ttl is None else ttl
+        self.backend = backend or RequestsBackend()
+        self.per_page = per_page
+        self.requests = 0
+        self.not_modified = 0
+
+        # Different users see different data, so the cache entries are separated by credentials
+        identity = repr(sorted(self.headers.items())) + repr(auth)
+        self.identity = hashlib.md5(self.api_url + identity).hexdigest()[:12]
+
+    def get_filename(self, resource, params):
+        """Returns the file in which a collection is cached"""
+        query = urllib.urlencode(sorted((params or {}).items()))
+        name = resource.strip("/").replace("/", "_")
+        return os.path.join(self.cache_dir, "{0}-{1}".format(
+            name, hashlib.md5(self.identity + resource + query).hexdigest()))
+
+    def load(self, filename):
+        try:
+            with open(filename, "rb") as f:
+                entry = pickle.load(f)
+            if entry["version"] == CACHE_VERSION:
+                return entry
+        except Exception:  # Missing or corrupt cache files are simply ignored
+            pass
+        return None
+
+    def save(self, filename, entry):
+        try:
+            # Only readable by the user, private projects are cached as well
+            write_atomic(filename, pickle.dumps(entry, pickle.HIGHEST_PROTOCOL), mode=0o600)
+        except (IOError, OSError):
+            pass
+
+    def get_all(self, resource, max_age=None, **params):
+        """
+        Returns all items of a paginated collection
+        :param resource: Path relative to the api url, e.g. "projects"
+        :param max_age: Overrides the TTL for this call. 0 forces revalidation.
+        :param params: Additional query parameters
+        :return: List of items
+        """
+        filename = self.get_filename(resource, params)
+        entry = self.load(filename)
+        max_age = self.ttl if max_age is None else max_age
+        if entry is not None and time.time() - entry["time"] < max_age:
+            return [item for page in entry["pages"] for item in page["items"]]
+
+        old_pages = entry["pages"] if entry else []
+        try:
+            pages = self.fetch_pages(resource, params, old_pages)
+        except IOError as err:
+            if entry is None:
+                raise
+            click.secho("Could not reach Gitlab ({}), using cached data.".format(err), fg="yellow")
+            return [item for page in old_pages for item in page["items"]]
+
+        self.save(filename, {"version": CACHE_VERSION, "time": time.time(), "pages": pages})
+        return [item for page in pages for item in page["items"]]
+
+    def fetch_pages(self, resource, params, old_pages):
+        """
+        Download all pages of a collection, revalidating already known pages
+        :return: List of pages {"etag":..., "items":...}
+        """
+        url = "{0}/{1}".format(self.api_url, resource.strip("/"))
+        pages = []
+        page_number = 1
+        while True:
+            headers = dict(self.headers)
+            old_page = old_pages[page_number - 1] if page_number <= len(old_pages) else None
+            if old_page is not None and old_page["etag"]:
+                headers["If-None-Match"] = old_page["etag"]
+
+            query = dict(params, page=page_number, per_page=self.per_page)
+            status, response_headers, body = self.backend.get(url, params=query, headers=headers, auth=self.auth)
+            self.requests += 1
+            if status == 304 and old_page is not None:
+                self.not_modified += 1
+                page = old_page
+            elif status == 200:
+                items = [body] if isinstance(body, dict) else body or []
+                page = {"etag": response_headers.get("ETag"), "items": items}
+            else:
+                raise IOError("HTTP status {0} for {1}".format(status, resource))
+            pages.append(page)
+
+            # Gitlab announces the next page, older versions are recognized by incomplete pages
+            next_page = response_headers.get("X-Next-Page")
+            if next_page is not None and status == 200:
+                if not next_page:
+                    break
+            elif len(page["items"]) < self.per_page:
+                break
+            page_number += 1
+        return pages
+
+    def evict(self, resource=None):
+        """
+        Remove cached collections
+        :param resource: Only remove this resource and the collections below it, e.g. "projects". All if not given.
+        :return: Number of removed collections
+        """
+        name = resource.strip("/").replace("/", "_") if resource else None
+        removed = 0
+        try:
+            filenames = os.listdir(self.cache_dir)
+        except OSError:
+            return 0
+        for filename in filenames:
+            if name is None or filename.startswith(name + "-") or filename.startswith(name + "_"):
+                try:
+                    os.remove(os.path.join(self.cache_dir, filename))
+                    removed += 1
+                except OSError:
+                    pass
+        return removed
+
+    def get_projects(self, **kwargs):
+        return self.get_all("projects", **kwargs)
+
+    def get_groups(self, **kwargs):
+        return self.get_all("groups", **kwargs)
+
+    def get_users(self, **kwargs):
+        return self.get_all("users", **kwargs)
+
+    def get_branches(self, project_id, **kwargs):
+        return self.get_all("projects/{}/repository/branches".format(project_id), **kwargs)
+
+    def search_projects(self, query, **kwargs):
+        return self.get_all("projects/search/{}".format(urllib.quote(query, safe="")), **kwargs)
+
+    def get_current_user(self):
+        """Returns the user belonging to the token. It is not cached, as the response contains the private token."""
+        status, _, body = self.backend.get("{}/user".format(self.api_url), headers=self.headers, auth=self.auth)
+        self.requests += 1
+        if status != 200:
+            raise IOError("HTTP status {} for user".format(status))
+        user = dict(body or {})
+        user.pop("private_token", None)
+        return user or None
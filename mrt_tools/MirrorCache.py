@@ -0,0 +1,229 @@
+from mrt_tools.UpdateScheduler import UpdateScheduler
+from mrt_tools.utilities import write_atomic
+from mrt_tools.settings import user_settings
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import subprocess
+import threading
+import shutil
+import fcntl
+import json
+import time
+import os
+
+LAST_USED_FILE = "mrt_last_used"
+LAST_REFRESH_FILE = "mrt_last_refresh"
+STATS_FILE = "stats.json"
+REFRESH_JOBS = 4  # Number of mirrors refreshed in parallel
+
+
+class MirrorCache(object):
+    """
+    Machine wide cache of bare git mirrors, which clones use as reference.
+
+    Every repo is mirrored once (git clone --mirror) and clones of all workspaces take their objects from the mirror,
+    so they are downloaded only once. Mirrors older than MIRROR_REFRESH_AGE are fetched again in the background. If the
+    cache grows beyond MIRROR_MAX_SIZE_MB, the least recently used mirrors are removed.
+
+    Each mirror has a lock file: clones hold a shared lock while they read from a mirror, creating and removing a
+    mirror requires an exclusive lock. Lock files are never removed, another process could hold a lock on the removed
+    file while a third one locks a new file with the same name.
+    """
+
+    def __init__(self, directory=None, max_size=None, refresh_age=None, background_refresh=True):
+        """
+        :param directory: Directory of the mirrors, defaults to $MRT_MIRROR_DIR or the setting MIRROR_DIR
+        :param max_size: Size in MB, above which cold mirrors are evicted
+        :param refresh_age: Time in seconds, after which a mirror is refreshed
+        :param background_refresh: Refresh old mirrors in a background process, instead of not at all
+        """
+        self.directory = directory or os.environ.get("MRT_MIRROR_DIR") or user_settings['Cache']['MIRROR_DIR']
+        self.max_size = (user_settings['Cache']['MIRROR_MAX_SIZE_MB'] if max_size is None else max_size) * 1024 ** 2
+        self.refresh_age = user_settings['Cache']['MIRROR_REFRESH_AGE'] if refresh_age is None else refresh_age
+        self.background_refresh = background_refresh
+        self.stale = set()  # Uris of used mirrors, which are due for a refresh
+        self.stale_lock = threading.Lock()
+        self.env = UpdateScheduler.get_git_env()
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+
+    def get_path(self, uri):
+        """Returns the directory of the mirror of a repo"""
+        parts = [p for p in UpdateScheduler.get_repo_key(uri).replace(":", "_").split("/") if p not in ("", ".", "..")]
+        return os.path.join(self.directory, *parts) + ".git"
+
+    @contextmanager
+    def lock(self, path, exclusive=False, blocking=True):
+        """
+        Lock a mirror
+        :return: Context manager yielding True, if the lock was acquired
+        """
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            if not os.path.isdir(os.path.dirname(path)):
+                raise  # Otherwise created by a concurrent clone
+        with open(path + ".lock", "a") as f:
+            flags = (fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH) | (0 if blocking else fcntl.LOCK_NB)
+            try:
+                fcntl.flock(f, flags)
+            except IOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @contextmanager
+    def use(self, uri, create=True):
+        """
+        Provide the mirror of a repo as reference for a clone. The mirror is created if necessary.
+        :param uri: Url of the repo
+        :param create: Create a missing mirror. Shallow and partial clones pass False, as creating the mirror would
+                       download the full history.
+        :return: Context manager yielding the path of the mirror, or None if it could not be created
+        """
+        path = self.get_path(uri)
+        hit = os.path.isdir(path)
+        if not hit and create:
+            hit = None if self.create(uri) else False
+        with self.lock(path):
+            if not os.path.isdir(path):
+                self.count("misses")
+                yield None
+                return
+            self.count("hits" if hit else "misses")
+            self.touch(path)
+            if hit and self.background_refresh and time.time() - self.get_last_refresh(path) > self.refresh_age:
+                with self.stale_lock:
+                    self.stale.add(uri)
+            yield path
+        if hit is None:
+            self.evict()
+
+    def create(self, uri):
+        """
+        Create the mirror of a repo
+        :return: True if the mirror exists afterwards
+        """
+        path = self.get_path(uri)
+        with self.lock(path, exclusive=True):
+            if os.path.isdir(path):
+                return True  # Created by another process meanwhile
+            tmp_path = path + ".tmp"
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            with open(os.devnull, "w") as devnull:
+                if subprocess.call(["git", "clone", "--quiet", "--mirror", uri, tmp_path], stdout=devnull,
+                                   stderr=devnull, env=self.env) != 0:
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    return False
+            os.rename(tmp_path, path)
+            self.touch(path)
+            self.touch(path, LAST_REFRESH_FILE)
+            return True
+
+    def refresh(self, uri):
+        """
+        Fetch new objects into the mirror of a repo. Does nothing, if another refresh is running.
+        :return: True if the mirror was refreshed
+        """
+        path = self.get_path(uri)
+        with self.lock(path + ".refresh", exclusive=True, blocking=False) as acquired:
+            if not acquired:
+                return False
+            with self.lock(path):
+                if not os.path.isdir(path):
+                    return False
+                with open(os.devnull, "w") as devnull:
+                    success = subprocess.call(["git", "--git-dir", path, "remote", "update", "--prune"],
+                                              stdout=devnull, stderr=devnull, env=self.env) == 0
+                if success:
+                    self.count("refreshes")
+                    self.touch(path, LAST_REFRESH_FILE)
+                return success
+
+    def refresh_all(self, uris, jobs=REFRESH_JOBS):
+        """
+        Refresh several mirrors in parallel
+        :return: Number of refreshed mirrors
+        """
+        if not uris:
+            return 0
+        with ThreadPoolExecutor(max_workers=min(jobs, len(uris))) as executor:
+            return sum(executor.map(self.refresh, uris))
+
+    def start_refresh(self):
+        """Refresh all stale mirrors, which were used since the last call, in one background process"""
+        with self.stale_lock:
+            uris = sorted(self.stale)
+            self.stale.clear()
+        if not uris:
+            return
+        devnull = open(os.devnull, 'wb')
+        subprocess.Popen(["mrt", "maintenance", "mirror", "refresh", "--quiet"] + uris, stdin=devnull, stdout=devnull,
+                         stderr=devnull, env=dict(os.environ, MRT_MIRROR_DIR=self.directory))
+
+    @staticmethod
+    def get_last_refresh(path):
+        try:
+            return os.path.getmtime(os.path.join(path, LAST_REFRESH_FILE))
+        except OSError:
+            return 0
+
+    @staticmethod
+    def touch(path, filename=LAST_USED_FILE):
+        with open(os.path.join(path, filename), "a"):
+            os.utime(os.path.join(path, filename), None)
+
+    def get_mirrors(self):
+        """
+        :return: List of tuples (path, size in bytes, last use), least recently used first
+        """
+        mirrors = []
+        for root, dirs, files in os.walk(self.directory):
+            for name in [d for d in dirs if d.endswith(".git")]:
+                path = os.path.join(root, name)
+                dirs.remove(name)
+                size = sum(os.path.getsize(os.path.join(r, f)) for r, _, fs in os.walk(path) for f in fs)
+                last_used = os.path.join(path, LAST_USED_FILE)
+                mirrors.append((path, size, os.path.getmtime(last_used if os.path.exists(last_used) else path)))
+        return sorted(mirrors, key=lambda m: m[2])
+
+    def evict(self, max_size=None):
+        """
+        Remove least recently used mirrors, until the cache is smaller than max_size. Mirrors in use are kept.
+        :param max_size: Size in bytes, defaults to MIRROR_MAX_SIZE_MB
+        :return: List of removed mirrors
+        """
+        max_size = self.max_size if max_size is None else max_size
+        mirrors = self.get_mirrors()
+        total = sum(size for _, size, _ in mirrors)
+        removed = []
+        for path, size, _ in mirrors:
+            if total <= max_size:
+                break
+            with self.lock(path, exclusive=True, blocking=False) as acquired:
+                if not acquired:
+                    continue
+                shutil.rmtree(path, ignore_errors=True)
+            total -= size
+            removed.append(path)
+        return removed
+
+    def count(self, key):
+        """Increment a counter of the statistics"""
+        with self.lock(os.path.join(self.directory, STATS_FILE), exclusive=True):
+            stats = self.get_stats()
+            stats[key] = stats.get(key, 0) + 1
+            write_atomic(os.path.join(self.directory, STATS_FILE), json.dumps(stats))
+
+    def get_stats(self):
+        """
+        :return: Dict with the counters hits, misses and refreshes
+        """
+        try:
+            with open(os.path.join(self.directory, STATS_FILE)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
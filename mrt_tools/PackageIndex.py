@@ -0,0 +1,91 @@
+from mrt_tools.utilities import write_atomic, get_workspace_cache_dir
+from catkin_pkg.package import parse_package, PACKAGE_MANIFEST_FILENAME
+from catkin_pkg.packages import find_package_paths
+import cPickle as pickle
+import os
+
+INDEX_VERSION = 1
+
+
+class PackageIndex(object):
+    """
+    Persistent index of all parsed package.xml files within a workspace.
+
+    Parsed manifests are stored on disk, keyed by their path relative to the src folder together with the mtime and
+    size of the manifest file. Only manifests that changed since the last invocation are parsed again.
+    """
+
+    def __init__(self, ws_root, src):
+        """
+        :param ws_root: Root directory of the workspace
+        :param src: Source folder of the workspace
+        """
+        self.filename = os.path.join(get_workspace_cache_dir(ws_root), "package_index")
+        self.src = os.path.abspath(src)
+        self.hits = 0
+        self.misses = 0
+        self.entries = self.load()
+
+    def load(self):
+        """
+        Read in index from file
+        :return: Dict {relative path: (stat key, package)}
+        """
+        try:
+            with open(self.filename, "rb") as f:
+                version, src, entries = pickle.load(f)
+            if version == INDEX_VERSION and src == self.src:
+                return entries
+        except Exception:  # Missing or corrupt index files are simply rebuilt
+            pass
+        return {}
+
+    def save(self):
+        """Write index to file"""
+        try:
+            write_atomic(self.filename, pickle.dumps((INDEX_VERSION, self.src, self.entries), pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
+
+    def get_packages(self):
+        """
+        Returns a dict of all catkin packages, just like catkin_pkg.packages.find_packages
+        :return: Dict {relative path: package}
+        """
+        packages = {}
+        changed = False
+        for path in find_package_paths(self.src):
+            try:
+                stat = os.stat(os.path.join(self.src, path, PACKAGE_MANIFEST_FILENAME))
+            except OSError:
+                continue
+            key = (stat.st_mtime, stat.st_size)
+
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+            else:
+                self.misses += 1
+                entry = (key, parse_package(os.path.join(self.src, path)))
+                self.entries[path] = entry
+                changed = True
+            packages[path] = entry[1]
+
+        # Forget about removed packages
+        for path in set(self.entries) - set(packages):
+            del self.entries[path]
+            changed = True
+
+        if changed:
+            self.save()
+
+        # Same sanity check as catkin_pkg
+        paths_by_name = {}
+        for path, package in packages.items():
+            paths_by_name.setdefault(package.name, []).append(path)
+        duplicates = [(name, paths) for name, paths in paths_by_name.items() if len(paths) > 1]
+        if duplicates:
+            duplicates = ["- {}: {}".format(name, ", ".join(sorted(paths))) for name, paths in duplicates]
+            raise RuntimeError("Multiple packages found with the same name(s):\n" + "\n".join(duplicates))
+
+        return packages
@@ -0,0 +1,118 @@
+from concurrent.futures import ThreadPoolExecutor
+from mrt_tools.utilities import get_job_count
+import subprocess
+import os
+
+
+class RepoStatus(object):
+    """Status of a single git repository"""
+
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.exists = os.path.isdir(path)
+        self.branch = None
+        self.upstream = None
+        self.ahead = 0
+        self.behind = 0
+        self.changes = []
+        self.untracked = []
+        self.unpushed = []
+        self.error = None
+
+    @property
+    def dirty(self):
+        return bool(self.changes)
+
+    @property
+    def has_changes(self):
+        """Whether anything in this repo is not yet on the server. Unreadable repos count as changed."""
+        return bool(self.changes or self.untracked or self.unpushed or self.error)
+
+    def __repr__(self):
+        return "<RepoStatus {0}: branch={1} ahead={2} behind={3} changes={4} untracked={5} unpushed={6}>".format(
+            self.name, self.branch, self.ahead, self.behind, len(self.changes), len(self.untracked),
+            len(self.unpushed))
+
+
+class RepoInspector(object):
+    """
+    Inspects many git repositories concurrently.
+
+    Every repo is queried with 'git -C', so no directory changes are needed and the inspection can run in a bounded
+    pool of worker threads.
+    """
+
+    def __init__(self, jobs=None):
+        """
+        :param jobs: Maximum number of concurrent git processes, defaults to the configured number of jobs
+        """
+        self.jobs = jobs
+
+    def inspect(self, repos):
+        """
+        Collect the status of several repositories
+        :param repos: List of (name, path) tuples
+        :return: List of RepoStatus objects, in the same order
+        """
+        if not repos:
+            return []
+        jobs = self.jobs or get_job_count(len(repos))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            return list(executor.map(lambda repo: self.inspect_repo(*repo), repos))
+
+    @staticmethod
+    def run_git(path, args):
+        process = subprocess.Popen(["git", "-C", path] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(error.strip() or "git {} failed".format(" ".join(args)))
+        return output
+
+    def inspect_repo(self, name, path):
+        """
+        Collect the status of one repository
+        :param name: Name of the repo
+        :param path: Path to the repo
+        :return: RepoStatus
+        """
+        status = RepoStatus(name, path)
+        if not status.exists:
+            return status
+        try:
+            self.parse_status(status, self.run_git(path, ["status", "--porcelain", "--branch"]))
+            log = self.run_git(path, ["log", "--branches", "--not", "--remotes", "--oneline"])
+            status.unpushed = [line for line in log.splitlines() if line]
+        except (RuntimeError, OSError) as err:
+            status.error = str(err)
+        return status
+
+    @staticmethod
+    def parse_status(status, output):
+        """
+        Fill a RepoStatus from the output of 'git status --porcelain --branch'
+        :param status: RepoStatus
+        :param output: Output of git
+        """
+        for line in output.splitlines():
+            if line.startswith("## "):
+                # e.g. "## master...origin/master [ahead 1, behind 2]"
+                header = line[3:]
+                for prefix in ("No commits yet on ", "Initial commit on "):
+                    if header.startswith(prefix):
+                        header = header[len(prefix):]
+                tracking = ""
+                if header.endswith("]") and " [" in header:
+                    header, tracking = header[:-1].rsplit(" [", 1)
+                status.branch, _, status.upstream = header.partition("...")
+                status.upstream = status.upstream or None
+                for item in tracking.split(","):
+                    item = item.strip()
+                    if item.startswith("ahead "):
+                        status.ahead = int(item[6:])
+                    elif item.startswith("behind "):
+                        status.behind = int(item[7:])
+            elif line.startswith("??"):
+                status.untracked.append(line)
+            elif line:
+                status.changes.append(line)
@@ -0,0 +1,128 @@
+from mrt_tools.DependencyGraph import DEPENDENCY_TYPES
+from mrt_tools.utilities import write_atomic
+from catkin_pkg.package import parse_package_string, InvalidPackage
+from xml.parsers.expat import ExpatError
+from collections import namedtuple
+import cPickle as pickle
+import hashlib
+import os
+
+INDEX_VERSION = 1
+INDEX_FILE = ".rdeps_index"
+
+# A package on a branch of a gitlab repo, which depends on the looked up package
+ReverseDependency = namedtuple("ReverseDependency", ["namespace", "repo", "branch", "package", "dep_type"])
+
+
+class ReverseDependencyIndex(object):
+    """
+    Inverted index from package names to the packages in gitlab that depend on them.
+
+    The index is built from the package.xml files downloaded by 'mrt maintenance update_cached_deps', which are stored
+    as <namespace>/<repo>/<branch>/package.xml. Only files that changed since the last update are parsed again.
+    """
+
+    def __init__(self, deps_ws):
+        """
+        :param deps_ws: Directory containing the downloaded package.xml files
+        """
+        self.deps_ws = deps_ws
+        self.filename = os.path.join(deps_ws, INDEX_FILE)
+        self.files = {}  # {relative path: (content hash, package name, [(dependency, type)])}
+        self.rdeps = {}  # {dependency: [ReverseDependency]}
+        self.load()
+
+    def load(self):
+        """Read in index from file"""
+        try:
+            with open(self.filename, "rb") as f:
+                version, self.files, self.rdeps = pickle.load(f)
+            if version != INDEX_VERSION:
+                self.files, self.rdeps = {}, {}
+        except Exception:  # Missing or corrupt index files are simply rebuilt
+            self.files, self.rdeps = {}, {}
+
+    def exists(self):
+        return os.path.exists(self.filename)
+
+    def update(self):
+        """
+        Parse new and changed package.xml files and rebuild the inverted index
+        :return: Number of parsed files
+        """
+        files = {}
+        parsed = 0
+        for root, dirs, filenames in os.walk(self.deps_ws):
+            if "package.xml" not in filenames:
+                continue
+            path = os.path.relpath(os.path.join(root, "package.xml"), self.deps_ws)
+            with open(os.path.join(self.deps_ws, path), "rb") as f:
+                data = f.read()
+            key = hashlib.sha1(data).hexdigest()
+            entry = self.files.get(path)
+            if entry is None or entry[0] != key:
+                entry = (key,) + self.parse(data, path)
+                parsed += 1
+            files[path] = entry
+
+        self.files = files
+        self.rdeps = {}
+        for path, (_, pkg_name, deps) in files.iteritems():
+            namespace, repo, branch = self.split_path(path)
+            for dep, dep_type in deps:
+                self.rdeps.setdefault(dep, []).append(ReverseDependency(namespace, repo, branch, pkg_name, dep_type))
+        write_atomic(self.filename, pickle.dumps((INDEX_VERSION, self.files, self.rdeps), pickle.HIGHEST_PROTOCOL))
+        return parsed
+
+    @staticmethod
+    def parse(data, path):
+        """
+        Extract the dependencies of a package.xml
+        :return: Tuple (package name, list of (dependency, type))
+        """
+        try:
+            package = parse_package_string(data, filename=path)
+        except (InvalidPackage, ExpatError, ValueError):
+            return None, []
+        deps = []
+        for dep_type, attribute in DEPENDENCY_TYPES.items():
+            deps += [(dep.name, dep_type) for dep in getattr(package, attribute)]
+        return package.name, sorted(set(deps))
+
+    @staticmethod
+    def split_path(path):
+        """Split <namespace>/<repo>/<branch>/package.xml, where the branch name can contain slashes"""
+        parts = path.split(os.sep)
+        return parts[0], parts[1], "/".join(parts[2:-1])
+
+    def lookup(self, pkg_name, dep_types=None):
+        """
+        Find all packages directly depending on a package
+        :param pkg_name: Name of the package
+        :param dep_types: Only consider these dependency types, all if not given
+        :return: List of ReverseDependency
+        """
+        return [r for r in self.rdeps.get(pkg_name, []) if not dep_types or r.dep_type in dep_types]
+
+    def lookup_transitive(self, pkg_name, dep_types=None):
+        """
+        Find all packages depending directly or indirectly on a package
+        :param pkg_name: Name of the package
+        :param dep_types: Only consider these dependency types, all if not given
+        :return: List of tuples (ReverseDependency, name of the package it depends on, distance)
+        """
+        results = []
+        visited = {pkg_name}
+        frontier = [pkg_name]
+        distance = 0
+        while frontier:
+            distance += 1
+            next_frontier = []
+            for name in frontier:
+                for rdep in self.lookup(name, dep_types):
+                    results.append((rdep, name, distance))
+                    if rdep.package and rdep.package not in visited:
+                        visited.add(rdep.package)
+                        next_frontier.append(rdep.package)
+            frontier = next_frontier
+        return results
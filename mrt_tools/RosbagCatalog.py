@@ -0,0 +1,212 @@
+from mrt_tools.utilities import escape_like
+from mrt_tools.settings import user_settings
+import sqlite3
+import os
+
+SCHEMA_VERSION = 1
+# Number of bags read between two commits. An interrupted update keeps the bags indexed so far.
+COMMIT_INTERVAL = 100
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bags (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    start REAL,
+    end REAL,
+    duration REAL,
+    messages INTEGER
+);
+CREATE TABLE IF NOT EXISTS fields (
+    bag_id INTEGER NOT NULL REFERENCES bags(id) ON DELETE CASCADE,
+    key TEXT NOT NULL,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS topics (
+    bag_id INTEGER NOT NULL REFERENCES bags(id) ON DELETE CASCADE,
+    topic TEXT NOT NULL,
+    type TEXT,
+    count INTEGER
+);
+CREATE INDEX IF NOT EXISTS fields_key_value ON fields (key, value);
+CREATE INDEX IF NOT EXISTS fields_bag ON fields (bag_id);
+CREATE INDEX IF NOT EXISTS topics_topic ON topics (topic);
+CREATE INDEX IF NOT EXISTS topics_bag ON topics (bag_id);
+"""
+
+
+def flatten_metadata(data, prefix=""):
+    """
+    Flatten nested metadata into dotted keys
+    :param data: Dict of metadata, e.g. {"Environment": {"Location": "Karlsruhe"}}
+    :return: List of (key, value) tuples, e.g. [("Environment.Location", "Karlsruhe")]
+    """
+    fields = []
+    for key, value in (data or {}).items():
+        key = prefix + str(key)
+        if isinstance(value, dict):
+            fields += flatten_metadata(value, key + ".")
+        elif isinstance(value, (list, tuple)):
+            fields += [(key, unicode(v)) for v in value]
+        else:
+            fields.append((key, unicode(value) if value is not None else u""))
+    return fields
+
+
+class BagEntry(object):
+    """A bag found in the catalog"""
+
+    def __init__(self, path, size, start, end, duration, messages):
+        self.path = path
+        self.size = size
+        self.start = start
+        self.end = end
+        self.duration = duration
+        self.messages = messages
+
+
+class RosbagCatalog(object):
+    """
+    Searchable index over the metadata of a rosbag archive.
+
+    For every bag, the metadata fields, size, time range and topics are stored in a SQLite database. Bags are
+    identified by path, size and mtime, so an update only opens new and modified bags. Queries are answered from the
+    database without touching the bags.
+    """
+
+    def __init__(self, filename=None):
+        """
+        :param filename: Database file, defaults to the catalog in the config directory
+        """
+        self.filename = filename or user_settings['Cache']['ROSBAG_CATALOG']
+        directory = os.path.dirname(os.path.abspath(self.filename))
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.db = sqlite3.connect(self.filename)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS fields; DROP TABLE IF EXISTS topics; "
+                                  "DROP TABLE IF EXISTS bags;")
+            self.db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def find_bags(paths):
+        """Returns the absolute paths of all bags in the given files and directories"""
+        bags = []
+        for path in paths:
+            path = os.path.abspath(path)
+            if os.path.isdir(path):
+                for root, dirs, files in os.walk(path):
+                    dirs.sort()
+                    bags += [os.path.join(root, f) for f in sorted(files) if f.endswith(".bag")]
+            elif os.path.isfile(path):
+                bags.append(path)
+        return bags
+
+    def update(self, paths, reader, on_error=None):
+        """
+        Add new and modified bags to the catalog and remove deleted ones
+        :param paths: Files and directories to index
+        :param reader: Function returning the info dict of a bag (see RosbagMetadataHandler.read_bag_info)
+        :param on_error: Called with path and exception for bags which can not be read
+        :return: Tuple (number of added or updated bags, number of unchanged bags, number of removed bags)
+        """
+        bags = self.find_bags(paths)
+        known = {row[0]: (row[1], row[2]) for row in self.db.execute("SELECT path, size, mtime FROM bags")}
+        updated = unchanged = 0
+        for path in bags:
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                unchanged += 1
+                continue
+            try:
+                info = reader(path)
+            except Exception as err:
+                if on_error is not None:
+                    on_error(path, err)
+                continue
+            self.add(path, stat.st_size, stat.st_mtime, info)
+            updated += 1
+            if updated % COMMIT_INTERVAL == 0:
+                self.db.commit()
+
+        # Remove bags, which do not exist anymore below the indexed directories or were given explicitly. Bags
+        # elsewhere are kept, even if they are not reachable right now (e.g. on an unmounted drive).
+        roots = [os.path.join(os.path.abspath(p), "") for p in paths if os.path.isdir(p)]
+        given = set(os.path.abspath(p) for p in paths if not os.path.isdir(p))
+        found = set(bags)
+        removed = [path for path in known if path not in found and
+                   (path in given or any(path.startswith(root) for root in roots))]
+        for path in removed:
+            self.db.execute("DELETE FROM bags WHERE path = ?", (path,))
+        self.db.commit()
+        return updated, unchanged, len(removed)
+
+    def add(self, path, size, mtime, info):
+        """Insert or replace the entry of a bag"""
+        self.db.execute("DELETE FROM bags WHERE path = ?", (path,))
+        cursor = self.db.execute("INSERT INTO bags (path, size, mtime, start, end, duration, messages) "
+                                 "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                 (path, size, mtime, info.get("start"), info.get("end"), info.get("duration"),
+                                  info.get("messages")))
+        bag_id = cursor.lastrowid
+        self.db.executemany("INSERT INTO fields (bag_id, key, value) VALUES (?, ?, ?)",
+                            [(bag_id, key, value) for key, value in flatten_metadata(info.get("metadata"))])
+        self.db.executemany("INSERT INTO topics (bag_id, topic, type, count) VALUES (?, ?, ?, ?)",
+                            [(bag_id, topic, msg_type, count)
+                             for topic, (msg_type, count) in (info.get("topics") or {}).items()])
+
+    @staticmethod
+    def parse_condition(condition):
+        """
+        Split a 'key=value' condition
+        :return: Tuple (key, value)
+        """
+        if "=" not in condition:
+            raise ValueError("Invalid condition '{}', expected key=value".format(condition))
+        key, value = condition.split("=", 1)
+        if not key.strip():
+            raise ValueError("Invalid condition '{}', expected key=value".format(condition))
+        return key.strip(), value.strip()
+
+    @staticmethod
+    def to_pattern(value):
+        """Convert a value with '*' wildcards into a LIKE pattern"""
+        return escape_like(value).replace("*", "%")
+
+    def find(self, conditions):
+        """
+        Find all bags matching all conditions.
+
+        Keys are matched case insensitive against the full dotted key (e.g. 'environment.location') or its last part
+        (e.g. 'location'). Values are compared case insensitive and may contain '*' as wildcard. The special keys
+        'topic' and 'path' match the recorded topics and the path of the bag.
+        :param conditions: List of 'key=value' strings
+        :return: List of BagEntry, sorted by start time
+        """
+        query = "SELECT path, size, start, end, duration, messages FROM bags WHERE 1"
+        params = []
+        for key, value in (self.parse_condition(c) for c in conditions):
+            pattern = self.to_pattern(value)
+            if key.lower() == "topic":
+                pattern = pattern if pattern.startswith("/") or pattern.startswith("%") else "/" + pattern
+                query += " AND id IN (SELECT bag_id FROM topics WHERE topic LIKE ? ESCAPE '\\')"
+                params.append(pattern)
+            elif key.lower() == "path":
+                query += " AND path LIKE ? ESCAPE '\\'"
+                params.append(pattern)
+            else:
+                query += (" AND id IN (SELECT bag_id FROM fields WHERE (lower(key) = lower(?) OR "
+                          "lower(key) LIKE '%.' || lower(?) ESCAPE '\\') AND value LIKE ? ESCAPE '\\')")
+                params += [key, escape_like(key), pattern]
+        query += " ORDER BY start, path"
+        return [BagEntry(*row) for row in self.db.execute(query, params)]
+
+    def get_fields(self, path):
+        """Returns the metadata fields of a bag as list of (key, value)"""
+        return list(self.db.execute("SELECT key, value FROM fields JOIN bags ON bags.id = fields.bag_id "
+                                    "WHERE path = ? ORDER BY key", (os.path.abspath(path),)))
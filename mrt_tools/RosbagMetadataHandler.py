@@ -1,10 +1,16 @@
 # Default settings
 from mrt_tools.utilities import get_script_root
 from mrt_tools.settings import CONFIG_DIR
+from mrt_tools.BagWatcher import BagWatcher
+from mrt_tools.TopicStatistics import compute_statistics
 from collections import OrderedDict
 from unidecode import unidecode
+import subprocess
 import getpass
 import click
+import struct
+import copy
+import re
 import yaml
 import time
 import os
@@ -17,9 +23,17 @@ except ImportError:
 
 METADATA_CACHE = os.path.join(CONFIG_DIR, "rosbag_metadata.yaml")
 METADATA_TOPIC = "/metadata"
+STATISTICS_KEY = "Statistics"
 METADATA_TEMPLATE = os.path.join(get_script_root(), "templates", "rosbag_metadata.yaml")
 
 
+def dict_to_plain(data):
+    """ Convert nested OrderedDicts into plain dicts """
+    if isinstance(data, dict):
+        return {k: dict_to_plain(v) for k, v in data.items()}
+    return data
+
+
 def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
     """ Wrapper function to assert ordered loading of yaml file """
 
@@ -40,6 +54,59 @@ def ordered_load(stream, Loader=yaml.Loader, object_pairs_hook=OrderedDict):
 yaml.add_representer(OrderedDict, lambda self, data: self.represent_mapping('tag:yaml.org,2002:map', data.items()))
 
 
+def get_bag_report(filename, rosbag_options=None, text=True):
+    """
+    Collect everything 'mrt rosbag info' shows about a bag, opening it only once. Runs in worker processes.
+    :param filename: Path to rosbag
+    :param rosbag_options: Options of 'rosbag info'. If given, the summary is produced by 'rosbag info' itself.
+    :param text: Produce the text of 'rosbag info'. Without it, only the index of the metadata topic is read.
+    :return: Dict with path, size, metadata, summary (see RosbagMetadataHandler.get_summary), text and error
+    """
+    report = {"path": filename, "size": None, "metadata": None, "summary": None, "text": None, "error": None}
+    try:
+        report["size"] = os.path.getsize(filename)
+        if rosbag_options or not text:
+            bag = RosbagMetadataHandler.open_index_only(filename, [METADATA_TOPIC])
+        else:
+            # The frequencies shown by 'rosbag info' are computed from the complete index
+            bag = rosbag.Bag(filename, 'r')
+        with bag:
+            report["metadata"] = OrderedDict()
+            for _, msg, _ in bag.read_messages(topics=[METADATA_TOPIC]):
+                report["metadata"] = ordered_load(msg.data)
+                break
+            report["summary"] = RosbagMetadataHandler.get_summary(bag)
+            if text and not rosbag_options:
+                report["text"] = str(bag)
+        if text and rosbag_options:
+            report["text"] = subprocess.check_output(["rosbag", "info"] + list(rosbag_options) + [filename])
+    except rosbag.bag.ROSBagException as err:
+        report["error"] = err.value
+    except (IOError, OSError, subprocess.CalledProcessError) as err:
+        report["error"] = str(err)
+    return report
+
+
+def annotate_bag(filename, data, force=False):
+    """
+    Write metadata to a bag, unless the bag already contains the same metadata. Runs in worker processes.
+    :param filename: Path to rosbag
+    :param data: Dict of metadata
+    :param force: Also write the metadata, if it did not change
+    :return: Tuple (one of "written", "unchanged" or "failed", size of the bag in bytes)
+    """
+    size = os.path.getsize(filename)
+    old_data = RosbagMetadataHandler.load_from_bag(filename, True)
+    if old_data and STATISTICS_KEY in old_data:
+        # Statistics belong to this bag and are kept
+        data = OrderedDict(data)
+        data[STATISTICS_KEY] = old_data[STATISTICS_KEY]
+    if not force and RosbagMetadataHandler.same_metadata(old_data, data):
+        return "unchanged", size
+    rmh = RosbagMetadataHandler()
+    return "written" if rmh.write_to_bag(filename, quiet=True, data=data) else "failed", size
+
+
 class RosbagMetadataHandler(object):
     """
     This class handles metadata writing for rosbags
@@ -110,16 +177,116 @@ class RosbagMetadataHandler(object):
             yaml.dump(data, stream=f, default_flow_style=False)
 
     @staticmethod
-    def load_from_bag(filename):
+    def open_index_only(filename, topics):
+        """
+        Open a rosbag for reading a few topics without loading the complete index.
+
+        Only the connection and chunk info records at the end of the bag are read. The index records are read only
+        for chunks, which contain one of the topics, so the cost does not grow with the size of the bag.
+        :param filename: Path to rosbag
+        :param topics: List of topics that will be read
+        :return: rosbag.Bag, ready for read_messages(topics=topics)
+        """
+        try:
+            bag = rosbag.Bag(filename, 'r', skip_index=True)
+        except TypeError:
+            return rosbag.Bag(filename, 'r')  # rosbag version without skip_index
+
+        try:
+            if bag.version != 200:
+                raise AttributeError("Bag format {} has no chunk infos".format(bag.version))
+            connections = set(c.id for c in bag._connections.values() if c.topic in topics)
+            for chunk_info in bag._chunks:
+                if not connections.intersection(chunk_info.connection_counts):
+                    continue
+                # The index records of a chunk follow directly after the chunk
+                bag._file.seek(chunk_info.pos)
+                rosbag.bag._skip_record(bag._file)
+                bag._curr_chunk_info = chunk_info
+                for _ in range(len(chunk_info.connection_counts)):
+                    connection_id, index = bag._reader.read_connection_index_record()
+                    if connection_id in connections:
+                        bag._connection_indexes[connection_id].extend(index)
+            # rosbag versions reading the index lazily would otherwise read all index records again in read_messages
+            bag._connection_indexes_read = True
+        except (AttributeError, struct.error, rosbag.ROSBagFormatException):
+            # Internals of rosbag differ from what we expect or the index records are damaged, read the complete index
+            # instead
+            bag.close()
+            bag = rosbag.Bag(filename, 'r')
+        return bag
+
+    @staticmethod
+    def get_start_time(bag):
+        """
+        Returns the time stamp of the first message in a bag from its chunk infos, without reading any messages
+        :param bag: Opened rosbag.Bag
+        :return: rospy.Time or None for empty bags
+        """
+        try:
+            if bag._chunks:
+                return min(chunk_info.start_time for chunk_info in bag._chunks)
+        except AttributeError:
+            for _, _, t in bag.read_messages():
+                return t
+        return None
+
+    @staticmethod
+    def get_summary(bag):
+        """
+        Returns time range, message count and topics of a bag. The numbers are taken from the chunk infos, so the bag
+        can be opened with open_index_only.
+        :param bag: Opened rosbag.Bag
+        :return: Dict with the keys start, end, duration, messages and topics ({topic: (type, message count)})
+        """
+        topics = {}
+        try:
+            if bag.version != 200:
+                raise AttributeError("Bag format {} has no chunk infos".format(bag.version))
+            for chunk_info in bag._chunks:
+                for connection_id, count in chunk_info.connection_counts.items():
+                    connection = bag._connections[connection_id]
+                    _, previous_count = topics.get(connection.topic, (None, 0))
+                    topics[connection.topic] = (connection.datatype, previous_count + count)
+            start = min(c.start_time for c in bag._chunks).to_sec() if bag._chunks else None
+            end = max(c.end_time for c in bag._chunks).to_sec() if bag._chunks else None
+        except AttributeError:
+            info = bag.get_type_and_topic_info()
+            topics = {topic: (i.msg_type, i.message_count) for topic, i in info.topics.items()}
+            start, end = (bag.get_start_time(), bag.get_end_time()) if topics else (None, None)
+        return {"start": start, "end": end, "duration": end - start if topics else 0.0,
+                "messages": sum(count for _, count in topics.values()), "topics": topics}
+
+    @staticmethod
+    def read_bag_info(filename):
+        """
+        Read metadata and summary of a bag without reading any other messages
+        :param filename: Path to rosbag
+        :return: Dict like get_summary, with the additional key metadata
+        """
+        bag = RosbagMetadataHandler.open_index_only(filename, [METADATA_TOPIC])
+        with bag:
+            info = RosbagMetadataHandler.get_summary(bag)
+            info["metadata"] = OrderedDict()
+            for _, msg, _ in bag.read_messages(topics=[METADATA_TOPIC]):
+                info["metadata"] = ordered_load(msg.data)
+                break
+        return info
+
+    @staticmethod
+    def load_from_bag(filename, quiet=False):
         """
         Load yaml data from METADATA_TOPIC from rosbag into OrderedDict
 
         :param filename: Path to rosbag
+        :param quiet: Do not print progress
         :return: OrderedDict with key value pairs from file or None upon file error
         """
-        click.echo("Gathering metadata from bag {} ...".format(filename))
+        if not quiet:
+            click.echo("Gathering metadata from bag {} ...".format(filename))
         try:
-            with rosbag.Bag(filename, 'r') as bag:
+            bag = RosbagMetadataHandler.open_index_only(filename, [METADATA_TOPIC])
+            with bag:
                 for msg_topic, msg, t in bag.read_messages(topics=[METADATA_TOPIC, ]):
                     if msg_topic == METADATA_TOPIC:
                         return ordered_load(msg.data)
@@ -129,40 +296,124 @@ class RosbagMetadataHandler(object):
             click.secho(err.value, fg="red")
             return None
 
-    def write_to_bag(self, bagfile):
+    @staticmethod
+    def read_statistics(filename, gap_threshold):
+        """
+        Compute per topic statistics of a bag (see TopicStatistics) in one pass over its messages
+        :param filename: Path to rosbag
+        :param gap_threshold: Time in seconds between two messages of a topic, above which a gap is reported
+        :return: OrderedDict {topic: statistics}
+        """
+        with rosbag.Bag(filename, 'r') as bag:
+            # Raw messages are not deserialized, only their size is needed
+            messages = ((topic, raw[0], len(raw[1]), t.to_sec())
+                        for topic, raw, t in bag.read_messages(raw=True) if topic != METADATA_TOPIC)
+            return compute_statistics(messages, gap_threshold)
+
+    def finalize_bag(self, bagfile, gap_threshold=None, quiet=False):
+        """
+        Write the metadata to a freshly recorded bag, optionally together with per topic statistics
+        :param bagfile: Path to rosbag
+        :param gap_threshold: If given, statistics are computed and gaps longer than this are reported
+        :param quiet: Only print a short note instead of the metadata
+        :return: True on success
+        """
+        if os.path.exists(bagfile + ".active"):
+            BagWatcher.wait_until_closed(bagfile)
+        data = OrderedDict(self.data or {})
+        if gap_threshold is not None:
+            try:
+                data[STATISTICS_KEY] = self.read_statistics(bagfile, gap_threshold)
+            except rosbag.bag.ROSBagException as err:
+                click.secho("Could not compute statistics of {0}: {1}".format(bagfile, err.value), fg="red")
+        return self.write_to_bag(bagfile, quiet=quiet, data=data)
+
+    def write_to_bag(self, bagfile, quiet=False, data=None):
         """
         Write Dictionary of metadata to rosbags METADATA_TOPIC
 
         Catches errors and prints warning
-        :param filename: Path to rosbag
-        :param data: dict
-        :return: None
+        :param bagfile: Path to rosbag
+        :param quiet: Only print a short note instead of the metadata
+        :param data: Metadata to write instead of the data of this object
+        :return: True on success
         """
-        metadata = self.data
+        metadata = self.data if data is None else data
         if isinstance(metadata, dict):  # convert dict to yaml
             metadata = yaml.dump(metadata, default_flow_style=False)
 
-        while os.path.exists(bagfile + ".active"):
+        if os.path.exists(bagfile + ".active"):
             click.echo("Waiting for bagfile to be written to disk...")
-            time.sleep(1)
+            BagWatcher.wait_until_closed(bagfile)
 
         success = False
         try:
-            with rosbag.Bag(bagfile, 'a') as bag:
+            # The index is not needed for appending. Without it, only the connection and chunk infos at the end of
+            # the bag are read and rewritten.
+            try:
+                bag = rosbag.Bag(bagfile, 'a', skip_index=True)
+            except TypeError:
+                bag = rosbag.Bag(bagfile, 'a')  # rosbag version without skip_index
+            with bag:
                 metadata_msg = std_msgs.msg.String(data=metadata)
                 # Put the new message in front of old messages
-                t = None
-                for _, _, t in bag.read_messages():
-                    break
+                t = self.get_start_time(bag)
                 if t:
                     success = True
                     bag.write(METADATA_TOPIC, metadata_msg, t - rospy.rostime.Duration(0, 1))
         except rosbag.bag.ROSBagException as err:
             click.secho("Could not write to bagfile: {}".format(err.value), fg="red")
 
-        if success:
+        if success and quiet:
+            click.echo("Wrote metadata to {}".format(bagfile))
+        elif success:
             click.echo("\nWrote the following metadata to {}:".format(bagfile))
-            click.echo(self.__str__())
+            click.echo(self.pretty(data) if data is not None else self.__str__())
+        return success
+
+    @staticmethod
+    def same_metadata(old, new):
+        """Compare two sets of metadata, ignoring the time of the last modification"""
+        if old is None or new is None:
+            return False
+        old, new = copy.deepcopy(old), copy.deepcopy(new)
+        for data in (old, new):
+            data.get("General", {}).pop("LastModified", None)
+        return yaml.safe_dump(dict_to_plain(old)) == yaml.safe_dump(dict_to_plain(new))
+
+    @staticmethod
+    def render(data, filename, pattern=None):
+        """
+        Fill in placeholders in the metadata values for one bag.
+
+        Values may contain {filename} (name of the bag), {stem} (name without .bag) and {dir} (name of the directory).
+        If a regex pattern is given, it is matched against the file name and its named groups are available as well,
+        e.g. the pattern '(?P<location>[a-z]+)_.*' allows 'Location: {location}'.
+        :param data: Dict of metadata
+        :param filename: Path to rosbag
+        :param pattern: Optional regex with named groups
+        :return: Copy of data with the placeholders replaced
+        """
+        name = os.path.basename(filename)
+        fields = {"filename": name, "stem": name[:-len(".bag")] if name.endswith(".bag") else name,
+                  "dir": os.path.basename(os.path.dirname(os.path.abspath(filename)))}
+        if pattern:
+            match = re.match(pattern, name)
+            if match is None:
+                raise ValueError("File name {0} does not match the pattern '{1}'".format(name, pattern))
+            fields.update((k, v) for k, v in match.groupdict().items() if v is not None)
+
+        def render_value(value):
+            if isinstance(value, dict):
+                return OrderedDict((k, render_value(v)) for k, v in value.items())
+            if isinstance(value, basestring) and "{" in value:
+                try:
+                    return value.format(**fields)
+                except KeyError as err:
+                    raise ValueError("Unknown placeholder {0} in '{1}'".format(err, value))
+            return value
+
+        return render_value(data)
 
     def collect_metadata(self, filename=METADATA_CACHE, clean_start=False, reuse_last=False):
         """
@@ -177,7 +428,9 @@ class RosbagMetadataHandler(object):
             last_data = OrderedDict()
             if os.path.isfile(filename):
                 if filename.endswith(".bag"):
-                    last_data = self.load_from_bag(filename)
+                    last_data = self.load_from_bag(filename) or OrderedDict()
+                    # Statistics describe only this bag and are not asked for
+                    last_data.pop(STATISTICS_KEY, None)
                     # Keep all of the old data
                     new_data.update(last_data)
                 else:
@@ -0,0 +1,130 @@
+from mrt_tools.utilities import write_atomic
+from mrt_tools.settings import user_settings
+import cPickle as pickle
+import hashlib
+import os
+
+CACHE_VERSION = 1
+
+
+class RosdepResolver(object):
+    """
+    Resolves rosdep keys in-process with the rosdep2 API.
+
+    Loading the rosdep database and resolving every key for the current platform takes a few seconds, so the
+    resulting key -> (installer, packages) index is cached. The cache is keyed on a hash over the rosdep sources list,
+    the downloaded sources cache and the platform, so it is rebuilt after every 'rosdep update'.
+    """
+
+    def __init__(self, cache_file=None):
+        """
+        :param cache_file: File to cache the resolved keys in
+        """
+        self.cache_file = cache_file or user_settings['Cache']['ROSDEP_CACHE_FILE']
+        self.installer_context = None
+        self.platform = None
+        self.index = None
+
+    def get_platform(self):
+        """
+        :return: Tuple (os name, os version, installer keys, default installer key)
+        """
+        if self.platform is None:
+            from rosdep2 import create_default_installer_context, get_default_installer
+            self.installer_context = create_default_installer_context()
+            _, installer_keys, default_key, os_name, os_version = get_default_installer(
+                installer_context=self.installer_context)
+            self.platform = (os_name, os_version, installer_keys, default_key)
+        return self.platform
+
+    def get_sources_hash(self):
+        """Hash over everything the resolution depends on"""
+        from rosdep2.sources_list import get_sources_list_dir, get_sources_cache_dir
+        md5 = hashlib.md5(repr((CACHE_VERSION, os.environ.get("ROS_DISTRO"), self.get_platform()[:2])))
+        for directory in (get_sources_list_dir(), get_sources_cache_dir()):
+            for root, dirs, files in sorted(os.walk(directory)):
+                for filename in sorted(files):
+                    stat = os.stat(os.path.join(root, filename))
+                    md5.update("{0} {1} {2}\n".format(os.path.join(root, filename), stat.st_mtime, stat.st_size))
+        return md5.hexdigest()
+
+    def get_index(self):
+        """
+        :return: Dict {rosdep key: (installer key, list of packages) or None, if there is no rule for this platform}
+        """
+        if self.index is not None:
+            return self.index
+        sources_hash = self.get_sources_hash()
+        try:
+            with open(self.cache_file, "rb") as f:
+                cached_hash, index = pickle.load(f)
+            if cached_hash == sources_hash:
+                self.index = index
+                return index
+        except Exception:  # Missing or corrupt cache files are simply rebuilt
+            pass
+
+        self.index = self.build_index()
+        try:
+            write_atomic(self.cache_file, pickle.dumps((sources_hash, self.index), pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
+        return self.index
+
+    def build_index(self):
+        """Resolve all keys of the rosdep database for this platform"""
+        from rosdep2 import RosdepLookup, ResolutionError, InvalidData, UnsupportedOs, RosdepInternalError
+        from rosdep2.rospkg_loader import DEFAULT_VIEW_KEY
+        os_name, os_version, installer_keys, default_key = self.get_platform()
+        view = RosdepLookup.create_from_rospkg().get_rosdep_view(DEFAULT_VIEW_KEY)
+
+        index = {}
+        for key in view.keys():
+            try:
+                installer_key, rule = view.lookup(key).get_rule_for_platform(os_name, os_version, installer_keys,
+                                                                             default_key)
+                resolved = self.installer_context.get_installer(installer_key).resolve(rule)
+                index[key] = (installer_key, [str(r) for r in resolved])
+            except (ResolutionError, InvalidData, UnsupportedOs, RosdepInternalError, KeyError):
+                index[key] = None  # A broken rule of one key must not prevent resolving all others
+        return index
+
+    @staticmethod
+    def get_underlay_packages():
+        """
+        Returns the names of all packages on the ROS_PACKAGE_PATH, i.e. of the underlays and chained workspaces. Just
+        like with 'rosdep check --ignore-src', these are not resolved.
+        """
+        import rospkg
+        return set(rospkg.RosPack().list())
+
+    def invalidate(self):
+        """Forget the resolved keys, e.g. after 'rosdep update'"""
+        self.index = None
+
+    def keys(self):
+        """Returns the set of all known rosdep keys"""
+        return set(self.get_index())
+
+    def resolve(self, keys):
+        """
+        Resolve several rosdep keys
+        :param keys: Iterable of rosdep keys
+        :return: Tuple ({installer key: set of packages}, list of keys which could not be resolved)
+        """
+        index = self.get_index()
+        resolved = {}
+        unresolved = []
+        for key in keys:
+            entry = index.get(key)
+            if entry is None:
+                unresolved.append(key)
+            else:
+                resolved.setdefault(entry[0], set()).update(entry[1])
+        return resolved, sorted(unresolved)
+
+    def get_packages_to_install(self, installer_key, packages):
+        """Returns the packages, which are not installed yet"""
+        self.get_platform()
+        installer = self.installer_context.get_installer(installer_key)
+        return installer.get_packages_to_install(sorted(packages))
@@ -0,0 +1,249 @@
+from mrt_tools.utilities import write_atomic, escape_like
+from mrt_tools.settings import user_settings
+import hashlib
+import sqlite3
+import zipfile
+import zlib
+import yaml
+import time
+import os
+
+SCHEMA_VERSION = 1
+ROSINSTALL_PATH = "src/.rosinstall"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL,
+    created REAL NOT NULL,
+    version TEXT
+);
+CREATE TABLE IF NOT EXISTS files (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    path TEXT NOT NULL,
+    blob TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS repos (
+    snapshot_id INTEGER NOT NULL REFERENCES snapshots(id) ON DELETE CASCADE,
+    local_name TEXT NOT NULL,
+    scm TEXT,
+    uri TEXT,
+    version TEXT
+);
+CREATE INDEX IF NOT EXISTS files_snapshot ON files (snapshot_id);
+CREATE INDEX IF NOT EXISTS repos_snapshot ON repos (snapshot_id);
+CREATE INDEX IF NOT EXISTS repos_version ON repos (version);
+"""
+
+
+class RepoChange(object):
+    """Difference of one repo between two snapshots"""
+
+    def __init__(self, local_name, old, new):
+        """
+        :param local_name: Path of the repo within src
+        :param old: Tuple (uri, version) in the first snapshot or None
+        :param new: Tuple (uri, version) in the second snapshot or None
+        """
+        self.local_name = local_name
+        self.old = old
+        self.new = new
+
+    @property
+    def status(self):
+        if self.old is None:
+            return "added"
+        if self.new is None:
+            return "removed"
+        return "changed"
+
+
+class SnapshotStore(object):
+    """
+    Local store of workspace snapshots.
+
+    Files of snapshots are stored content addressed (by their sha1), so config files which are the same in many
+    snapshots are only stored once. A SQLite index maps every snapshot to its files and to the repos and commits of its
+    rosinstall file, so comparing snapshots and finding snapshots by commit does not read any archive.
+    """
+
+    def __init__(self, directory=None):
+        """
+        :param directory: Directory of the store, defaults to the one in the config directory
+        """
+        self.directory = directory or user_settings['Snapshot']['STORE_DIR']
+        self.objects_dir = os.path.join(self.directory, "objects")
+        if not os.path.exists(self.objects_dir):
+            os.makedirs(self.objects_dir)
+        self.db = sqlite3.connect(os.path.join(self.directory, "index.sqlite"))
+        self.db.execute("PRAGMA foreign_keys = ON")
+        if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self.db.executescript("DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS repos; "
+                                  "DROP TABLE IF EXISTS snapshots;")
+            self.db.execute("PRAGMA user_version = {}".format(SCHEMA_VERSION))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    @staticmethod
+    def get_name(filename):
+        """Name under which a snapshot file is stored"""
+        name = os.path.basename(filename)
+        ending = user_settings['Snapshot']['FILE_ENDING']
+        return name[:-len(ending)] if name.endswith(ending) else name
+
+    def get_object_path(self, blob):
+        return os.path.join(self.objects_dir, blob[:2], blob[2:])
+
+    def write_blob(self, data):
+        """
+        Store data, unless it is stored already
+        :return: sha1 of data
+        """
+        blob = hashlib.sha1(data).hexdigest()
+        path = self.get_object_path(blob)
+        if not os.path.exists(path):
+            write_atomic(path, zlib.compress(data))
+        return blob
+
+    def read_blob(self, blob):
+        with open(self.get_object_path(blob), "rb") as f:
+            return zlib.decompress(f.read())
+
+    def exists(self, name):
+        return self.db.execute("SELECT 1 FROM snapshots WHERE name = ?", (name,)).fetchone() is not None
+
+    def add(self, name, files, created=None):
+        """
+        Add a snapshot, replacing an existing one with the same name
+        :param name: Name of the snapshot
+        :param files: Dict {path within the snapshot: content}, containing the rosinstall file at src/.rosinstall
+        :param created: Creation time, defaults to now
+        """
+        blobs = {path: self.write_blob(data) for path, data in files.items()}
+        repos = self.parse_rosinstall(files.get(ROSINSTALL_PATH, ""))
+        version = files.get(user_settings['Snapshot']['VERSION_FILE'])
+        with self.db:
+            replaced = self.db.execute("DELETE FROM snapshots WHERE name = ?", (name,)).rowcount
+            snapshot_id = self.db.execute("INSERT INTO snapshots (name, created, version) VALUES (?, ?, ?)",
+                                          (name, created or time.time(), version)).lastrowid
+            self.db.executemany("INSERT INTO files (snapshot_id, path, blob) VALUES (?, ?, ?)",
+                                [(snapshot_id, path, blob) for path, blob in blobs.items()])
+            self.db.executemany("INSERT INTO repos (snapshot_id, local_name, scm, uri, version) VALUES (?, ?, ?, ?, ?)",
+                                [(snapshot_id,) + repo for repo in repos])
+        if replaced:
+            self.remove_unreferenced_objects()
+
+    def add_archive(self, filename, name=None):
+        """
+        Add a snapshot file created by 'mrt snapshot create'
+        :param filename: Path to the snapshot file
+        :param name: Name of the snapshot, defaults to the file name
+        :return: Name of the snapshot
+        """
+        name = name or self.get_name(filename)
+        with zipfile.ZipFile(filename, "r") as zf:
+            files = {info.filename: zf.read(info) for info in zf.infolist() if not info.filename.endswith("/")}
+        self.add(name, files, os.path.getmtime(filename))
+        return name
+
+    def export(self, name, filename):
+        """Write a stored snapshot into a snapshot file"""
+        zf = zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED)
+        for path, blob in self.get_files(name):
+            zf.writestr(path, self.read_blob(blob))
+        zf.close()
+
+    def remove(self, name):
+        """
+        Remove a snapshot from the index. Unreferenced objects are deleted.
+        :return: True if the snapshot existed
+        """
+        with self.db:
+            removed = self.db.execute("DELETE FROM snapshots WHERE name = ?", (name,)).rowcount
+        if removed:
+            self.remove_unreferenced_objects()
+        return bool(removed)
+
+    def remove_unreferenced_objects(self):
+        referenced = set(row[0] for row in self.db.execute("SELECT DISTINCT blob FROM files"))
+        for prefix in os.listdir(self.objects_dir):
+            for rest in os.listdir(os.path.join(self.objects_dir, prefix)):
+                if prefix + rest not in referenced:
+                    os.remove(os.path.join(self.objects_dir, prefix, rest))
+
+    @staticmethod
+    def parse_rosinstall(data):
+        """
+        :param data: Content of a rosinstall file
+        :return: List of tuples (local name, scm, uri, version)
+        """
+        repos = []
+        for entry in yaml.safe_load(data) or []:
+            for scm, spec in entry.items():
+                repos.append((spec.get("local-name"), scm, spec.get("uri"), str(spec.get("version") or "")))
+        return repos
+
+    def get_snapshots(self):
+        """
+        :return: List of tuples (name, creation time, number of repos), newest first
+        """
+        return list(self.db.execute("SELECT name, created, (SELECT COUNT(*) FROM repos WHERE snapshot_id = id) "
+                                    "FROM snapshots ORDER BY created DESC, name"))
+
+    def get_id(self, name):
+        row = self.db.execute("SELECT id FROM snapshots WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError("No snapshot named '{}'".format(name))
+        return row[0]
+
+    def get_files(self, name):
+        """
+        :return: List of tuples (path, blob)
+        """
+        return list(self.db.execute("SELECT path, blob FROM files WHERE snapshot_id = ? ORDER BY path",
+                                    (self.get_id(name),)))
+
+    def get_repos(self, name):
+        """
+        :return: Dict {local name: (uri, version)}
+        """
+        return {row[0]: (row[1], row[2]) for row in self.db.execute(
+            "SELECT local_name, uri, version FROM repos WHERE snapshot_id = ?", (self.get_id(name),))}
+
+    def diff(self, old_name, new_name):
+        """
+        Compare two snapshots
+        :return: Tuple (list of RepoChange sorted by local name, list of paths of changed config files)
+        """
+        old_repos, new_repos = self.get_repos(old_name), self.get_repos(new_name)
+        changes = [RepoChange(name, old_repos.get(name), new_repos.get(name))
+                   for name in sorted(set(old_repos) | set(new_repos))
+                   if old_repos.get(name) != new_repos.get(name)]
+        old_files, new_files = dict(self.get_files(old_name)), dict(self.get_files(new_name))
+        ignored = {ROSINSTALL_PATH, user_settings['Snapshot']['VERSION_FILE']}
+        changed_files = sorted(path for path in set(old_files) | set(new_files)
+                               if path not in ignored and old_files.get(path) != new_files.get(path))
+        return changes, changed_files
+
+    def find(self, repo, version):
+        """
+        Find all snapshots containing a repo at a commit
+        :param repo: Local name or part of the url of the repo, empty to match any repo
+        :param version: Commit sha, can be abbreviated, or other version (branch, tag)
+        :return: List of tuples (snapshot name, local name, version), newest snapshot first
+        """
+        query = ("SELECT snapshots.name, local_name, repos.version FROM repos "
+                 "JOIN snapshots ON snapshots.id = snapshot_id")
+        if len(version) >= 4:
+            # Prefix match as range, so that the index on versions is used
+            query += " WHERE repos.version >= ? AND repos.version < ?"
+            params = [version, version + u"\uffff"]
+        else:
+            query += " WHERE repos.version = ?"
+            params = [version]
+        if repo:
+            query += " AND (local_name = ? OR uri LIKE '%' || ? || '%' ESCAPE '\\')"
+            params += [repo, escape_like(repo)]
+        query += " ORDER BY snapshots.created DESC, snapshots.name, local_name"
+        return list(self.db.execute(query, params))
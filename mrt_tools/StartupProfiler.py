@@ -0,0 +1,59 @@
+import __builtin__
+import time
+import sys
+
+
+class StartupProfiler(object):
+    """
+    Measures how long each module takes to import.
+
+    The builtin import function is wrapped, so that every module which is imported for the first time gets timed.
+    Time spent in nested imports is tracked separately, so the report can show both the cumulative and the own
+    import time of a module.
+    """
+
+    def __init__(self):
+        self.timings = []
+        self.start_time = None
+        self._original_import = None
+        self._child_times = []
+
+    def start(self):
+        """Install the import hook"""
+        self.start_time = time.time()
+        self._original_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def stop(self):
+        """Remove the import hook again"""
+        if self._original_import is not None:
+            __builtin__.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, *args, **kwargs):
+        if name in sys.modules:
+            return self._original_import(name, *args, **kwargs)
+
+        self._child_times.append(0.0)
+        start = time.time()
+        try:
+            return self._original_import(name, *args, **kwargs)
+        finally:
+            duration = time.time() - start
+            children = self._child_times.pop()
+            if self._child_times:
+                self._child_times[-1] += duration
+            self.timings.append((name, duration, duration - children))
+
+    def report(self, limit=25):
+        """
+        Print the slowest imports to stderr
+        :param limit: Number of modules to show
+        """
+        self.stop()
+        total = time.time() - self.start_time
+        lines = ["", "Startup profile ({:.3f}s total, {} modules imported)".format(total, len(self.timings)),
+                 "{:>10} {:>10}  {}".format("cumul.[s]", "self[s]", "module")]
+        for name, cumulative, own in sorted(self.timings, key=lambda t: t[1], reverse=True)[:limit]:
+            lines.append("{:10.3f} {:10.3f}  {}".format(cumulative, own, name))
+        sys.stderr.write("\n".join(lines) + "\n")
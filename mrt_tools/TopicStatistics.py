@@ -0,0 +1,86 @@
+from collections import OrderedDict
+
+MAX_REPORTED_GAPS = 10
+
+
+class TopicStatistics(object):
+    """
+    Statistics of the messages of one topic, accumulated message by message with constant memory.
+    """
+
+    def __init__(self, msg_type, gap_threshold):
+        """
+        :param msg_type: Message type of the topic
+        :param gap_threshold: Time in seconds between two messages, above which a gap is reported
+        """
+        self.msg_type = msg_type
+        self.gap_threshold = gap_threshold
+        self.count = 0
+        self.bytes = 0
+        self.min_size = None
+        self.max_size = None
+        self.first = None
+        self.last = None
+        self.min_period = None
+        self.max_period = None
+        self.gap_count = 0
+        self.gaps = []  # The first MAX_REPORTED_GAPS gaps as (start time, duration)
+
+    def add(self, size, stamp):
+        """
+        Add a message
+        :param size: Size of the serialized message in bytes
+        :param stamp: Receive time in seconds, not decreasing
+        """
+        self.count += 1
+        self.bytes += size
+        self.min_size = size if self.min_size is None else min(self.min_size, size)
+        self.max_size = size if self.max_size is None else max(self.max_size, size)
+        if self.last is None:
+            self.first = stamp
+        else:
+            period = stamp - self.last
+            self.min_period = period if self.min_period is None else min(self.min_period, period)
+            self.max_period = period if self.max_period is None else max(self.max_period, period)
+            if period > self.gap_threshold:
+                self.gap_count += 1
+                if len(self.gaps) < MAX_REPORTED_GAPS:
+                    self.gaps.append((self.last, period))
+        self.last = stamp
+
+    def to_dict(self):
+        """Returns the statistics in the format stored in the metadata"""
+        def frequency(period):
+            return round(1.0 / period, 3) if period else None
+
+        duration = self.last - self.first if self.count > 1 else 0.0
+        return OrderedDict([
+            ("Type", self.msg_type),
+            ("Messages", self.count),
+            ("Bytes", self.bytes),
+            ("MinSize", self.min_size),
+            ("MaxSize", self.max_size),
+            ("MeanFrequency", round((self.count - 1) / duration, 3) if duration else None),
+            ("MinFrequency", frequency(self.max_period)),
+            ("MaxFrequency", frequency(self.min_period)),
+            ("Gaps", self.gap_count),
+            ("LongestGap", round(self.max_period, 3) if self.gap_count else None),
+            ("GapList", [OrderedDict([("Start", round(start, 3)), ("Duration", round(length, 3))])
+                         for start, length in self.gaps]),
+        ])
+
+
+def compute_statistics(messages, gap_threshold=1.0):
+    """
+    Compute per topic statistics in a single pass
+    :param messages: Iterable of (topic, message type, size in bytes, time in seconds), ordered by time
+    :param gap_threshold: Time in seconds between two messages of a topic, above which a gap is reported
+    :return: OrderedDict {topic: statistics dict}, sorted by topic
+    """
+    topics = {}
+    for topic, msg_type, size, stamp in messages:
+        statistics = topics.get(topic)
+        if statistics is None:
+            statistics = topics[topic] = TopicStatistics(msg_type, gap_threshold)
+        statistics.add(size, stamp)
+    return OrderedDict((topic, topics[topic].to_dict()) for topic in sorted(topics))
@@ -0,0 +1,399 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from mrt_tools.utilities import get_job_count, get_git_version
+from mrt_tools.settings import CONFIG_DIR, user_settings
+from contextlib import contextmanager
+import multiprocessing
+import subprocess
+import urlparse
+import tempfile
+import shutil
+import socket
+import click
+import time
+import re
+import os
+
+# Error messages of git, which indicate a network problem worth retrying
+TRANSIENT_ERRORS = ["Connection reset", "Connection refused", "Connection timed out", "timed out",
+                    "Could not resolve host", "early EOF", "remote end hung up", "The requested URL returned error: 5",
+                    "ssh_exchange_identification", "kex_exchange_identification", "Temporary failure"]
+
+SSH_CONTROL_DIR = os.path.join(CONFIG_DIR, "ssh")
+
+# Oldest git, which can fetch all objects into a partial clone (git fetch --refetch)
+REFETCH_GIT_VERSION = (2, 36)
+
+
+@contextmanager
+def local_reference(path):
+    """Provides a local repo as reference for clones, see UpdateScheduler"""
+    yield path
+
+
+class UpdateResult(object):
+    """Outcome of updating a single repository"""
+
+    def __init__(self, name):
+        self.name = name
+        self.action = None
+        self.duration = 0.0
+        self.attempts = 0
+        self.error = None
+
+    @property
+    def success(self):
+        return self.error is None
+
+
+class UpdateScheduler(object):
+    """
+    Clones and updates the git repositories of a workspace in parallel, without going through wstool.
+
+    The number of workers scales with the number of cores and the measured latency to the git servers. SSH
+    connections to the same host are multiplexed over one ControlMaster connection and transient network errors are
+    retried.
+    """
+
+    def __init__(self, jobs=None, retries=None, verbose=False, references=None, clone_modes=None):
+        """
+        :param jobs: Number of parallel workers, determined automatically if not given
+        :param retries: How often to retry after transient errors
+        :param verbose: Print output of git
+        :param references: Function returning a context manager for a given uri, which yields the path of a local
+                           repo with the same objects or None (see MirrorCache.use and local_reference). Used to
+                           clone without transferring objects over the network.
+        :param clone_modes: Dict {local name: CloneMode} of repos, which are cloned shallow or partial
+        """
+        self.jobs = jobs
+        self.retries = user_settings['Gitlab']['UPDATE_RETRIES'] if retries is None else retries
+        self.verbose = verbose
+        self.references = references
+        self.clone_modes = clone_modes or {}
+        self.env = self.get_git_env()
+
+    @staticmethod
+    def get_git_env():
+        """Environment for git processes, reusing one ssh connection per host"""
+        env = dict(os.environ)
+        env["GIT_TERMINAL_PROMPT"] = "0"
+        persist = user_settings['Gitlab']['SSH_CONTROL_PERSIST']
+        if persist and "GIT_SSH" not in env and "GIT_SSH_COMMAND" not in env:
+            if not os.path.exists(SSH_CONTROL_DIR):
+                os.makedirs(SSH_CONTROL_DIR, 0o700)
+            env["GIT_SSH_COMMAND"] = "ssh -o ControlMaster=auto -o ControlPersist={0} -o ControlPath={1}".format(
+                persist, os.path.join(SSH_CONTROL_DIR, "%C"))
+        return env
+
+    @staticmethod
+    def get_host(uri):
+        """
+        Returns host and port of a git uri
+        :param uri: e.g. https://host/repo.git or git@host:repo.git
+        :return: Tuple (scheme, host, port)
+        """
+        if "://" in uri:
+            parsed = urlparse.urlparse(uri)
+            default_port = {"https": 443, "http": 80, "ssh": 22, "git": 9418}.get(parsed.scheme, 22)
+            return parsed.scheme, parsed.hostname, parsed.port or default_port
+        # scp-like syntax: [user@]host:path
+        host = uri.split(":", 1)[0].split("@")[-1]
+        return "ssh", host, 22
+
+    def open_connections(self, uris):
+        """
+        Open one ssh master connection per host, unless there is one already, and measure the latency to every host
+        :param uris: List of repo uris, either scp-like (user@host:path) or urls (ssh://user@host:port/path)
+        :return: Highest measured connection latency in seconds
+        """
+        latency = 0.0
+        hosts = {self.get_host(uri): uri for uri in uris}
+        for (scheme, host, port), uri in hosts.items():
+            if not host:
+                continue
+            try:
+                start = time.time()
+                socket.create_connection((host, port), timeout=2).close()
+                latency = max(latency, time.time() - start)
+            except (socket.error, socket.timeout):
+                continue
+            if scheme == "ssh" and "ControlMaster" in self.env.get("GIT_SSH_COMMAND", ""):
+                if "://" in uri:
+                    # Same arguments as git passes to ssh, so that the ControlPath matches
+                    parsed = urlparse.urlparse(uri)
+                    ssh_args = ["-p", str(parsed.port)] if parsed.port else []
+                    ssh_args.append("{0}@{1}".format(parsed.username, host) if parsed.username else host)
+                else:
+                    ssh_args = [uri.split(":", 1)[0]]
+                ssh_command = self.env["GIT_SSH_COMMAND"].split()
+                with open(os.devnull, "w") as devnull:
+                    # The master of an earlier run may still be alive (ControlPersist). Another master could not bind
+                    # the control socket and would stay around as a detached session, which never exits.
+                    if subprocess.call(ssh_command + ["-O", "check"] + ssh_args, stdout=devnull, stderr=devnull,
+                                       env=self.env) != 0:
+                        subprocess.call(ssh_command + ["-o", "ConnectTimeout=5", "-MNf"] + ssh_args, stdout=devnull,
+                                        stderr=devnull, env=self.env)
+        return latency
+
+    def get_worker_count(self, tasks, latency):
+        """
+        Network bound tasks profit from more workers than cores. The higher the latency, the more workers are used.
+        :param tasks: Number of repos
+        :param latency: Connection latency in seconds
+        """
+        if self.jobs:
+            return max(1, min(self.jobs, tasks))
+        workers = get_job_count(tasks)
+        workers = int(workers * min(4.0, 1.0 + latency / 0.05))
+        return max(1, min(workers, tasks, 8 * multiprocessing.cpu_count()))
+
+    def run_git(self, args, cwd=None):
+        process = subprocess.Popen(["git"] + args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   env=self.env)
+        output, _ = process.communicate()
+        if process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, "git " + " ".join(args), output)
+        return output
+
+    @staticmethod
+    def get_repo_key(uri):
+        """Identifies a repo independent of the protocol of its uri"""
+        if "://" in uri:
+            host, path = UpdateScheduler.get_host(uri)[1], uri.split("://", 1)[1].split("/", 1)[-1]
+        elif re.match("^[^/]+:", uri):
+            host, path = UpdateScheduler.get_host(uri)[1], uri.split(":", 1)[1]
+        else:
+            host, path = "localhost", os.path.abspath(uri)  # Local path
+        path = path.strip("/")
+        if path.endswith(".git"):
+            path = path[:-len(".git")]
+        return "{0}/{1}".format(host, path).lower()
+
+    @staticmethod
+    def find_local_repos(directory):
+        """
+        Find git repos below a directory, which can serve as reference for clones
+        :return: Dict {repo key: path}
+        """
+        repos = {}
+        for root, dirs, files in os.walk(directory):
+            is_bare = "HEAD" in files and "objects" in dirs and "refs" in dirs
+            if ".git" not in dirs and ".git" not in files and not is_bare:
+                continue
+            dirs[:] = []  # Do not descend into repos
+            try:
+                uri = subprocess.check_output(["git", "-C", root, "config", "--get", "remote.origin.url"]).strip()
+            except subprocess.CalledProcessError:
+                continue
+            repos.setdefault(UpdateScheduler.get_repo_key(uri), root)
+        return repos
+
+    @staticmethod
+    def is_sha(version):
+        return bool(version and re.match("^[0-9a-f]{40}$", version))
+
+    def has_commit(self, repo, version):
+        """Whether a local repo contains a commit, given by its full sha"""
+        if not self.is_sha(version):
+            return False  # Branches and tags of the local repo can differ from the remote
+        with open(os.devnull, "w") as devnull:
+            return subprocess.call(["git", "-C", repo, "cat-file", "-e", version + "^{commit}"], stdout=devnull,
+                                   stderr=devnull) == 0
+
+    @staticmethod
+    def is_shallow(path):
+        return os.path.exists(os.path.join(path, ".git", "shallow"))
+
+    def clone(self, path_spec, path, mode=None):
+        """Clone a repo and checkout the requested version"""
+        uri, version = path_spec.get_uri(), path_spec.get_version()
+        with self.references(uri) if self.references else local_reference(None) as reference:
+            local = self.clone_from(uri, version, path, reference, mode)
+        if version:
+            self.fetch_pinned_commit(path, version, mode)
+            self.run_git(["-C", path, "checkout", "--quiet", version])
+        if local:
+            self.remove_reference_refs(path)
+
+    def clone_from(self, uri, version, path, reference, mode=None):
+        """
+        Clone a repo without checking out files, using a local reference repo if given
+        :return: True if the repo was cloned from the reference, without contacting the server
+        """
+        if reference and version and self.has_commit(reference, version):
+            # Pinned commit is available locally, clone without network access. Objects are hardlinked.
+            self.run_git(["clone", "--quiet", "--no-checkout", reference, path])
+            self.run_git(["-C", path, "remote", "set-url", "origin", uri])
+            return True
+        else:
+            args = ["clone", "--quiet"]
+            if reference:
+                # Only objects missing in the reference are transferred
+                args += ["--reference", reference, "--dissociate"]
+            if version:
+                args.append("--no-checkout")  # Check out the requested version only
+            if mode is not None:
+                args += mode.get_clone_args()
+                if mode.depth and version and not self.is_sha(version):
+                    args += ["--branch", version]  # A shallow clone only contains one branch
+            self.run_git(args + [uri, path])
+            return False
+
+    def remove_reference_refs(self, path):
+        """
+        Remove the branches copied from a reference repo. They show the state of the reference (including its unpushed
+        commits) instead of the one of the server. The server's branches are fetched with the next update.
+        """
+        refs = self.run_git(["-C", path, "for-each-ref", "--format=%(refname)", "refs/heads/", "refs/remotes/"])
+        for ref in refs.split():
+            self.run_git(["-C", path, "update-ref", "--no-deref", "-d", ref])
+
+    def fetch_pinned_commit(self, path, version, mode):
+        """A shallow clone contains the requested commit only if it is at the tip of a branch, fetch it otherwise"""
+        if mode is not None and mode.depth and self.is_shallow(path) and self.is_sha(version) and \
+                not self.has_commit(path, version):
+            self.run_git(["-C", path, "fetch", "--quiet", "--depth", str(mode.depth), "origin", version])
+
+    def pull(self, path_spec, path, mode=None):
+        """
+        Fetch a repo and fast forward to the requested version. Shallow repos only receive the new commits.
+        The remote of the current branch is fetched (origin for detached heads). Pinned commits of shallow clones and
+        full clones are fetched from origin, the remote name used by wstool and by clone.
+        """
+        self.run_git(["-C", path, "fetch", "--quiet", "--prune"])
+        if path_spec.get_version():
+            self.fetch_pinned_commit(path, path_spec.get_version(), mode)
+            self.run_git(["-C", path, "checkout", "--quiet", path_spec.get_version()])
+        try:
+            self.run_git(["-C", path, "rev-parse", "--abbrev-ref", "--symbolic-full-name", "@{u}"])
+        except subprocess.CalledProcessError:
+            return  # Detached head or no tracking branch, nothing to merge
+        self.run_git(["-C", path, "merge", "--ff-only", "--quiet", "@{u}"])
+
+    def make_full_clone(self, path):
+        """
+        Fetch the complete history and all objects into a shallow or partial clone
+        :return: True if the repo was not a full clone before
+        """
+        changed = False
+        if self.is_shallow(path):
+            # Shallow clones track a single branch only
+            self.run_git(["-C", path, "config", "remote.origin.fetch", "+refs/heads/*:refs/remotes/origin/*"])
+            self.run_git(["-C", path, "fetch", "--quiet", "--unshallow", "origin"])
+            changed = True
+        try:
+            self.run_git(["-C", path, "config", "--get", "remote.origin.partialclonefilter"])
+        except subprocess.CalledProcessError:
+            return changed  # Not a partial clone
+        self.run_git(["-C", path, "config", "--unset", "remote.origin.partialclonefilter"])
+        if get_git_version() >= REFETCH_GIT_VERSION:
+            self.run_git(["-C", path, "fetch", "--quiet", "--refetch", "origin"])
+        else:
+            self.refetch(path)
+        return True
+
+    def refetch(self, path):
+        """
+        Fetch all objects of the server into a partial clone, for git versions without fetch --refetch.
+        A normal fetch skips the missing blobs, because the server only sends objects which are not reachable from the
+        local commits. Fetching into an empty repo negotiates nothing, its packs are moved into the partial clone.
+        """
+        uri = self.run_git(["-C", path, "config", "--get", "remote.origin.url"]).strip()
+        tmp_dir = tempfile.mkdtemp(dir=os.path.join(path, ".git"), prefix="refetch.")
+        try:
+            self.run_git(["init", "--quiet", "--bare", tmp_dir])
+            # Small fetches would be unpacked into loose objects otherwise
+            self.run_git(["-C", tmp_dir, "-c", "fetch.unpackLimit=1", "fetch", "--quiet", uri,
+                          "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*"])
+            pack_dir = os.path.join(tmp_dir, "objects", "pack")
+            # Indexes are moved last, git only uses packs with an index
+            for name in sorted(os.listdir(pack_dir), key=lambda n: n.endswith(".idx")):
+                shutil.move(os.path.join(pack_dir, name), os.path.join(path, ".git", "objects", "pack", name))
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def update_repo(self, element):
+        """
+        Clone or update one repository, retrying after transient errors
+        :param element: wstool config element
+        :return: UpdateResult
+        """
+        path_spec = element.get_path_spec()
+        path = element.get_path()
+        mode = self.clone_modes.get(element.get_local_name())
+        result = UpdateResult(element.get_local_name())
+        result.action = "update" if os.path.isdir(os.path.join(path, ".git")) else "clone"
+        start = time.time()
+        while True:
+            result.attempts += 1
+            try:
+                if result.action == "clone":
+                    self.clone(path_spec, path, mode)
+                else:
+                    self.pull(path_spec, path, mode)
+                result.error = None
+                break
+            except subprocess.CalledProcessError as err:
+                result.error = err.output.strip() or str(err)
+                if result.attempts > self.retries or not any(e in result.error for e in TRANSIENT_ERRORS):
+                    break
+                if result.action == "clone" and os.path.exists(path):
+                    # Retry from scratch after an interrupted clone
+                    shutil.rmtree(path, ignore_errors=True)
+                time.sleep(2 ** (result.attempts - 1))
+        result.duration = time.time() - start
+        return result
+
+    def run(self, elements):
+        """
+        Update several repositories in parallel
+        :param elements: List of wstool config elements of git repos
+        :return: List of UpdateResults
+        """
+        if not elements:
+            return []
+        latency = self.open_connections([e.get_path_spec().get_uri() for e in elements])
+        workers = self.get_worker_count(len(elements), latency)
+        click.echo("Updating {} repos with {} parallel jobs...".format(len(elements), workers))
+
+        results = []
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(self.update_repo, element) for element in elements]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                self.report_progress(result, len(results), len(elements))
+
+        self.print_summary(results, time.time() - start)
+        return results
+
+    def report_progress(self, result, done, total):
+        prefix = "[{0:>{1}}/{2}] ".format(done, len(str(total)), total)
+        if result.success:
+            retry_info = " after {} attempts".format(result.attempts) if result.attempts > 1 else ""
+            click.echo(prefix + "{0} {1}d ({2:.1f}s{3})".format(result.name, result.action, result.duration,
+                                                                retry_info))
+        else:
+            click.secho(prefix + "{0} failed to {1} ({2:.1f}s)".format(result.name, result.action, result.duration),
+                        fg="red")
+        if self.verbose or not result.success:
+            for line in (result.error or "").splitlines():
+                click.echo("    " + line)
+
+    @staticmethod
+    def print_summary(results, wall_time, count=10):
+        """Print the slowest repos and all failures"""
+        slowest = sorted(results, key=lambda r: r.duration, reverse=True)[:count]
+        name_width = max([len(r.name) for r in slowest] + [4])
+        click.echo("")
+        click.echo("Slowest repos:")
+        click.echo("{0:<{1}}  {2:<6}  {3:>8}  {4:>8}".format("Repo", name_width, "Action", "Time[s]", "Attempts"))
+        for r in slowest:
+            click.echo("{0:<{1}}  {2:<6}  {3:>8.1f}  {4:>8}".format(r.name, name_width, r.action, r.duration,
+                                                                    r.attempts))
+        failed = [r.name for r in results if not r.success]
+        click.echo("")
+        click.echo("Updated {0} repos in {1:.1f}s (sum of repo times {2:.1f}s)".format(
+            len(results), wall_time, sum(r.duration for r in results)))
+        if failed:
+            click.secho("Failed: " + ", ".join(sorted(failed)), fg="red")
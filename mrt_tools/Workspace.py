@@ -1,15 +1,24 @@
-from mrt_tools.utilities import changed_base_yaml, update_apt_and_ros_packages, self_dir, is_ros_sourced
+from mrt_tools.utilities import changed_base_yaml, update_apt_and_ros_packages, self_dir, is_ros_sourced, \
+    write_atomic, get_package_names_file, read_git_urls, get_git_url_cache_file, get_clone_mode_file
 from wstool import multiproject_cli, config_yaml, multiproject_cmd, config as wstool_config
 from mrt_tools.Git import Git, test_git_credentials
+from mrt_tools.PackageIndex import PackageIndex
+from mrt_tools.DependencyGraph import DependencyGraph, DEPENDENCY_TYPES
+from mrt_tools.RosdepResolver import RosdepResolver
+from mrt_tools.RepoInspector import RepoInspector
+from mrt_tools.UpdateScheduler import UpdateScheduler
+from mrt_tools.MirrorCache import MirrorCache
+from mrt_tools.CloneMode import CloneMode
+from mrt_tools.settings import user_settings
 from catkin_tools.context import Context
-from catkin_pkg import packages
 import subprocess
+import tempfile
+import filecmp
 import click
 import shutil
 import yaml
 import sys
 import os
-import re
 
 
 class Workspace(object):
@@ -25,11 +34,13 @@ class Workspace(object):
         self.catkin_config = None
         self.catkin_pkgs = None
         self.catkin_pkg_names = None
+        self.index = None
+        self.dependency_graph = None
 
         if self.root is not None:
             self.src = self.root + "/src/"
+            self.index = PackageIndex(self.root, self.src)
             self.load()
-            self.catkin_pkgs = self.get_catkin_packages()
             self.catkin_pkg_names = self.get_catkin_package_names()
             self.wstool_pkg_names = self.get_wstool_package_names()
             if not set(self.catkin_pkg_names).issubset(set(self.wstool_pkg_names)):
@@ -37,6 +48,7 @@ class Workspace(object):
                 #             "url_in_package_xml'", fg='yellow')
                 # TODO Maybe not so smart to change rosinstall file every time -> snapshots!
                 self.recreate_index()
+            self.update_package_names_file()
             self.cd_root()
         elif not quiet:
             click.secho("No_catkin_workspace_root_found.", fg="red")
@@ -64,8 +76,8 @@ class Workspace(object):
         subprocess.call("catkin build", shell=True)
 
         self.src = self.root + "/src/"
+        self.index = PackageIndex(self.root, self.src)
         self.load()
-        self.catkin_pkgs = self.get_catkin_packages()
         catkin_pkgs = set(self.get_catkin_package_names())
         wstool_pks = set(self.get_wstool_package_names())
         if not catkin_pkgs.issubset(wstool_pks):
@@ -136,14 +148,31 @@ class Workspace(object):
         self.catkin_pkgs = self.get_catkin_packages()
 
     def write(self):
-        """Write to .rosinstall in workspace"""
-        config_yaml.generate_config_yaml(self.wstool_config, self.src + ".rosinstall", "")
+        """Write to .rosinstall in workspace. The file is replaced atomically and only if its content changed.
+        :return: Whether the file was changed
+        """
+        filename = os.path.join(self.src, ".rosinstall")
+        fd, tmp_name = tempfile.mkstemp(dir=self.src, prefix=".rosinstall.")
+        os.close(fd)
+        try:
+            config_yaml.generate_config_yaml(self.wstool_config, tmp_name, "")
+            if os.path.exists(filename) and filecmp.cmp(tmp_name, filename, shallow=False):
+                os.remove(tmp_name)
+                return False
+            os.chmod(tmp_name, 0o644)
+            os.rename(tmp_name, filename)
+            return True
+        except (IOError, OSError):
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
 
-    def add(self, pkg_name, url, update=True):
+    def add(self, pkg_name, url, update=True, clone_mode=None):
         """Add a repository to the workspace
         :param pkg_name: Name of package
         :param url: URL to git repo
         :param update: Run wstool update to pull new commits afterwards?
+        :param clone_mode: CloneMode of the new repo, defaults to the one in the settings
         """
         ps = config_yaml.PathSpec(pkg_name, "git", url)
         self.wstool_config.add_path_spec(ps)
@@ -152,7 +181,7 @@ class Workspace(object):
             self.write()
             if url.startswith("https"):
                 test_git_credentials()
-            self.update_only(pkg_name)
+            self.update_only(pkg_name, clone_mode=clone_mode)
             # Fix for issue #9 to make ros cfg files executable
             subprocess.call("find " + os.path.join(self.src, pkg_name) + " -name \*.cfg -exec chmod 755 {} \;",
                             shell=True)
@@ -163,53 +192,113 @@ class Workspace(object):
         """
         return pkg_name in self.get_wstool_package_names()
 
-    def update(self):
-        """Update this workspace"""
+    def update(self, jobs=None, references=None, clone_mode=None):
+        """Update this workspace
+        :param jobs: Number of parallel jobs, determined automatically if not given
+        :param references: Function returning a local repo to clone a uri from, see UpdateScheduler
+        :param clone_mode: CloneMode of repos, which are cloned
+        """
         if self.contains_https():
             test_git_credentials()
-        subprocess.call("wstool update -t {0} -j 10".format(self.src), shell=True)
+        return self.update_only(self.get_wstool_package_names(), jobs=jobs, references=references,
+                                clone_mode=clone_mode)
 
-    def update_only(self, pkgs):
+    def update_only(self, pkgs, jobs=None, references=None, clone_mode=None):
         """Update this workspace
         :param pkgs: Names of packages to be updated
+        :param jobs: Number of parallel jobs, determined automatically if not given
+        :param references: Function returning a local repo to clone a uri from, see UpdateScheduler. Defaults to the
+                           shared mirror cache.
+        :param clone_mode: CloneMode of repos, which are cloned. Defaults to the recorded mode of the repo or the one
+                           in the settings.
+        :return: List of UpdateResults of the git repos
         """
-        jobs = 1
-        if isinstance(pkgs, list):
-            jobs = len(pkgs)
-            jobs = 10 if jobs > 10 else jobs
-            pkgs = " ".join(pkgs)
-        subprocess.call("wstool update -t {0} -j {1} {2}".format(self.src, jobs, pkgs), shell=True)
-
-    def unpushed_repos(self, pkg_name=None, quiet=False):
-        """Search for unpushed commits in workspace
+        if not isinstance(pkgs, list):
+            pkgs = [pkgs]
+        elements = [e for e in self.get_wstool_packages() if e.get_local_name() in pkgs]
+        unknown = sorted(set(pkgs) - set(e.get_local_name() for e in elements))
+        if unknown:
+            click.secho("Not in this workspace: " + ", ".join(unknown), fg="red")
+            sys.exit(1)
+        git_elements = [e for e in elements if e.get_path_spec().get_scmtype() == "git"]
+
+        # Record how new repos are cloned. Existing repos keep their mode, it is used to keep shallow repos shallow.
+        clone_modes = self.get_clone_modes()
+        new_repos = [e.get_local_name() for e in git_elements if not os.path.isdir(os.path.join(e.get_path(), ".git"))]
+        for name in new_repos:
+            clone_modes[name] = clone_mode or clone_modes.get(name) or CloneMode.default()
+        if new_repos:
+            CloneMode.save(get_clone_mode_file(self.root), clone_modes)
+
+        mirrors = None
+        if references is None and user_settings['Cache']['USE_MIRROR_CACHE']:
+            mirrors = MirrorCache()
+            modes_by_uri = {e.get_path_spec().get_uri(): clone_modes.get(e.get_local_name()) for e in git_elements}
+
+            def references(uri):
+                # Shallow and partial clones only use mirrors which exist already
+                mode = modes_by_uri.get(uri)
+                return mirrors.use(uri, create=mode is None or mode.is_full)
+
+        results = UpdateScheduler(jobs=jobs, references=references, clone_modes=clone_modes).run(git_elements)
+        if mirrors is not None:
+            mirrors.start_refresh()
+
+        # Other version control systems are left to wstool
+        others = [e.get_local_name() for e in elements if e not in git_elements]
+        if others:
+            subprocess.call(["wstool", "update", "-t", self.src, "-j", str(min(len(others), 10))] + others)
+        return results
+
+    def get_clone_modes(self):
+        """Returns a dict {package name: CloneMode} of all repos, which are shallow or partial clones"""
+        return CloneMode.load(get_clone_mode_file(self.root))
+
+    def make_full_clone(self, pkgs):
+        """Turn shallow and partial clones into full clones
+        :param pkgs: Names of packages
+        :return: Names of packages, which could not be converted
+        """
+        clone_modes = self.get_clone_modes()
+        scheduler = UpdateScheduler()
+        failed = []
+        for pkg in pkgs:
+            click.echo("Fetching full history of {}...".format(pkg))
+            try:
+                scheduler.make_full_clone(os.path.join(self.src, pkg))
+            except subprocess.CalledProcessError as err:
+                click.secho(err.output.strip() or str(err), fg="red")
+                failed.append(pkg)
+                continue
+            clone_modes.pop(pkg, None)
+        CloneMode.save(get_clone_mode_file(self.root), clone_modes)
+        return failed
+
+    def inspect_repos(self, pkg_name=None):
+        """Collect the git status of all repos in this workspace in parallel
         :param pkg_name: Look for only one specified package name
+        :return: List of RepoStatus objects
         """
-        # Read in again
-        self.catkin_pkg_names = self.get_catkin_package_names()
         self.wstool_pkg_names = self.get_wstool_package_names()
-        unpushed_repos = []
-        for pkg in self.wstool_pkg_names:
-            if pkg not in self.catkin_pkg_names:
-                continue
+        repos = [(pkg, os.path.join(self.src, pkg)) for pkg in self.wstool_pkg_names if not pkg_name or pkg == pkg_name]
+        return RepoInspector().inspect(repos)
 
-            # If we are only looking for one specific pkg:
-            if pkg_name and pkg != pkg_name:
-                continue
+    def unpushed_repos(self, pkg_name=None, quiet=False, repo_status=None):
+        """Search for unpushed commits in workspace
+        :param pkg_name: Look for only one specified package name
+        :param quiet: Do not print the unpushed commits
+        :param repo_status: Result of inspect_repos, if available already
+        """
+        if repo_status is None:
+            repo_status = self.inspect_repos(pkg_name)
 
-            try:
-                os.chdir(self.src + pkg)
-                git_process = subprocess.Popen("git log --branches --not --remotes", shell=True, stdout=subprocess.PIPE)
-                result = git_process.communicate()
-
-                if result[0] != "":
-                    if not quiet:
-                        click.secho("Unpushed commits in repo '" + pkg + "'", fg="yellow")
-                        subprocess.call("git log --branches --not --remotes --oneline", shell=True)
-                    unpushed_repos.append(pkg)
-            except OSError:  # Directory does not exist (repo not cloned yet)
-                pass
-
-        os.chdir(self.org_dir)
+        unpushed_repos = []
+        for status in repo_status:
+            if status.unpushed:
+                if not quiet:
+                    click.secho("Unpushed commits in repo '" + status.name + "'", fg="yellow")
+                    click.echo("\n".join(status.unpushed))
+                unpushed_repos.append(status.name)
         return unpushed_repos
 
     def test_for_changes(self, pkg_name=None, quiet=False, prompt="Are you sure you want to continue?"):
@@ -219,24 +308,24 @@ class Workspace(object):
         :param pkg_name:
         :param prompt:
         """
-        # Parse git status messages
-        statuslist = multiproject_cmd.cmd_status(self.wstool_config, untracked=True)
-        statuslist = [{k["entry"].get_local_name(): k["status"]} for k in statuslist if k["status"] != ""]
-
-        if pkg_name:
-            statuslist = [line for line in statuslist if pkg_name in line]
+        # Read the status of all repos in one pass
+        repo_status = self.inspect_repos(pkg_name)
+        # Repos which could not be inspected might contain changes as well
+        statuslist = [status for status in repo_status if status.changes or status.untracked or status.error]
 
         # Check for unpushed commits
-        unpushed_repos = self.unpushed_repos(pkg_name, quiet=quiet)
+        unpushed_repos = self.unpushed_repos(pkg_name, quiet=quiet, repo_status=repo_status)
 
         # Prompt user if changes detected
         if len(unpushed_repos) > 0 or len(statuslist) > 0:
             if not quiet:
                 if len(statuslist) > 0:  # Unpushed repos where asked already
                     click.secho("\nYou have the following uncommited changes:", fg="red")
-                    for e in statuslist:
-                        click.echo(list(e.keys())[0])
-                        click.echo(list(e.values())[0])
+                    for status in statuslist:
+                        click.echo(status.name)
+                        if status.error:
+                            click.secho("Could not read the git status: " + status.error, fg="red")
+                        click.echo("\n".join(status.changes + status.untracked))
                     click.confirm(prompt, abort=True)
             return True
         else:
@@ -251,14 +340,29 @@ class Workspace(object):
             f.writelines(yaml.safe_dump(source_aggregate))
 
     def get_catkin_packages(self):
-        """Returns a dict of all catkin packages"""
-        return packages.find_packages(self.src)
+        """Returns a dict of all catkin packages. Only manifests that changed since the last call are parsed."""
+        return self.index.get_packages()
 
     def get_catkin_package_names(self):
         """Returns a list of all catkin packages in ws"""
         self.catkin_pkgs = self.get_catkin_packages()
         return [k for k, v in list(self.catkin_pkgs.items())]
 
+    def update_package_names_file(self):
+        """Write the package names of this workspace to a file, which is read for autocompletion"""
+        content = "\n".join(sorted(self.catkin_pkg_names)) + "\n"
+        filename = get_package_names_file(self.root)
+        try:
+            with open(filename, "r") as f:
+                if f.read() == content:
+                    return
+        except (IOError, OSError):
+            pass
+        try:
+            write_atomic(filename, content)
+        except (IOError, OSError):
+            pass  # Autocompletion is not worth failing for
+
     def get_wstool_packages(self):
         """Returns a list of all wstool packages in ws"""
         return self.wstool_config.get_config_elements()
@@ -268,33 +372,34 @@ class Workspace(object):
         self.wstool_pks = self.get_wstool_packages()
         return [pkg.get_local_name() for pkg in self.wstool_pks]
 
+    def get_dependency_graph(self):
+        """Returns the dependency graph of all packages in this workspace. It is only rebuilt when packages changed."""
+        self.catkin_pkgs = self.get_catkin_packages()
+        if self.dependency_graph is None or self.dependency_graph.packages != self.catkin_pkgs:
+            self.dependency_graph = DependencyGraph(self.catkin_pkgs)
+        return self.dependency_graph
+
     def get_dependencies(self, pkg_name, deep=False):
         """Returns a dict of all dependencies
         :param pkg_name: Name of package
         :param deep: Recursively retrieve dependencies
         """
-        deps = {d: {} for d in self.get_all_dependencies(pkg_name)}
+        graph = self.get_dependency_graph()
         if deep:
-            for k in deps.keys():
-                deps.update(self.get_dependencies(k, deep))
-        return {pkg_name: deps}
+            return graph.to_tree(pkg_name)
+        return {pkg_name: {d: {} for d in graph.dependencies(pkg_name)}}
 
     def get_all_dependencies(self, pkg_name):
         """Returns a flat list of dependencies"""
-        deps = set()
-        if pkg_name in self.catkin_pkgs.keys():
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].build_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].build_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].build_export_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].exec_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].doc_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].buildtool_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].buildtool_export_depends})
-            deps.update({d.name for d in self.catkin_pkgs[pkg_name].test_depends})
-        return deps
-
-    def resolve_dependencies(self, git=None, default_yes=None):
-        # TODO maybe use rosdep2 package directly
+        return self.get_dependency_graph().dependencies(pkg_name)
+
+    def resolve_dependencies(self, git=None, default_yes=None, resolver=None, clone_mode=None):
+        """Clone missing workspace dependencies from gitlab and install missing system dependencies.
+        :param git: Git object to search for repos, created if needed
+        :param default_yes: Do not ask before installing
+        :param resolver: RosdepResolver to use, created if needed
+        :param clone_mode: CloneMode of cloned dependencies, defaults to the one in the settings
+        """
         click.echo("Resolving dependencies...")
         # Test whether ros is sourced
         if is_ros_sourced() is False:
@@ -304,78 +409,93 @@ class Workspace(object):
         if changed_base_yaml():
             click.secho("Base YAML file changed, running 'rosdep update'.", fg="green")
             subprocess.call("rosdep update", shell=True)
+            if resolver is not None:
+                resolver.invalidate()
 
-        if not git:
-            git = Git()
-
-        regex_rosdep_resolve = re.compile("ERROR\[([^\]]*)\]: Cannot locate rosdep definition for \[([^\]]*)\]")
+        resolver = resolver or RosdepResolver()
+        dep_types = [t for t in DEPENDENCY_TYPES if t != "doc"]
+        underlay_pkgs = resolver.get_underlay_packages()
 
+        # Iterate until no new packages appear in the workspace
         while True:
-            rosdep_process = subprocess.Popen(['rosdep', 'check', '--from-paths', self.src, '--ignore-src'],
-                                              stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-            rosdep_output, rosdep_err = rosdep_process.communicate()
-
-            if not rosdep_err:
-                break
-
-            missing_packages = dict()
-            for match in regex_rosdep_resolve.finditer(rosdep_err):
-                missing_packages[match.group(2)] = match.group(1)
-
+            graph = self.get_dependency_graph()
+            ws_pkgs = set(graph.packages_by_name)
+            deps = set()
+            for pkg in ws_pkgs:
+                deps |= graph.dependencies(pkg, dep_types)
+            system_deps, missing_packages = resolver.resolve(deps - ws_pkgs - underlay_pkgs)
             if not missing_packages:
-                click.echo(rosdep_output)
-                click.echo(rosdep_err)
-                sys.exit(1)
+                break
 
+            if not git:
+                git = Git()
             gitlab_packages = []
-            for missing_package, package_dep_specified in missing_packages.items():
+            not_found = []
+            for missing_package in missing_packages:
                 # Search for package in gitlab
                 repo = git.find_repo(missing_package)
                 if repo:
-                    url = repo[git.get_url_string()]
-                    self.add(missing_package, url, update=True)
+                    self.add(missing_package, repo[git.get_url_string()], update=False)
                     gitlab_packages.append(missing_package)
                 else:
-                    # no Gitlab project found
-                    if not self.updated_apt:
-                        # first not found package. Update apt-get and ros.
-                        click.secho("Updating mrt apt-get and rosdep and resolve again. This might take a while ...",
-                                    fg='green')
-                        update_apt_and_ros_packages()
-                        self.updated_apt = True
-                        break
-                    else:
-                        click.secho(
-                            "Package {0} (requested from: {1}) could not be found.".format(missing_package,
-                                                                                           package_dep_specified),
-                            fg='red')
-                        sys.exit(1)
-            # Load new gitlab packages
-            self.write()
+                    not_found.append(missing_package)
+
+            if gitlab_packages:
+                # Clone all new packages at once. Their dependencies are resolved in the next pass.
+                self.write()
+                if self.contains_https():
+                    test_git_credentials()
+                self.update_only(gitlab_packages, clone_mode=clone_mode)
+                continue
 
-        # install missing system dependencies
-        if default_yes:
-            subprocess.check_call(["rosdep", "install", "--default-yes", "--from-paths", self.src, "--ignore-src"])
-        else:
-            subprocess.check_call(["rosdep", "install", "--from-paths", self.src, "--ignore-src"])
+            if not self.updated_apt:
+                # first not found package. Update apt-get and ros.
+                click.secho("Updating mrt apt-get and rosdep and resolve again. This might take a while ...",
+                            fg='green')
+                update_apt_and_ros_packages()
+                resolver.invalidate()
+                self.updated_apt = True
+                continue
 
-    def recreate_index(self, write=True):
+            for missing_package in not_found:
+                requested_by = graph.reverse_dependencies(missing_package, dep_types) & ws_pkgs
+                click.secho("Package {0} (requested from: {1}) could not be found.".format(
+                    missing_package, ", ".join(sorted(requested_by))), fg='red')
+            sys.exit(1)
+
+        # install missing system dependencies with a single apt call
+        apt_packages = resolver.get_packages_to_install("apt", system_deps.pop("apt", []))
+        if apt_packages:
+            click.echo("Installing system dependencies: " + " ".join(apt_packages))
+            subprocess.check_call(["sudo", "apt-get", "install"] + (["--yes"] if default_yes else []) + apt_packages)
+
+        # Other installers (pip, source...) are left to rosdep
+        if any(system_deps.values()):
+            rosdep_install = ["rosdep", "install", "--from-paths", self.src, "--ignore-src"]
+            subprocess.check_call(rosdep_install + (["--default-yes"] if default_yes else []))
+
+    def recreate_index(self, write=True, reset=False):
         """Goes through all directories within the workspace and checks whether the rosinstall file is up to date.
+        Entries of repos which were added, removed or got a new url are changed, all others are kept as they are.
         :param write: Export new index to file
+        :param reset: Start from an empty index instead of the current one
         """
         self.catkin_pkg_names = self.get_catkin_package_names()
 
-        self.wstool_config = wstool_config.Config([], self.src)
+        if reset or self.wstool_config is None:
+            self.wstool_config = wstool_config.Config([], self.src)
         self.cd_src()
 
+        # Only repos whose git config changed since the last call are read again
+        urls = read_git_urls(self.src, self.catkin_pkg_names, get_git_url_cache_file(self.root))
+        urls = {pkg: urls[pkg] for pkg in self.catkin_pkg_names if pkg in urls}
+        current = {e.get_local_name(): e.get_path_spec().get_uri() for e in self.get_wstool_packages()}
+        for pkg, url in current.items():
+            if urls.get(pkg) != url:
+                self.wstool_config.remove_element(pkg)
         for pkg in self.catkin_pkg_names:
-            # Try reading it from git repo
-            try:
-                with open(pkg + "/.git/config", 'r') as f:
-                    git_url = next(line[7:-1] for line in f if line.startswith("\turl"))
-                    self.add(pkg, git_url, update=False)
-            except (IOError, StopIteration):
-                pass
+            if pkg in urls and current.get(pkg) != urls[pkg]:
+                self.add(pkg, urls[pkg], update=False)
 
         # Create rosinstall file from config
         if write:
@@ -0,0 +1,213 @@
+from mrt_tools.utilities import write_atomic
+import cPickle as pickle
+import hashlib
+import tarfile
+import pipes
+import json
+import zlib
+import stat
+import os
+
+MANIFEST_FILE = ".mrt_sync_manifest"
+
+
+def hash_file(path):
+    """Returns the sha1 of the content of a file or the target of a symlink"""
+    if os.path.islink(path):
+        return hashlib.sha1(os.readlink(path)).hexdigest()
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 ** 2), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(src, cache_file=None):
+    """
+    Hash all files of a source folder. Hidden files and folders (e.g. .git) are skipped. Files, whose size and mtime
+    did not change since the last call, are not read again.
+    :param src: Directory to hash
+    :param cache_file: File to store the hashes in
+    :return: Dict {relative path: "<sha1> <mode>"}
+    """
+    cache = {}
+    if cache_file:
+        try:
+            with open(cache_file, "rb") as f:
+                cache = pickle.load(f)
+        except Exception:  # Missing or corrupt cache files are simply rebuilt
+            cache = {}
+
+    entries = {}
+    manifest = {}
+    for root, dirs, files in os.walk(src):
+        # Symlinks to directories are transferred as symlinks
+        links = [d for d in dirs if os.path.islink(os.path.join(root, d))]
+        dirs[:] = sorted(d for d in dirs if not d.startswith(".") and d not in links)
+        for name in sorted(files + links):
+            if name.startswith("."):
+                continue
+            path = os.path.join(root, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue  # Removed meanwhile
+            if not stat.S_ISREG(st.st_mode) and not stat.S_ISLNK(st.st_mode):
+                continue
+            rel_path = os.path.relpath(path, src)
+            key = (st.st_size, st.st_mtime, st.st_mode)
+            entry = cache.get(rel_path)
+            if entry is None or entry[0] != key:
+                try:
+                    entry = (key, hash_file(path))
+                except (IOError, OSError):
+                    continue
+            entries[rel_path] = entry
+            manifest[rel_path] = "{0} {1:o}".format(entry[1], stat.S_IMODE(st.st_mode))
+
+    if cache_file and entries != cache:
+        try:
+            write_atomic(cache_file, pickle.dumps(entries, pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
+    return manifest
+
+
+def diff_manifests(local, remote):
+    """
+    :return: Tuple (sorted list of files to transfer, sorted list of files to remove on the remote)
+    """
+    changed = sorted(path for path, entry in local.items() if remote.get(path) != entry)
+    removed = sorted(path for path in remote if path not in local)
+    return changed, removed
+
+
+def add_to_archive(archive, path, arcname):
+    """
+    Add a file or symlink to a tar stream. Regular files are opened before their header is written, so that a file
+    deleted meanwhile raises an error without leaving a broken entry in the stream.
+    """
+    info = archive.gettarinfo(path, arcname=arcname)
+    if info.isreg():
+        with open(path, "rb") as f:
+            archive.addfile(info, f)
+    else:
+        archive.addfile(info)
+
+
+class CountingWriter(object):
+    """File object counting the bytes written to it"""
+
+    def __init__(self, f):
+        self.f = f
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        self.f.write(data)
+
+
+class WorkspaceSync(object):
+    """
+    Mirrors the source folder of a workspace into a folder on a remote host, transferring only changed files.
+
+    The remote folder contains a manifest with the content hash of every file, as of the last sync. Only files whose
+    hash differs from the local one are sent, as a gzip compressed tar stream over the ssh connection. No temporary
+    archive is written on either side. Files which were deleted locally are removed on the remote.
+    """
+
+    def __init__(self, ssh, remote_src):
+        """
+        :param ssh: Connected paramiko SSHClient
+        :param remote_src: Absolute path of the source folder on the remote host
+        """
+        self.ssh = ssh
+        self.remote_src = remote_src
+        self.manifest_path = os.path.join(remote_src, MANIFEST_FILE)
+
+    def run(self, command, data=None, write=None):
+        """
+        Execute a command on the remote host
+        :param data: String to pass to stdin
+        :param write: Function called with a file object writing to stdin
+        :return: Output of the command
+        """
+        stdin, stdout, stderr = self.ssh.exec_command(command)
+        try:
+            if data:
+                stdin.write(data)
+            if write is not None:
+                write(stdin)
+            stdin.flush()
+        finally:
+            stdin.channel.shutdown_write()
+        output = stdout.read()
+        error = stderr.read()
+        if stdout.channel.recv_exit_status() != 0:
+            raise IOError("'{0}' failed: {1}".format(command, error.strip()))
+        return output
+
+    def read_remote_manifest(self):
+        """Returns the manifest of the last sync, or an empty one if the remote folder is new or damaged"""
+        try:
+            data = self.run("cat {} 2>/dev/null || true".format(pipes.quote(self.manifest_path)))
+            manifest = json.loads(zlib.decompress(data)) if data else {}
+        except (IOError, ValueError, zlib.error):
+            return {}
+        return {path.encode("utf-8"): entry for path, entry in manifest.items()}
+
+    def write_remote_manifest(self, manifest):
+        tmp_path = self.manifest_path + ".tmp"
+        self.run("mkdir -p {0} && cat > {1} && mv {1} {2}".format(
+            pipes.quote(self.remote_src), pipes.quote(tmp_path), pipes.quote(self.manifest_path)),
+            data=zlib.compress(json.dumps(manifest, sort_keys=True)))
+
+    def sync(self, local_src, cache_file=None):
+        """
+        Bring the remote source folder to the state of the local one
+        :param local_src: Local source folder
+        :param cache_file: File caching the local hashes, see build_manifest
+        :return: Tuple (number of transferred files, number of removed files, compressed bytes sent)
+        """
+        local = build_manifest(local_src, cache_file)
+        remote = self.read_remote_manifest()
+        changed, removed = diff_manifests(local, remote)
+        if not changed and not removed:
+            return 0, 0, 0
+
+        # Files about to change are dropped from the remote manifest first, so that they are sent again, if the
+        # transfer is interrupted
+        for path in changed + removed:
+            remote.pop(path, None)
+        self.write_remote_manifest(remote)
+
+        if removed:
+            self.remove_remote_files(removed)
+
+        sent = [0]
+        vanished = []
+        if changed:
+            def write_archive(stdin):
+                writer = CountingWriter(stdin)
+                archive = tarfile.open(fileobj=writer, mode="w|gz")
+                for path in changed:
+                    try:
+                        add_to_archive(archive, os.path.join(local_src, path), path)
+                    except (IOError, OSError):
+                        vanished.append(path)  # Deleted since the manifest was built
+                archive.close()
+                sent[0] = writer.count
+
+            self.run("mkdir -p {0} && tar -xzf - -C {0}".format(pipes.quote(self.remote_src)), write=write_archive)
+        if vanished:
+            # The remote must not keep an old version of a file, which is gone locally
+            self.remove_remote_files(vanished)
+            for path in vanished:
+                local.pop(path)
+        self.write_remote_manifest(local)
+        return len(changed) - len(vanished), len(removed), sent[0]
+
+    def remove_remote_files(self, paths):
+        """Remove files relative to the remote source folder, together with folders becoming empty"""
+        self.run("cd {0} && xargs -0 rm -f -- && find . -mindepth 1 -type d -empty -delete".format(
+            pipes.quote(self.remote_src)), data="\0".join(paths))
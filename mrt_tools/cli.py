@@ -1,9 +1,20 @@
+import sys
+
+# Profile imports before anything else gets loaded
+if "--profile-startup" in sys.argv:
+    from mrt_tools.StartupProfiler import StartupProfiler
+    import atexit
+
+    startup_profiler = StartupProfiler()
+    startup_profiler.start()
+    atexit.register(startup_profiler.report)
+
 from distutils.sysconfig import get_python_lib
 from mrt_tools.settings import user_settings
 import mrt_tools.commands
+import importlib
 import os
 import click
-import sys
 
 # Test for sudo
 if os.getuid() == 0:
@@ -37,19 +48,17 @@ class MyCLI(click.MultiCommand):
         return rv
 
     def get_command(self, ctx, name):
-        ns = {}
-        fn = os.path.join(plugin_folder, 'mrt_' + name + '.py')
-        try:
-            with open(fn) as f:
-                code = compile(f.read(), fn, 'exec')
-                eval(code, ns, ns)
-        except IOError:
+        # Plugins are imported as regular modules, so python caches their bytecode and every plugin is only loaded
+        # once per invocation, no matter how often click asks for it.
+        if not os.path.isfile(os.path.join(plugin_folder, 'mrt_' + name + '.py')):
             click.secho("No such subcommand: '{0}'".format(name), fg="red")
             sys.exit(1)
-        return ns['main']
+        return importlib.import_module('mrt_tools.commands.mrt_' + name).main
 
 
-cli = MyCLI(help='A toolbelt full of mrt scripts.')
+cli = MyCLI(help='A toolbelt full of mrt scripts.',
+            params=[click.Option(['--profile-startup'], is_flag=True, expose_value=False,
+                                 help="Print the import time of every loaded module on exit.")])
 
 if __name__ == '__main__':
     cli()
@@ -1,15 +1,19 @@
 from mrt_tools.Workspace import Workspace
+from mrt_tools.WorkspaceSync import WorkspaceSync
+from mrt_tools.settings import user_settings
+from mrt_tools.utilities import get_workspace_cache_dir
 
 import paramiko
 import getpass
+import hashlib
+import posixpath
+import socket
+import pipes
 import os
 import sys
 import time
 import fcntl
 import termios
-import tarfile
-import tempfile
-import stat
 import mrt_tools.DockerCheck
 
 import click
@@ -24,12 +28,15 @@ def main():
 @main.command(short_help="Tests a workspace in a clean environment.",
               help="Builds a workspace on mrtknecht or local in a docker environment. "
                    "All non hidden files of the src folder are transfered to the docker "
-                   "and copied to a newly created catkin workspace. Then a release build "
+                   "and copied to a catkin workspace. Then a release build "
                    "is performed."
-                   "It can be used without pushing your source files to git.")
+                   "It can be used without pushing your source files to git. "
+                   "The workspace on mrtknecht is kept between checks: only changed files are uploaded "
+                   "and the build tree and ccache of the last check are reused.")
 @click.option('--local', is_flag=True, help='Test locally instead on mrtknecht '
                                             '(docker environment must be setup properly).')
-def ws(local):
+@click.option('--clean', is_flag=True, help='Upload everything and build from scratch.')
+def ws(local, clean):
     ws = Workspace()
     ws_root = ws.get_root()
     ws_src = os.path.join(ws_root, "src")
@@ -37,50 +44,33 @@ def ws(local):
         raise Exception("Cannot find workspace source folder")
 
     if local:
-        mrt_tools.DockerCheck.ws(ws_root)
+        mrt_tools.DockerCheck.ws(ws_root, clean=clean)
         return
 
     ssh = _connect()
 
-    # copy data to server
-    sftp = ssh.open_sftp()
-
-    # create docker folder if not exist
-    sftp.chdir("/tmp")
-    if "docker" not in sftp.listdir():
-        sftp.mkdir("docker")
-
-    sftp.chmod("docker", mode=stat.S_IRGRP | stat.S_IWGRP | stat.S_IXGRP | stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
-    sftp.chdir("docker")
-
-    # create temporary file and create tar archive
-    try:
-        tarPathName = tempfile.mkstemp()[1]
-        tarFile = tarfile.TarFile(tarPathName, "w")
-
-        tempFileName = os.path.basename(tarPathName)
-        remote_work_dir = os.path.join("/tmp", "docker", tempFileName)
-
-        # prepare wokspace
-        sftp.mkdir(tempFileName, mode=stat.S_IRUSR | stat.S_IWUSR | stat.S_IXUSR)
+    # Every local workspace has its own workspace on the server
+    remote_dir = user_settings['Check']['REMOTE_WORKSPACE_DIR']
+    remote_user_dir = posixpath.join(remote_dir, getpass.getuser())
+    remote_work_dir = posixpath.join(remote_user_dir, _get_remote_workspace_name(ws_root))
+    sync = WorkspaceSync(ssh, posixpath.join(remote_work_dir, "src"))
+    sync.run("mkdir -p {0} && (chmod 770 {0} 2>/dev/null || true) && mkdir -p {1} && chmod 700 {1}".format(
+        pipes.quote(remote_dir), pipes.quote(remote_user_dir)))
+    if clean:
+        sync.run("rm -rf " + pipes.quote(remote_work_dir))
+
+    # prepare workspace
+    catkin_dir = posixpath.join(remote_work_dir, ".catkin_tools")
+    if not sync.run("test -d {} && echo exists || true".format(pipes.quote(catkin_dir))):
+        sync.run("mkdir -p " + pipes.quote(remote_work_dir))
         _executeSshCommand(ssh, 'bash -c "cd {0} && mrt ws init"'.format(remote_work_dir))
 
-        os.chdir(ws_src)
-        tarFile.add(".", exclude=lambda p: os.path.basename(os.path.abspath(p)).startswith('.'))
-        tarFile.close()
-
-        # copy tar archive to remote
-        dest_tar = os.path.join(remote_work_dir, tempFileName + ".tar")
-        sftp.put(tarPathName, dest_tar)
-    finally:
-        if os.path.exists(tarPathName):
-            os.remove(tarPathName)
-
-    sftp.close()
-
-    remote_work_src = os.path.join(remote_work_dir, "src")
-    ssh.exec_command("tar -xf " + dest_tar + " -C " + remote_work_src)
-    ssh.exec_command("rm " + dest_tar)
+    # copy changed files to remote
+    click.echo("Uploading changed files...")
+    start = time.time()
+    changed, removed, sent = sync.sync(ws_src, os.path.join(get_workspace_cache_dir(ws_root), "check_hashes"))
+    click.echo("Uploaded {0} changed files ({1:.1f} MB) and removed {2} files in {3:.1f}s".format(
+        changed, sent / 1024.0 ** 2, removed, time.time() - start))
 
     # run docker build
     execLine = 'bash -c "cd {0}  && mrt check ws --local"'.format(remote_work_dir)
@@ -106,6 +96,12 @@ def pkg(pkg_name, local):
     _executeSshCommand(ssh, execLine)
 
 
+def _get_remote_workspace_name(ws_root):
+    # The hash distinguishes workspaces with the same name
+    ws_id = hashlib.sha1(socket.gethostname() + ":" + os.path.abspath(ws_root)).hexdigest()[:8]
+    return "{0}_{1}".format(os.path.basename(os.path.abspath(ws_root)), ws_id)
+
+
 def _connect():
     # connect to server per ssh
     print("Connect to mrtknecht")
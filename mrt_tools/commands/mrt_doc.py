@@ -1,8 +1,9 @@
 from mrt_tools.Workspace import Workspace
+from mrt_tools.DagScheduler import DagScheduler
+from mrt_tools.PackageIndex import PackageIndex
+from catkin_tools.context import Context
 from mrt_tools.utilities import *
 
-import catkin_pkg.topological_order
-
 import os
 import subprocess
 import tempfile
@@ -10,18 +11,14 @@ import webbrowser
 import hashlib
 import time
 
-# Autocompletion
-try:
-    tmp_ws = Workspace(quiet=True)
-    suggestions = tmp_ws.get_catkin_package_names()
-    repo_list = import_repo_names()
-    os.chdir(tmp_ws.org_dir)
-except:
-    suggestions = []
-    repo_list = []
-
 self_dir = get_script_root()
 
+# Stored next to the doxygen output, to detect whether the documentation is up to date
+DOC_BUILD_HASH_FILE = ".doc_build_hash"
+
+# Lookup table of package paths, see get_package_paths_
+package_paths_ = {}
+
 
 ########################################################################################################################
 # Package
@@ -37,15 +34,19 @@ def main():
 
 
 @main.command(help="Generate the documentation of a workspace or package.")
-@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=suggestions)
+@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=import_package_names)
 @click.option("--this", is_flag=True, help="Build the package containing the current working directory.")
 @click.option("--no-deps", is_flag=True, help="Only build specified packages, not their dependencies.")
 @click.option("-v", "--verbose", is_flag=True, help="Print the info output of the doc generation")
 @click.option("--workspace-docs", "-w", is_flag=True, default=True,
               help="Build a documentation page with combines all documentation in this workspace")
-def build(pkg_name, this, no_deps, verbose, workspace_docs):
+@click.option("-j", "--jobs", type=click.INT, help="Maximum number of parallel doxygen runs. Defaults to the number "
+                                                   "of cores.")
+@click.option("-f", "--force", is_flag=True, help="Rebuild the documentation, even if nothing changed.")
+def build(pkg_name, this, no_deps, verbose, workspace_docs, jobs, force):
     start = time.time()
     ws = Workspace()
+    get_package_paths_(ws)
 
     # add all workspace packages to possibly be doc builded
     pkg_list = ws.get_catkin_packages()
@@ -67,24 +68,35 @@ def build(pkg_name, this, no_deps, verbose, workspace_docs):
         # clear doc build package list and set to specified one
         pkg_list = {pkg_name: pkg_list[pkg_name]}
 
-        # add also dependencies if necessary  
+        # add also dependencies if necessary
         if not no_deps:
             pkg_list.update(get_dep_packages_in_workspace_(ws, pkg_name))
 
         is_build_workspace_doc = False
 
-    # order topologically to get the build order right
-    pkg_list = catkin_pkg.topological_order.topological_order_packages(pkg_list)
-
     # output build summary
     end = time.time()
     click.secho("[doc build] Found '{}' packages in {:.1f} seconds.".format(len(pkg_list), end - start))
 
-    # build packages
-    for pkg, _ in pkg_list:
-        output_start_status_(pkg)
-        build_(ws, pkg, verbose)
-        output_finished_states_(pkg)
+    # build packages in parallel. A package has to wait only for the tag files of its dependencies.
+    graph = ws.get_dependency_graph()
+    dependencies = {pkg: graph.dependencies(pkg) for pkg in pkg_list}
+    scheduler = DagScheduler(jobs=jobs, label="doc build")
+    up_to_date = set()
+
+    def build_job(pkg):
+        log = build_(ws, pkg, verbose, force=force)
+        if log is None:
+            up_to_date.add(pkg)
+        return log
+
+    results = scheduler.run(dependencies, build_job)
+    scheduler.print_summary(results)
+    if up_to_date:
+        click.echo("[doc build] {} packages were up to date.".format(len(up_to_date)))
+    failed = sorted(pkg for pkg, result in results.items() if not result.success)
+    if failed:
+        click.secho("[doc build] Failed to build documentation of: " + ", ".join(failed), fg="red")
 
     # build workspace docs
     if workspace_docs:
@@ -93,10 +105,13 @@ def build(pkg_name, this, no_deps, verbose, workspace_docs):
         build_workspace_doc_(ws)
         output_finished_states_("workspace_doc")
 
+    if failed:
+        sys.exit(1)
+
 
 @main.command(short_help="Shows the documentation of a package.",
               help="Shows the documentation of a package. If the documentation is not found, it will be generated.")
-@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=suggestions)
+@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=import_package_names)
 def show(pkg_name):
     if pkg_name:
         index_file = get_html_index_file_path_(pkg_name)
@@ -106,7 +121,10 @@ def show(pkg_name):
         index_file = os.path.join(doc_folder, "html", "index.html")
 
     if not os.path.isfile(index_file):
-        build_(ws, pkg_name)
+        ws = Workspace()
+        log = build_(ws, pkg_name)
+        if log:
+            click.secho(log, fg="yellow")
 
     if not os.path.isfile(index_file):
         raise RuntimeError("Documentation output not found. Expected to be in " + index_file)
@@ -115,13 +133,13 @@ def show(pkg_name):
 
 
 @main.command(help="Removes the documentation build folder of a workspace or package.")
-@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=suggestions)
+@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=import_package_names)
 def clean(pkg_name):
     if pkg_name:
         pkg_list = [pkg_name]
     else:
         ws = Workspace()
-        pkg_list = ws.get_catkin_package_names()
+        pkg_list = sorted(get_package_paths_(ws))
 
     for pkg in pkg_list:
         _, _, package_doxygen_output_dir = check_paths_(pkg)
@@ -134,7 +152,12 @@ def clean(pkg_name):
             shutil.rmtree(doc_folder)
 
 
-def build_(ws, pkg_name, verbose=None):
+def build_(ws, pkg_name, verbose=None, force=True):
+    """
+    Run doxygen for one package. This does not change the working directory and can be run in parallel.
+    :param force: Also run doxygen, if neither the inputs nor the tag files of the dependencies changed
+    :return: Output of doxygen, if verbose, and its warnings. None, if the documentation was up to date.
+    """
     # prepare build paths
     package_src_dir, package_build_dir, package_doxygen_output_dir = check_paths_(pkg_name)
 
@@ -150,8 +173,11 @@ def build_(ws, pkg_name, verbose=None):
     config["GENERATE_TAGFILE"] = "\"" + tag_file_name + "\""
 
     # determine all dependent packages from workspace and add the tag files
+    # (reuse an existing graph, this function runs in parallel threads)
+    graph = ws.dependency_graph or ws.get_dependency_graph()
+    dep_packages = [p for p in sorted(graph.dependencies(pkg_name)) if graph.is_workspace_package(p)]
     tag_files = list()
-    for dep_package, _ in get_dep_packages_in_workspace_(ws, pkg_name):
+    for dep_package in dep_packages:
         tag_files.append(get_tag_file_config_entry_(dep_package))
 
     config["TAGFILES"] = " ".join(tag_files)
@@ -163,8 +189,8 @@ def build_(ws, pkg_name, verbose=None):
 
     # Set the input folders. Only add those which are 
     input_folders = ["README.md", "doc", "include", "src"]
-    input_folders = ['"{}"'.format(f) for f in input_folders if os.path.exists(os.path.join(package_src_dir, f))]
-    config["INPUT"] = " ".join(input_folders)
+    input_folders = [f for f in input_folders if os.path.exists(os.path.join(package_src_dir, f))]
+    config["INPUT"] = " ".join('"{}"'.format(f) for f in input_folders)
 
     if os.path.exists(os.path.join(package_src_dir, "doc")):
         config["IMAGE_PATH"] = "doc"
@@ -173,6 +199,24 @@ def build_(ws, pkg_name, verbose=None):
     if not verbose:
         config["QUIET"] = "YES"
 
+    # Add include to user defined doxygen file
+    user_doxyfile = os.path.join(package_src_dir, "Doxyfile")
+    if os.path.isfile(user_doxyfile):
+        config["@INCLUDE"] = '"{}"'.format(user_doxyfile)
+        input_folders.append("Doxyfile")
+
+    # Skip the package, if nothing changed since the last build
+    build_hash = get_doc_build_hash_(config, package_src_dir, input_folders,
+                                     [get_tage_file_name_(dep) for dep in dep_packages])
+    hash_file = os.path.join(package_doxygen_output_dir, DOC_BUILD_HASH_FILE)
+    try:
+        with open(hash_file, "r") as f:
+            if not force and f.read() == build_hash and os.path.isfile(tag_file_name):
+                return None
+        os.remove(hash_file)
+    except (IOError, OSError):
+        pass
+
     warn_logfile_name = None
     try:
         # add warn logfile
@@ -180,25 +224,60 @@ def build_(ws, pkg_name, verbose=None):
 
         config["WARN_LOGFILE"] = '"{}"'.format(warn_logfile_name)
 
-        # Add include to user defined doxygen file
-        user_doxyfile = os.path.join(package_src_dir, "Doxyfile")
-        if os.path.isfile(user_doxyfile):
-            config["@INCLUDE"] = '"{}"'.format(user_doxyfile)
-
         # build
-        run_doxygen_(config, package_src_dir)
+        output = run_doxygen_(config, package_src_dir)
+        write_atomic(hash_file, build_hash)
 
-        # output warn log file if not empty
+        # return warn log file together with the output
         with open(warn_logfile_name, "r") as f:
             warn_log = f.read().rstrip("\n")
-            if len(warn_log) > 0:
-                click.secho(warn_log, fg="yellow")
+        return "\n".join(log for log in [output.rstrip("\n") if verbose else "", warn_log] if log)
     finally:
-        if os.path.isfile(warn_logfile_name):
+        if warn_logfile_name and os.path.isfile(warn_logfile_name):
             os.remove(warn_logfile_name)
 
 
+def get_doc_build_hash_(config, package_src_dir, inputs, dep_tag_files):
+    """
+    Hash over everything that influences the documentation of a package: The content of all input files, the
+    effective doxygen configuration and the tag files of the dependencies. QUIET only affects the console output and
+    is left out, so that a verbose run does not rebuild everything.
+    :param config: Generated doxygen config
+    :param package_src_dir: Source folder of the package
+    :param inputs: Input files and folders, relative to package_src_dir
+    :param dep_tag_files: Tag files of the dependencies
+    """
+    sha = hashlib.sha1()
+    with open(get_doxygen_template_filename_(), "rb") as f:
+        sha.update(f.read())
+    sha.update(repr(sorted((k, v) for k, v in config.items() if k != "QUIET")))
+
+    def add_file(filename, name):
+        sha.update("\0" + name + "\0")
+        try:
+            with open(filename, "rb") as f:
+                for block in iter(lambda: f.read(1 << 16), b""):
+                    sha.update(block)
+        except (IOError, OSError):
+            sha.update("\0missing")
+
+    for path in sorted(inputs):
+        full_path = os.path.join(package_src_dir, path)
+        if os.path.isfile(full_path):
+            add_file(full_path, path)
+            continue
+        for root, dirs, files in os.walk(full_path):
+            dirs.sort()
+            for filename in sorted(files):
+                add_file(os.path.join(root, filename), os.path.relpath(os.path.join(root, filename), package_src_dir))
+
+    for tag_file in sorted(dep_tag_files):
+        add_file(tag_file, tag_file)
+    return sha.hexdigest()
+
+
 def run_doxygen_(config, package_src_dir):
+    """Run doxygen in package_src_dir and return its output"""
     # generate config
     additional_doxygen_config = "\n".join(["{0} = {1}".format(k, v) for k, v in config.items()])
 
@@ -213,8 +292,7 @@ def run_doxygen_(config, package_src_dir):
         doxyfile.flush()
 
         # run doxygen
-        os.chdir(package_src_dir)
-        subprocess.check_call(["doxygen", doxyfile.name])
+        return subprocess.check_output(["doxygen", doxyfile.name], cwd=package_src_dir, stderr=subprocess.STDOUT)
 
 
 def build_workspace_doc_(ws):
@@ -314,27 +392,47 @@ def get_tag_file_config_entry_(pkg_name):
 
 def get_dep_packages_in_workspace_(ws, pkg_name):
     """Returns all packages which depends from pkg_name which are also in the current workspace"""
-    package_deps = ws.get_dependencies(pkg_name)[pkg_name]
-    ws_packages = ws.get_catkin_packages()
+    graph = ws.get_dependency_graph()
+    package_deps = graph.dependencies(pkg_name)
 
-    return [(p, ws_packages[p]) for p in package_deps.keys() if p in ws_packages]
+    return [(p, graph.packages_by_name[p]) for p in sorted(package_deps) if graph.is_workspace_package(p)]
 
 
 def get_workspace_doc_folder_(ws):
     doc_folder_name = "workspace_doc_" + str(hashlib.sha224(ws.get_root()).hexdigest()[:10])
-    doc_folder = subprocess.check_output(["catkin", "locate", "--build"], universal_newlines=True).rstrip("\n")
-    doc_folder = os.path.join(doc_folder, doc_folder_name)
+    doc_folder = os.path.join(ws.catkin_config.build_space_abs, doc_folder_name)
     return doc_folder
 
 
+def get_package_paths_(ws=None):
+    """
+    Returns a dict {pkg_name: (source folder, build folder)} of all packages in the workspace. It is built once per
+    invocation from the catkin context and the package index, which is much faster than calling 'catkin locate'.
+    :param ws: Workspace to take context and packages from. Loaded from the current directory if not given.
+    """
+    if not package_paths_:
+        if ws is None:
+            ws_root = find_workspace_root()
+            if ws_root is None:
+                click.secho("No catkin workspace root found.", fg="red")
+                sys.exit(1)
+            context = Context.load(ws_root)
+            packages = PackageIndex(ws_root, context.source_space_abs).get_packages()
+        else:
+            context = ws.catkin_config
+            packages = ws.catkin_pkgs or ws.get_catkin_packages()
+        for path, pkg in packages.items():
+            package_paths_[pkg.name] = (os.path.join(context.source_space_abs, path),
+                                        os.path.join(context.build_space_abs, pkg.name))
+    return package_paths_
+
+
 def check_paths_(pkg_name):
-    if pkg_name not in suggestions:
+    package_paths = get_package_paths_()
+    if pkg_name not in package_paths:
         click.echo("Package '{}' does not exist inside this workspace.".format(pkg_name))
         sys.exit()
-    package_src_dir = subprocess.check_output(["catkin", "locate", "--src", pkg_name], universal_newlines=True).rstrip(
-        "\n")
-    package_build_dir = subprocess.check_output(["catkin", "locate", "--build", pkg_name],
-                                                universal_newlines=True).rstrip("\n")
+    package_src_dir, package_build_dir = package_paths[pkg_name]
     package_doxygen_output_dir = os.path.join(package_build_dir, "doxygen_doc")
 
     return package_src_dir, package_build_dir, package_doxygen_output_dir
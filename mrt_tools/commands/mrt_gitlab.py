@@ -90,7 +90,7 @@ def add_user(git):
     """Add a user to a repository"""
     click.echo("Loading... please wait a moment")
 
-    users = list(git.server.getall(git.server.getusers))
+    users = git.get_users()
     users = sorted(users, key=lambda k: k['name'])
     repo_dicts = git.get_repos()
     repo_dicts = sorted(repo_dicts, key=lambda k: k['path_with_namespace'])
@@ -164,7 +164,7 @@ def show(ctx):
 @click.pass_obj
 def users(git):
     """Display a list of user names"""
-    user_list = list(git.server.getall(git.server.getusers, per_page=100))
+    user_list = git.get_users()
     user_list = sorted(user_list, key=lambda k: k['name'])
     for index, item in enumerate(user_list):
         click.echo("(" + str(index) + ") " + item['name'])
@@ -175,7 +175,7 @@ def users(git):
 @click.pass_obj
 def repos(git):
     """Display a list of repositories"""
-    repo_list = list(git.server.getall(git.server.getprojects, per_page=100))
+    repo_list = git.get_repos()
     repo_list = sorted(repo_list, key=lambda k: k['name'])
     for index, item in enumerate(repo_list):
         click.echo("(" + str(index) + ") " + item['name'])
@@ -186,7 +186,7 @@ def repos(git):
 @click.pass_obj
 def groups(git):
     """Display a list of group names"""
-    group_list = list(git.server.getall(git.server.getgroups, per_page=100))
+    group_list = git.get_groups()
     group_list = sorted(group_list, key=lambda k: k['name'])
     for index, item in enumerate(group_list):
         click.echo("(" + str(index) + ") " + item['name'])
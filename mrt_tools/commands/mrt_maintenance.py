@@ -2,8 +2,13 @@ from mrt_tools.CredentialManager import credentialManager, set_git_credentials
 from wstool import config as wstool_config
 from mrt_tools.Workspace import Workspace
 from mrt_tools.utilities import *
+from mrt_tools.GitlabCache import GitlabCache, RequestsBackend
+from mrt_tools.DepsDownloader import DepsDownloader
+from mrt_tools.ReverseDependencyIndex import ReverseDependencyIndex
 from mrt_tools.Git import Git
+from mrt_tools.MirrorCache import MirrorCache
 import getpass
+import time
 
 
 ########################################################################################################################
@@ -204,6 +209,7 @@ def rename_pkg(new_name):
     if not git.server.editproject(project_id, name=new_name, path=new_name):
         click.secho("There was a problem, moving the project. Aborting!", fg="red")
         sys.exit(1)
+    git.cache.evict("projects")
 
     click.echo("Updating git remote...")
     os.chdir(ws.src + "/" + package)
@@ -216,7 +222,7 @@ def rename_pkg(new_name):
     shutil.move(package, new_name)
     os.chdir(new_name)
     os.remove(ws.src + "/.rosinstall")
-    ws.recreate_index(write=True)
+    ws.recreate_index(write=True, reset=True)
 
     click.echo("")
     click.echo("Next steps:")
@@ -233,7 +239,7 @@ def update_rosinstall():
     click.secho("Removing wstool database src/.rosinstall", fg="yellow")
     os.remove(".rosinstall")
     click.echo("Initializing wstool...")
-    ws.recreate_index(write=True)
+    ws.recreate_index(write=True, reset=True)
 
 
 @main.command(short_help="Updates the cached list of repos.",
@@ -252,7 +258,7 @@ def update_repo_cache(quiet):
     try:
         # Connect
         git = Git(quiet=quiet)
-        repo_dicts = git.get_repos()
+        repo_dicts = git.get_repos(max_age=0)
         if not repo_dicts:
             raise Exception
         if not quiet:
@@ -281,6 +287,83 @@ def update_repo_cache(quiet):
                 f.write(r["name"] + ",")
 
 
+@main.command(short_help="Updates the cached list of ros topics.",
+              help="This command reads the published topics from the ros master and caches them in a file for bash "
+                   "autocompletion. It is started in the background whenever the cached list is outdated, so normally "
+                   "there is no need to call this manually.")
+@click.option("--quiet", is_flag=True)
+def update_topic_cache(quiet):
+    """Read topic list from ros master and write it into caching file."""
+    topics = refresh_topic_cache()
+    if not quiet:
+        click.echo("Found {} published topics.".format(len(topics)))
+
+
+@main.group(short_help="Manage the shared cache of git mirrors.")
+def mirror():
+    """All clones take their objects from a machine wide cache of git mirrors."""
+
+
+@mirror.command(short_help="Show disk usage and hit rate of the mirror cache.")
+@click.option("-n", "--count", type=click.INT, default=10, help="Number of mirrors to list")
+def stats(count):
+    """Show disk usage and hit rate of the mirror cache."""
+    cache = MirrorCache()
+    mirrors = cache.get_mirrors()
+    counters = cache.get_stats()
+    hits, misses = counters.get("hits", 0), counters.get("misses", 0)
+    click.echo("Mirror cache in {}".format(cache.directory))
+    click.echo("{0} mirrors, {1:.1f} MB of {2:.0f} MB".format(len(mirrors), sum(m[1] for m in mirrors) / 1024.0 ** 2,
+                                                              cache.max_size / 1024.0 ** 2))
+    click.echo("{0} hits, {1} misses, hit rate {2:.0f}%, {3} refreshes".format(
+        hits, misses, 100.0 * hits / (hits + misses) if hits + misses else 0, counters.get("refreshes", 0)))
+    if mirrors and count:
+        click.echo("Largest mirrors:")
+        for path, size, last_used in sorted(mirrors, key=lambda m: m[1], reverse=True)[:count]:
+            click.echo("  {0:>9.1f} MB  last used {1}  {2}".format(
+                size / 1024.0 ** 2, time.strftime("%Y-%m-%d %H:%M", time.localtime(last_used)),
+                os.path.relpath(path, cache.directory)))
+
+
+@mirror.command(short_help="Fetch new commits into mirrors.",
+                help="Mirrors are refreshed in the background when they are used, so normally there is no need to call "
+                     "this manually. Without URIS, all mirrors are refreshed.")
+@click.argument("uris", type=click.STRING, nargs=-1)
+@click.option("--quiet", is_flag=True)
+def refresh(uris, quiet):
+    """Fetch new commits into mirrors."""
+    cache = MirrorCache()
+    if not uris:
+        uris = [subprocess.check_output(["git", "--git-dir", path, "config", "--get", "remote.origin.url"]).strip()
+                for path, _, _ in cache.get_mirrors()]
+    refreshed = cache.refresh_all(uris)
+    if not quiet:
+        click.echo("Refreshed {0} of {1} mirrors.".format(refreshed, len(uris)))
+
+
+@mirror.command(short_help="Remove least recently used mirrors.")
+@click.option("--max-size", type=click.INT, help="Size in MB to shrink the cache to, 0 removes all unused mirrors")
+def gc(max_size):
+    """Remove least recently used mirrors, until the cache is below its maximum size."""
+    cache = MirrorCache()
+    removed = cache.evict(None if max_size is None else max_size * 1024 ** 2)
+    for path in removed:
+        click.echo("Removed " + os.path.relpath(path, cache.directory))
+    click.echo("Removed {} mirrors.".format(len(removed)))
+
+
+@main.command(short_help="Clear the local cache of gitlab metadata.",
+              help="Projects, groups, users and branches retrieved from gitlab are cached locally for "
+                   "{} seconds and revalidated with the server afterwards. This command removes the cached data, "
+                   "either completely or only for the given resource.".format(
+                  user_settings['Cache']['GITLAB_CACHE_TTL']))
+@click.argument("resource", required=False, type=click.Choice(["projects", "groups", "users"]))
+def clear_gitlab_cache(resource):
+    """Remove cached gitlab metadata"""
+    cache = GitlabCache(user_settings['Gitlab']['HOST_URL'] + "/api/v3")
+    click.echo("Removed {} cached collections.".format(cache.evict(resource)))
+
+
 @main.command(short_help="Change the default configuration of mrt tools.",
               help="This command starts an editor to let you edit the configuration file. You can specify whether to "
                    "use https or ssh, whether to save your private API token locally, and for how long to cache your git "
@@ -317,54 +400,21 @@ def settings():
 
 
 @main.command(short_help="Update your local copy of all package dependencies.",
-              help="This will download every package.xml file from Gitlab, that you have access to. These files will "
-                   "be used for reverse dependency lookup.")
-def update_cached_deps():
+              help="This will download every package.xml file from Gitlab, that you have access to. These files are "
+                   "indexed for reverse dependency lookup.")
+@click.option("-j", "--jobs", type=click.INT, default=10, help="Number of concurrent downloads.")
+def update_cached_deps(jobs):
     git = Git()
 
-    if os.path.exists(user_settings['Cache']['CACHED_DEPS_WS']):
-        click.echo("Removing existing files in workspace")
-        shutil.rmtree(user_settings['Cache']['CACHED_DEPS_WS'])
-    os.makedirs(user_settings['Cache']['CACHED_DEPS_WS'])
-
     click.echo("Retrieving repo list")
-    repo_list = list(git.server.getall(git.server.getprojects, per_page=100))
-
-    click.echo("Downloading package.xml files")
-    skipped_repos = []
-    with click.progressbar(repo_list) as repos:
-        branches = []
-        for repo in repos:
-            errcount = 0
-            branches = git.server.getbranches(repo['id'])
-            while not branches and errcount < 5:
-                branches = git.server.getbranches(repo['id'])
-                errcount += 1
-            if errcount == 5:
-                skipped_repos.append(repo['name'])
-                continue
-
-            for branch in branches:
-
-                # TODO Test checksum before downloading?
-
-                file_contents = git.server.getrawfile(repo['id'], branch['name'], 'package.xml')
-                if file_contents is None or file_contents is False:
-                    skipped_repos.append(repo['name'])
-                    continue
-
-                file_name = os.path.join(user_settings['Cache']['CACHED_DEPS_WS'], repo['namespace']['name'],
-                                         repo['name'], branch['name'], 'package.xml')
-                if not os.path.exists(os.path.dirname(file_name)):
-                    os.makedirs(os.path.dirname(file_name))
-
-                with open(file_name, 'w') as f:
-                    f.write(file_contents)
-
-    skipped_repos = set(skipped_repos)
-    click.echo("Skipped the following repos:")
-    for repo in skipped_repos:
-        click.echo("- {}".format(repo))
+    repo_list = git.get_repos(max_age=0)
+
+    click.echo("Downloading changed package.xml files")
+    git.cache.backend = RequestsBackend(verify=git.server.verify_ssl, pool_size=jobs)
+    DepsDownloader(git.cache, user_settings['Cache']['CACHED_DEPS_WS'], jobs=jobs).run(repo_list)
+
+    click.echo("Updating reverse dependency index")
+    ReverseDependencyIndex(user_settings['Cache']['CACHED_DEPS_WS']).update()
 
 
 @main.group(short_help="Manage your stored password and username")
@@ -1,21 +1,14 @@
 from string import Template
 
 from mrt_tools.Workspace import Workspace
+from mrt_tools.DependencyGraph import DEPENDENCY_TYPES
+from mrt_tools.ReverseDependencyIndex import ReverseDependencyIndex
 from mrt_tools.Digraph import Digraph
+from mrt_tools.CloneMode import CloneMode
 from mrt_tools.utilities import *
 from mrt_tools.Git import Git
 import stat
 
-# Autocompletion
-try:
-    tmp_ws = Workspace(quiet=True)
-    suggestions = tmp_ws.get_catkin_package_names()
-    repo_list = import_repo_names()
-    os.chdir(tmp_ws.org_dir)
-except:
-    suggestions = []
-    repo_list = []
-
 self_dir = get_script_root()
 
 
@@ -42,10 +35,16 @@ def main(ctx):
 
 @main.command(short_help="Clone catkin packages from gitlab.",
               help="This command let's you clone repositories directly into your workspace. Dependencies to other "
-                   "packages are automatically resolved. Try out the bashcompletion for the package name.")
-@click.argument("pkg_names", type=click.STRING, required=True, nargs=-1, autocompletion=repo_list)
+                   "packages are automatically resolved. Try out the bashcompletion for the package name. With --depth "
+                   "or --filter, the packages and their dependencies are cloned shallow or partial, which can be "
+                   "undone with 'mrt pkg unshallow'.")
+@click.argument("pkg_names", type=click.STRING, required=True, nargs=-1, autocompletion=import_repo_names)
+@click.option("--depth", type=click.INT, help="Clone only the last DEPTH commits.")
+@click.option("--filter", "blob_filter", type=click.STRING,
+              help="Partial clone, fetching blobs on demand, e.g. 'blob:none' or 'blob:limit=1m'.")
+@click.option("--full", is_flag=True, help="Clone the full history, even if a default depth or filter is set.")
 @click.pass_obj
-def add(ws, pkg_names):
+def add(ws, pkg_names, depth, blob_filter, full):
     """Clone catkin packages from gitlab."""
     """
     This tool searches for, and clones a package from the Gitlab Server into the current workspace.
@@ -53,6 +52,7 @@ def add(ws, pkg_names):
     """
 
     git = Git()
+    clone_mode = CloneMode.from_options(depth, blob_filter, full)
 
     for pkg_name in pkg_names:
 
@@ -66,15 +66,43 @@ def add(ws, pkg_names):
         if not repo:
             continue
         url = repo[git.get_url_string()]
-        ws.add(pkg_name, url)
+        ws.add(pkg_name, url, clone_mode=clone_mode)
+
+    ws.resolve_dependencies(git=git, clone_mode=clone_mode)
+
 
-    ws.resolve_dependencies(git=git)
+@main.command(short_help="Turn shallow and partial clones into full clones.",
+              help="This command fetches the full history and all files of packages, which were cloned with --depth "
+                   "or --filter. Without arguments, the packages which are not cloned fully are listed.")
+@click.argument("pkg_names", type=click.STRING, required=False, nargs=-1, autocompletion=import_package_names)
+@click.option("--all", "all_pkgs", is_flag=True, help="Convert all shallow and partial clones of this workspace.")
+@click.pass_obj
+def unshallow(ws, pkg_names, all_pkgs):
+    """Turn shallow and partial clones into full clones."""
+    clone_modes = ws.get_clone_modes()
+    if all_pkgs:
+        pkg_names = sorted(clone_modes)
+    elif not pkg_names:
+        for pkg_name, mode in sorted(clone_modes.items()):
+            click.echo("{0}: {1}".format(pkg_name, mode))
+        if not clone_modes:
+            click.echo("All packages are cloned fully.")
+        return
+
+    unknown = [p for p in pkg_names if not ws.find(p)]
+    if unknown:
+        click.secho("Not in this workspace: " + ", ".join(unknown), fg="red")
+        sys.exit(1)
+    failed = ws.make_full_clone(list(pkg_names))
+    if failed:
+        click.secho("Could not convert: " + ", ".join(failed), fg="red")
+        sys.exit(1)
 
 
 @main.command(short_help="Deletes package from workspace.",
               help="This command let's you savely remove a package from the current workspace, by checking for "
                    "uncommited or unpushed changes and removing the directory as well as the .rosinstall config entry.")
-@click.argument("pkg_names", type=click.STRING, required=True, nargs=-1, autocompletion=suggestions)
+@click.argument("pkg_names", type=click.STRING, required=True, nargs=-1, autocompletion=import_package_names)
 @click.pass_obj
 def remove(ws, pkg_names):
     """Delete package from workspace."""
@@ -166,12 +194,15 @@ def deps(ws):
                    "workspace. You can specify a package name, use the '--this' flag or leave the argument away to "
                    "create dependency graphs for the whole workspace. Dependencys are checked by using catkin, "
                    "the resulting images are written to 'ws/pics/'")
-@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=suggestions)
+@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=import_package_names)
 @click.option("--this", is_flag=True, help="Use the package containing the current directory.")
 @click.option("--repos-only", is_flag=True)
+@click.option("-t", "--type", "dep_types", type=click.Choice(DEPENDENCY_TYPES.keys()), multiple=True,
+              help="Only consider these dependency types. Defaults to all.")
 @click.pass_obj
-def draw(ws, pkg_name, this, repos_only):
+def draw(ws, pkg_name, this, repos_only, dep_types):
     """ Visualize dependencies of catkin packages."""
+    graph = ws.get_dependency_graph()
     pkg_list = ws.get_catkin_package_names()
 
     if pkg_name or this:
@@ -179,108 +210,85 @@ def draw(ws, pkg_name, this, repos_only):
         pkg_list = [pkg_name]
     else:
         if click.confirm("Create dependency graph for every package?"):
-            for pkg_name in ws.get_catkin_package_names():
+            for pkg_name in pkg_list:
                 click.echo("Creating graph for {}...".format(pkg_name))
-                deps = ws.get_dependencies(pkg_name, deep=True)
-                graph = Digraph(deps, repos_only)
-                graph.plot(pkg_name, show=False)
+                Digraph(graph.subgraph([pkg_name], dep_types), repos_only).plot(pkg_name, show=False)
         if click.confirm("Create complete dependency graph for workspace?", abort=True):
             pkg_name = os.path.basename(ws.root)
 
-    deps = dict()
-    for pkg in pkg_list:
-        deps.update(ws.get_dependencies(pkg, deep=True))
-    graph = Digraph(deps, repos_only)
-    graph.plot(pkg_name)
+    Digraph(graph.subgraph(pkg_list, dep_types), repos_only).plot(pkg_name)
 
 
 @deps.command(short_help="List dependencies of catkin packages.",
               help="This will list all dependencies of a named catkin package.")
-@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=suggestions)
+@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=import_package_names)
 @click.option("--this", is_flag=True, help="Use the package containing the current directory.")
+@click.option("-t", "--type", "dep_types", type=click.Choice(DEPENDENCY_TYPES.keys()), multiple=True,
+              help="Only consider these dependency types. Defaults to all.")
 @click.pass_obj
-def show(ws, pkg_name, this):
+def show(ws, pkg_name, this, dep_types):
     """ Visualize dependencies of catkin packages."""
     pkg_name = figure_out_pkg_name(ws, pkg_name, this)
 
-    these_deps = ws.get_dependencies(pkg_name, deep=True)[pkg_name]
-    git_deps = set()
-    apt_deps = set()
-
-    def sort(d):
-        for k, v in d.iteritems():
-            if not v:
-                apt_deps.add(k)
-            else:
-                git_deps.add(k)
-                sort(v)
-
-    sort(these_deps)
+    graph = ws.get_dependency_graph()
+    these_deps = graph.transitive_dependencies(pkg_name, dep_types)
+    git_deps = {d for d in these_deps if graph.is_workspace_package(d)}
+    apt_deps = these_deps - git_deps
 
     click.echo("")
     click.echo("Dependencies for {}".format(pkg_name))
     click.echo("")
     click.echo("Gitlab dependencies")
     click.echo("===================")
-    for dep in git_deps:
+    for dep in sorted(git_deps):
         click.echo(dep)
     click.echo("")
     click.echo("Apt-get dependencies")
     click.echo("====================")
-    for dep in apt_deps:
+    for dep in sorted(apt_deps):
         click.echo(dep)
 
 
 @deps.command(short_help="Lookup reverse dependencies.",
-              help="This will crawl all packages (in the MRT workspace, on the master branch, on the latest commit, "
-                   "in gitlab) inorder to detect, who directly relies on this pkg.")
-@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=suggestions)
+              help="This will look through all packages in gitlab (on every branch, as of the last update of the "
+                   "dependency cache) in order to detect, who relies on this pkg. With --transitive, packages that "
+                   "rely on it indirectly are listed as well.")
+@click.argument("pkg_name", type=click.STRING, required=False, autocompletion=import_package_names)
 @click.option("--this", is_flag=True, help="Use the package containing the current directory.")
 @click.option("-u", "--update", is_flag=True)
+@click.option("--transitive", is_flag=True, help="Also list packages, which depend on this package indirectly.")
+@click.option("-t", "--type", "dep_types", multiple=True, type=click.Choice(DEPENDENCY_TYPES.keys()),
+              help="Only consider these dependency types. Can be given multiple times.")
 @click.pass_obj
-def rlookup(ws, pkg_name, this, update):
+def rlookup(ws, pkg_name, this, update, transitive, dep_types):
     if update or not os.path.exists(user_settings['Cache']['CACHED_DEPS_WS']):
         click.echo("Updating repo cache...")
         process = subprocess.Popen(['mrt maintenance update_cached_deps'], shell=True)
         process.wait()  # Wait for process to finish and set returncode
-        # print(process.returncode)
 
     pkg_name = figure_out_pkg_name(ws, pkg_name, this)
 
+    index = ReverseDependencyIndex(user_settings['Cache']['CACHED_DEPS_WS'])
+    if not index.exists():
+        index.update()
+
+    if transitive:
+        results = index.lookup_transitive(pkg_name, dep_types)
+    else:
+        results = [(rdep, pkg_name, 1) for rdep in index.lookup(pkg_name, dep_types)]
+
+    # Group by repo and branch
     rdeps = {}
-    for root, dirs, files in os.walk(user_settings['Cache']['CACHED_DEPS_WS']):
-        def insert_into_dict(d, data):
-            key = data[0]
-            if type(d) is list:
-                d.append(key)
-                return d
-            elif type(d) is dict and key not in d:
-                if len(data) == 2:
-                    d[key] = []
-                else:
-                    d[key] = dict()
-            d[key] = insert_into_dict(d[key], data[1:])
-            return d
-
-        if files == ["package.xml"]:
-            filename = os.path.join(root, files[0])
-            root, branch = os.path.split(root)
-            root, repo = os.path.split(root)
-            root, namespace = os.path.split(root)
-            with open(filename, 'r') as f:
-                for line in f:
-                    line = line.decode("utf-8")
-                    if pkg_name in line and "depend" in line:
-                        match = re.search("\</.*\>", line)
-                        typ = match.string[match.start() + 2:match.end() - 1]
-                        rdeps = insert_into_dict(rdeps, [namespace, repo, branch, typ])
+    for rdep, dependency, distance in results:
+        branches = rdeps.setdefault((rdep.namespace, rdep.repo), {})
+        branches.setdefault((rdep.branch, dependency, distance), []).append(rdep.dep_type)
 
     click.echo("I found the following packages relying on {}:\n".format(pkg_name))
-    for namespace, d_repo in rdeps.iteritems():
-        for repo, d_branches in d_repo.iteritems():
-            click.echo("{}/{}:".format(namespace, repo))
-            for branch, typ in d_branches.iteritems():
-                click.echo("\t- On branch '{}': {}".format(branch, typ))
+    for (namespace, repo), d_branches in sorted(rdeps.iteritems()):
+        click.echo("{}/{}:".format(namespace, repo))
+        for (branch, dependency, distance), types in sorted(d_branches.iteritems()):
+            via = " (via {})".format(dependency) if distance > 1 else ""
+            click.echo("\t- On branch '{}': {}{}".format(branch, ", ".join(types), via))
 
 
 @main.command(short_help="Create a new ROS executable in this package.",
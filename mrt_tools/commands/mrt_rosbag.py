@@ -1,17 +1,20 @@
-from mrt_tools.RosbagMetadataHandler import RosbagMetadataHandler
-from mrt_tools.utilities import get_help_text
+from mrt_tools.RosbagMetadataHandler import RosbagMetadataHandler, get_bag_report, annotate_bag
+from mrt_tools.RosbagCatalog import RosbagCatalog
+from mrt_tools.BagWatcher import BagWatcher
+from mrt_tools.utilities import get_help_text, import_topic_names
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from collections import OrderedDict
+import multiprocessing
 import subprocess
+import itertools
+import functools
+import json
+import glob
+import re
 import time
 import click
 import os
 
-try:
-    import rospy
-    topic_list = rospy.get_published_topics()
-    topic_list = [pair[0][1:] for pair in topic_list]
-except:
-    topic_list = []
-
 
 @click.group(short_help="A wrapper for rosbag.",
              help="This group of commands wrap the native 'rosbag' command. The original commands are extanded by "
@@ -26,8 +29,12 @@ def main():
 @click.option('-O', '--output-name', 'output_name', type=click.STRING)
 @click.option('-o', '--output-prefix', 'prefix', type=click.STRING)
 @click.option('-r','--reuse', 'reuse', is_flag=True)
-@click.argument('args', nargs=-1, type=click.UNPROCESSED, autocompletion=topic_list)
-def record(output_name, prefix, reuse, args):
+@click.option('--stats', 'stats', is_flag=True, help="Store per topic statistics (message counts, sizes, frequencies "
+                                                     "and gaps) in the metadata")
+@click.option('--gap-threshold', 'gap_threshold', type=click.FLOAT, default=1.0,
+              help="Time in seconds between two messages of a topic, above which a gap is reported (with --stats)")
+@click.argument('args', nargs=-1, type=click.UNPROCESSED, autocompletion=import_topic_names)
+def record(output_name, prefix, reuse, stats, gap_threshold, args):
     if not [arg for arg in args if not arg.startswith("-")] and "-a" not in args:
         click.echo("You must specify a topic name or else use the '-a' option.")
         return
@@ -45,46 +52,184 @@ def record(output_name, prefix, reuse, args):
     rmh = RosbagMetadataHandler()
     rmh.collect_metadata(reuse_last=reuse)
 
-    # Perform action
-    process = subprocess.Popen(["rosbag", "record"] + list(args))
-    try:
-        process.wait()
-    except KeyboardInterrupt:
-        click.echo("")
-        process.terminate()
-        process.communicate()
+    # Perform action. Metadata is written to every bag as soon as rosbag closed it, so with --split the chunks are
+    # annotated while the recording goes on.
+    written = []
+    with ThreadPoolExecutor(max_workers=multiprocessing.cpu_count()) as executor:
+        watcher = BagWatcher(output_name, lambda bag: written.append(
+            executor.submit(rmh.finalize_bag, bag, gap_threshold if stats else None, True)))
+        watcher.start()
+        process = subprocess.Popen(["rosbag", "record"] + list(args))
+        try:
+            process.wait()
+        except KeyboardInterrupt:
+            click.echo("")
+            process.terminate()
+            process.communicate()
+        watcher.wait()
 
-    rmh.write_to_bag(output_name)
+    if any(future.result() for future in written):
+        click.echo("\nWrote the following metadata:")
+        click.echo(rmh)
+    else:
+        click.secho("No bag was written.", fg="yellow")
 
 
 @main.command()
-@click.argument('bagfile', type=click.STRING, required=True)
+@click.argument('bagfiles', nargs=-1, type=click.STRING, required=True)
 @click.option('--clean', 'clean', is_flag=True, help="Discard existing metadata")
-def annotate(bagfile, clean):
-    """Add metadata to an existing rosbag"""
-    if not os.path.isfile(bagfile):
-        click.echo("No such file: {}".format(os.path.abspath(bagfile)))
+@click.option('-p', '--pattern', 'pattern', type=click.STRING,
+              help="Regex with named groups, matched against each file name. The groups can be used as placeholders "
+                   "in the metadata, e.g. '(?P<location>[a-z]+)_.*' and 'Location: {location}'.")
+@click.option('-j', '--jobs', 'jobs', type=click.INT,
+              help="Number of bags to write in parallel, defaults to the number of cores")
+@click.option('-f', '--force', 'force', is_flag=True, help="Also write bags, which already contain this metadata")
+def annotate(bagfiles, clean, pattern, jobs, force):
+    """
+    Add metadata to existing rosbags.
+
+    Accepts bag files, directories and glob patterns. The metadata is asked for once, taking the first bag as default,
+    and written to all bags. Values may contain the placeholders {filename}, {stem} and {dir} and the named groups of
+    --pattern, which are filled in for every bag. Bags already containing the same metadata are skipped.
+    """
+    bags = []
+    for arg in bagfiles:
+        if os.path.isdir(arg):
+            bags += sorted(os.path.join(arg, f) for f in os.listdir(arg) if f.endswith(".bag"))
+        elif os.path.isfile(arg):
+            bags.append(arg)
+        else:
+            matches = sorted(glob.glob(arg))
+            if not matches:
+                click.echo("No such file: {}".format(os.path.abspath(arg)))
+            bags += [f for f in matches if os.path.isfile(f)]
+    if not bags:
         return
+
+    # Collect metadata once and fill in the placeholders for every bag before writing anything
     rmh = RosbagMetadataHandler()
-    rmh.collect_metadata(bagfile, clean_start=clean)
-    rmh.write_to_bag(bagfile)
+    rmh.collect_metadata(bags[0], clean_start=clean)
+    try:
+        data = [rmh.render(rmh.data, bag, pattern) for bag in bags]
+    except (ValueError, re.error) as err:
+        raise click.BadParameter(str(err))
+
+    start = time.time()
+    counts = {"written": 0, "unchanged": 0, "failed": 0}
+    total_size = 0
+    jobs = min(jobs or multiprocessing.cpu_count(), len(bags))
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(annotate_bag, bag, bag_data, force) for bag, bag_data in zip(bags, data)]
+        with click.progressbar(zip(bags, futures), length=len(bags), label="Writing metadata") as bar:
+            for bag, future in bar:
+                try:
+                    status, size = future.result()
+                except Exception as err:
+                    status, size = "failed", 0
+                    click.secho("\nCould not write to {0}: {1}".format(bag, getattr(err, "value", err)), fg="red")
+                counts[status] += 1
+                total_size += size
+
+    duration = max(time.time() - start, 1e-3)
+    click.echo("Wrote metadata to {0} bags, {1} already up to date, {2} failed".format(
+        counts["written"], counts["unchanged"], counts["failed"]))
+    click.echo("Processed {0} bags ({1:.1f}MB) in {2:.1f}s: {3:.1f} bags/s, {4:.1f}MB/s".format(
+        len(bags), total_size / 1e6, duration, len(bags) / duration, total_size / 1e6 / duration))
 
 
 @main.command(context_settings=dict(ignore_unknown_options=True, ), short_help="Show metadata of one or more bag files",
               help=get_help_text("rosbag info --help"))
+@click.option('-j', '--jobs', 'jobs', type=click.INT, help="Number of bags to read in parallel, defaults to the number "
+                                                             "of cores")
+@click.option('--json', 'as_json', is_flag=True, help="Print one JSON object per bag")
 @click.argument('args', nargs=-1, type=click.UNPROCESSED)
-def info(args):
+def info(jobs, as_json, args):
     options = [arg for arg in args if arg.startswith("-")]
-    bags = [arg for arg in args if not arg.startswith("-")]
-    for bag in bags:
-        if os.path.isdir(bag):
-            click.echo("{} is not a rosbag".format(bag))
+    bags = []
+    for arg in args:
+        if arg.startswith("-"):
+            continue
+        if os.path.isdir(arg):
+            # Show all bags within a directory
+            bags += sorted(os.path.join(arg, f) for f in os.listdir(arg) if f.endswith(".bag"))
+        else:
+            bags.append(arg)
+
+    # Every bag is opened only once, results are printed in input order as soon as they are available
+    read_report = functools.partial(get_bag_report, rosbag_options=options, text=not as_json)
+    jobs = min(jobs or multiprocessing.cpu_count(), len(bags))
+    if jobs <= 1:
+        print_reports_(itertools.imap(read_report, bags), as_json)
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        print_reports_(executor.map(read_report, bags), as_json)
+
+
+def print_reports_(reports, as_json):
+    for report in reports:
+        if as_json:
+            summary = report["summary"] or {}
+            click.echo(json.dumps(OrderedDict([
+                ("path", report["path"]), ("size", report["size"]), ("start", summary.get("start")),
+                ("end", summary.get("end")), ("duration", summary.get("duration")),
+                ("messages", summary.get("messages")),
+                ("topics", OrderedDict((topic, {"type": msg_type, "count": count})
+                                       for topic, (msg_type, count) in sorted(summary.get("topics", {}).items()))),
+                ("metadata", report["metadata"]), ("error", report["error"])]), default=str))
+            continue
+
+        click.echo("============ INFO for file {} ============".format(os.path.basename(report["path"])))
+        if report["error"] is not None:
+            click.secho(report["error"], fg="red")
             continue
-        click.echo("============ INFO for file {} ============".format(os.path.basename(bag)))
         rmh = RosbagMetadataHandler()
-        rmh.data = rmh.load_from_bag(bag)
-        if rmh.data is not None:
-            click.echo(rmh)
-            click.echo("Rosbag")
-            click.echo("=" * len("Rosbag"))
-            subprocess.call(["rosbag", "info"] + list(options) + [bag])
+        rmh.data = report["metadata"]
+        click.echo(rmh)
+        click.echo("Rosbag")
+        click.echo("=" * len("Rosbag"))
+        click.echo(report["text"].rstrip("\n"))
+
+
+@main.command(short_help="Index the metadata of bag files.")
+@click.argument('paths', nargs=-1, type=click.Path())
+@click.option('--db', 'db', type=click.Path(), help="Catalog database, defaults to the one in the config directory")
+def catalog(paths, db):
+    """
+    Add all bags within the given files and directories to a searchable catalog. Only new and modified bags are read,
+    bags which were deleted are removed from the catalog. Search the catalog with 'mrt rosbag find'.
+    """
+    def report_error(path, err):
+        click.secho("Could not read {0}: {1}".format(path, err), fg="red")
+
+    rosbag_catalog = RosbagCatalog(db)
+    start = time.time()
+    updated, unchanged, removed = rosbag_catalog.update(paths or ["."], RosbagMetadataHandler.read_bag_info,
+                                                        on_error=report_error)
+    rosbag_catalog.close()
+    click.echo("Indexed {0} bags, {1} unchanged, {2} removed in {3:.1f}s".format(updated, unchanged, removed,
+                                                                               time.time() - start))
+
+
+@main.command(short_help="Search the bag catalog.")
+@click.argument('conditions', nargs=-1, required=True)
+@click.option('--db', 'db', type=click.Path(), help="Catalog database, defaults to the one in the config directory")
+@click.option('-l', '--list', 'paths_only', is_flag=True, help="Only print the paths of the matching bags")
+def find(conditions, db, paths_only):
+    """
+    Find bags in the catalog by their metadata, e.g. 'mrt rosbag find location=karlsruhe weather=rain'. Keys match
+    the name of a metadata field or its full path (e.g. environment.location), values are case insensitive and may
+    contain '*' as wildcard. Use topic=... and path=... to filter by recorded topics and file names.
+    """
+    rosbag_catalog = RosbagCatalog(db)
+    try:
+        bags = rosbag_catalog.find(conditions)
+    except ValueError as err:
+        raise click.BadParameter(str(err))
+    finally:
+        rosbag_catalog.close()
+    for bag in bags:
+        if paths_only:
+            click.echo(bag.path)
+            continue
+        start = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(bag.start)) if bag.start else "-" * 19
+        click.echo("{0}  {1:>8.1f}s  {2:>8.1f}MB  {3}".format(start, bag.duration or 0, bag.size / 1e6, bag.path))
@@ -1,6 +1,14 @@
 from mrt_tools.Workspace import Workspace
 from mrt_tools.settings import user_settings
+from mrt_tools.SnapshotStore import SnapshotStore
+from mrt_tools.UpdateScheduler import UpdateScheduler, local_reference
+from mrt_tools.MirrorCache import MirrorCache
+from mrt_tools.CloneMode import CloneMode
+from mrt_tools.RosdepResolver import RosdepResolver
+from concurrent.futures import ThreadPoolExecutor
 from mrt_tools.utilities import *
+import tempfile
+import shutil
 import time
 
 
@@ -44,23 +52,37 @@ def create(name):
     os.remove(user_settings['Snapshot']['VERSION_FILE'])
     click.secho("Wrote snapshot to " + filename, fg="green")
 
+    # Keep it in the local store as well, for 'mrt snapshot diff' and 'mrt snapshot find'
+    store = SnapshotStore()
+    store.add_archive(filename)
+    store.close()
+
 
 @main.command(short_help="Restore a catkin workspace from a snapshot.",
               help="This command creates a new workspace with the name of the given snapshot file, initializes it, "
-                   "copies the config files and then uses wstool update functionality to clone all repos with the "
-                   "specified commit into the workspace. Finally, catkin build is called, in order to compile the "
-                   "workspace. NOTE: Packages in this workspace are pinned to the specified commit. Therefor wstool "
+                   "copies the config files and then clones all repos in parallel with the specified commit into the "
+                   "workspace. Finally, catkin build is called, in order to compile the workspace. NAME can be a "
+                   "snapshot file or the name of a stored snapshot. Repos found below the --reference directories "
+                   "(e.g. the src folder of another workspace) or in the mirror cache are cloned locally instead of "
+                   "over the network. With --depth or --filter, repos are cloned shallow or partial. "
+                   "NOTE: Packages in this workspace are pinned to the specified commit. Therefor wstool "
                    "update will always reset the repo to this commit!")
 @click.argument("name", type=click.STRING, required=True)
-def restore(name):
+@click.option("-j", "--jobs", type=click.INT, help="Number of repos to clone in parallel")
+@click.option("-r", "--reference", "reference_dirs", multiple=True, type=click.Path(exists=True, file_okay=False),
+              help="Directory containing git repos to clone from, if they contain the pinned commit.")
+@click.option("--depth", type=click.INT, help="Clone only the last DEPTH commits up to the pinned commit.")
+@click.option("--filter", "blob_filter", type=click.STRING,
+              help="Partial clone, fetching blobs on demand, e.g. 'blob:none' or 'blob:limit=1m'.")
+@click.option("--full", is_flag=True, help="Clone the full history, even if a default depth or filter is set.")
+def restore(name, jobs, reference_dirs, depth, blob_filter, full):
     """Restore a catkin workspace from a snapshot"""
     org_dir = os.getcwd()
-    filename = os.path.join(org_dir, name)
     workspace = os.path.join(org_dir, os.path.basename(name).split(".")[0] + "_snapshot_ws")
 
     # Read archive
     try:
-        zf = zipfile.ZipFile(filename, "r", zipfile.ZIP_DEFLATED)
+        zf = open_snapshot_(name)
         # file_list = [f.filename for f in zf.filelist]
         version = zf.read(user_settings['Snapshot']['VERSION_FILE'])
     except IOError:
@@ -84,16 +106,144 @@ def restore(name):
         zf.extractall(path=workspace)
         os.remove(os.path.join(workspace, user_settings['Snapshot']['VERSION_FILE']))
 
-        # Clone packages
-        click.secho("Cloning packages", fg="green")
-        ws.load()
-        ws.update()
-        ws.resolve_dependencies()
+        # Loading the rosdep database takes a while and does not depend on the cloned repos, so it is done meanwhile
+        resolver = RosdepResolver()
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            rosdep_index = executor.submit(resolver.get_index)
+
+            click.secho("Cloning packages", fg="green")
+            local_repos = {}
+            for reference_dir in reference_dirs:
+                for key, path in UpdateScheduler.find_local_repos(reference_dir).items():
+                    local_repos.setdefault(key, path)
+            mirrors = MirrorCache() if user_settings['Cache']['USE_MIRROR_CACHE'] else None
+            clone_mode = CloneMode.from_options(depth, blob_filter, full)
+            full_clones = (clone_mode or CloneMode.default()).is_full
+
+            def references(uri):
+                # Mirrors are not created for shallow and partial clones, as that would download the full history
+                path = local_repos.get(UpdateScheduler.get_repo_key(uri))
+                return local_reference(path) if path or mirrors is None else mirrors.use(uri, create=full_clones)
+
+            ws.load()
+            results = ws.update(jobs=jobs, references=references, clone_mode=clone_mode)
+            if mirrors is not None:
+                mirrors.start_refresh()
+            try:
+                rosdep_index.result()
+            except Exception as err:
+                click.secho("Could not load rosdep database: {}".format(err), fg="yellow")
+                resolver.invalidate()
+        if not all(r.success for r in results):
+            click.secho("Some repos could not be cloned.", fg="red")
+            sys.exit(1)
+        ws.resolve_dependencies(resolver=resolver, clone_mode=clone_mode)
 
-        # Build workspace
+        # Build workspace. It was just created, so there is nothing to clean.
         click.secho("Building workspace", fg="green")
-        subprocess.call(["catkin", "clean", "-a"])
         subprocess.call(["catkin", "build"])
 
     else:
         click.secho("ERROR: Snapshot version not known.", fg="red")
+
+
+def open_snapshot_(name, store=None):
+    """
+    Open a snapshot file. If there is no such file, the stored snapshot with this name is exported and opened.
+    :param name: Path to a snapshot file or name of a stored snapshot
+    :param store: SnapshotStore, defaults to the one in the config directory
+    :return: ZipFile
+    :raises IOError: If there is neither the file nor a stored snapshot
+    """
+    if os.path.isfile(name):
+        return zipfile.ZipFile(name, "r", zipfile.ZIP_DEFLATED)
+    own_store = store is None
+    store = store or SnapshotStore()
+    tmp_dir = tempfile.mkdtemp()
+    try:
+        if not store.exists(name):
+            raise IOError("No snapshot named '{}'".format(name))
+        filename = os.path.join(tmp_dir, name + user_settings['Snapshot']['FILE_ENDING'])
+        store.export(name, filename)
+        # ZipFile opens the file again for every member, unless it is given a file object
+        return zipfile.ZipFile(open(filename, "rb"), "r", zipfile.ZIP_DEFLATED)
+    finally:
+        if own_store:
+            store.close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)  # The open archive stays readable
+
+
+def get_snapshot_name_(store, name):
+    """Returns the name of a stored snapshot. Snapshot files are added to the store first."""
+    if os.path.isfile(name):
+        return store.add_archive(name)
+    if not store.exists(name):
+        click.secho("No snapshot file or stored snapshot named '{}'".format(name), fg="red")
+        sys.exit(1)
+    return name
+
+
+@main.command(short_help="Add snapshot files to the local snapshot store.",
+              help="Snapshots created with 'mrt snapshot create' are added to the store automatically. Use this "
+                   "command to add snapshot files created elsewhere.")
+@click.argument("files", type=click.Path(exists=True, dir_okay=False), required=True, nargs=-1)
+def add(files):
+    """Add snapshot files to the store"""
+    store = SnapshotStore()
+    for filename in files:
+        click.echo("Added " + store.add_archive(filename))
+    store.close()
+
+
+@main.command(name="list", short_help="List the snapshots in the local snapshot store.")
+def list_snapshots():
+    """List stored snapshots"""
+    store = SnapshotStore()
+    for name, created, repo_count in store.get_snapshots():
+        click.echo("{0}  {1:>4} repos  {2}".format(time.strftime("%Y-%m-%d %H:%M", time.localtime(created)),
+                                                   repo_count, name))
+    store.close()
+
+
+@main.command(short_help="Compare two snapshots.",
+              help="Shows which repos were added, removed or moved to another commit between snapshot OLD and "
+                   "snapshot NEW, and which config files changed. Both can be snapshot files or names of stored "
+                   "snapshots.")
+@click.argument("old", type=click.STRING, required=True)
+@click.argument("new", type=click.STRING, required=True)
+def diff(old, new):
+    """Compare two snapshots"""
+    store = SnapshotStore()
+    changes, changed_files = store.diff(get_snapshot_name_(store, old), get_snapshot_name_(store, new))
+    store.close()
+    if not changes and not changed_files:
+        click.echo("The snapshots are identical.")
+    for change in changes:
+        if change.status == "added":
+            click.secho("+ {0}  {1}".format(change.local_name, change.new[1]), fg="green")
+        elif change.status == "removed":
+            click.secho("- {0}  {1}".format(change.local_name, change.old[1]), fg="red")
+        else:
+            click.secho("~ {0}  {1} -> {2}".format(change.local_name, change.old[1], change.new[1]), fg="yellow")
+            if change.old[0] != change.new[0]:
+                click.echo("    url: {0} -> {1}".format(change.old[0], change.new[0]))
+    for path in changed_files:
+        click.secho("~ {}".format(path), fg="yellow")
+
+
+@main.command(short_help="Find snapshots containing a commit.",
+              help="Lists all stored snapshots, in which REPO is pinned to COMMIT. REPO can be the name of the repo in "
+                   "the workspace or a part of its url, COMMIT can be abbreviated. Use '@<sha>' to search all repos.")
+@click.argument("spec", type=click.STRING, required=True, metavar="REPO@COMMIT")
+def find(spec):
+    """Find snapshots by commit"""
+    if "@" not in spec:
+        raise click.BadParameter("Expected REPO@COMMIT", param_hint="spec")
+    repo, version = spec.rsplit("@", 1)
+    store = SnapshotStore()
+    results = store.find(repo, version)
+    store.close()
+    if not results:
+        click.echo("No snapshot contains {}.".format(spec))
+    for name, local_name, full_version in results:
+        click.echo("{0}  {1}@{2}".format(name, local_name, full_version))
@@ -1,5 +1,6 @@
 from mrt_tools.Workspace import Workspace
 from mrt_tools.Git import test_git_credentials
+from mrt_tools.CloneMode import CloneMode
 from mrt_tools.utilities import *
 
 
@@ -7,7 +8,7 @@ from mrt_tools.utilities import *
 # WStool
 ########################################################################################################################
 @click.command(context_settings=dict(ignore_unknown_options=True, ), short_help="A wrapper for wstool.",
-               help=subprocess.check_output(["wstool", "--help"]))
+               help=get_help_text("wstool --help"))
 @click.argument('action', type=click.STRING)
 @click.argument('args', nargs=-1, type=click.UNPROCESSED)
 def main(action, args):
@@ -35,6 +36,12 @@ def main(action, args):
 
         ws.recreate_index() # Rebuild .rosinstall in case a package was deletetd manually
 
+        # Plain updates are done natively, everything else is passed to wstool
+        jobs, pkgs, clone_mode = parse_update_args_(args)
+        if pkgs is not None:
+            results = ws.update_only(pkgs or ws.get_wstool_package_names(), jobs=jobs, clone_mode=clone_mode)
+            sys.exit(0 if all(r.success for r in results) else 1)
+
         # Speedup the pull process by parallelization
         if not [a for a in args if a.startswith("-j")]:
             args += ("-j10",)
@@ -70,3 +77,41 @@ def main(action, args):
         ws.unpushed_repos()
 
     sys.exit(process.returncode)
+
+
+def parse_update_args_(args):
+    """
+    Split the arguments of 'wstool update' into job count, package names and the clone mode of missing repos
+    (--depth N, --filter SPEC, --full)
+    :param args: Arguments of the update command
+    :return: Tuple (jobs, packages, CloneMode or None). packages is None, if other options were given.
+    """
+    jobs = None
+    depth = None
+    blob_filter = None
+    full = False
+    pkgs = []
+    args = list(args)
+    while args:
+        arg = args.pop(0)
+        if arg in ("-j", "--jobs") and args and args[0].isdigit():
+            jobs = int(args.pop(0))
+        elif arg.startswith("-j") and arg[2:].isdigit():
+            jobs = int(arg[2:])
+        elif arg.startswith("--jobs=") and arg[7:].isdigit():
+            jobs = int(arg[7:])
+        elif arg == "--depth" and args and args[0].isdigit():
+            depth = int(args.pop(0))
+        elif arg.startswith("--depth=") and arg[8:].isdigit():
+            depth = int(arg[8:])
+        elif arg == "--filter" and args:
+            blob_filter = args.pop(0)
+        elif arg.startswith("--filter="):
+            blob_filter = arg[9:]
+        elif arg == "--full":
+            full = True
+        elif arg.startswith("-"):
+            return None, None, None
+        else:
+            pkgs.append(arg.rstrip("/"))
+    return jobs, pkgs, CloneMode.from_options(depth, blob_filter, full)
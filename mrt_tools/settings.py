@@ -15,17 +15,39 @@ default_settings = {
         'CACHE_LOCK_FILE': os.path.join(CONFIG_DIR, ".repo_cache_lock"),
         'CACHE_LOCK_DECAY_TIME': 30,  # in seconds
         'CACHED_DEPS_WS': os.path.join(CONFIG_DIR, "deps_cache_ws"),
+        'ROSDEP_CACHE_FILE': os.path.join(CONFIG_DIR, "rosdep_cache"),
+        'ROSBAG_CATALOG': os.path.join(CONFIG_DIR, "rosbag_catalog.sqlite"),
+        'TOPIC_CACHE_FILE': os.path.join(CONFIG_DIR, "topic_cache"),
+        'TOPIC_CACHE_TTL': 10,  # in seconds
+        'ROS_MASTER_TIMEOUT': 1.0,  # in seconds
+        'HELP_TEXT_CACHE_DIR': os.path.join(CONFIG_DIR, "help_cache"),
+        'WORKSPACE_CACHE_DIR': ".mrt",  # relative to workspace root
+        'GITLAB_CACHE_DIR': os.path.join(CONFIG_DIR, "gitlab_cache"),
+        'GITLAB_CACHE_TTL': 300,  # in seconds
+        'USE_MIRROR_CACHE': True,  # clone from shared local mirrors
+        'MIRROR_DIR': os.path.join(CONFIG_DIR, "mirrors"),
+        'MIRROR_MAX_SIZE_MB': 20480,
+        'MIRROR_REFRESH_AGE': 600,  # in seconds
     },
     'Gitlab': {
         'HOST_URL': "https://gitlab.mrt.uni-karlsruhe.de",
         'CACHE_GIT_CREDENTIALS_FOR_HTTPS_REPOS': True,
         'GIT_CACHE_TIMEOUT': 900,  # in seconds
-        'STORE_CREDENTIALS_IN': ""
+        'STORE_CREDENTIALS_IN': "",
+        'UPDATE_RETRIES': 3,  # retries after network errors during clone and pull
+        'SSH_CONTROL_PERSIST': 60,  # in seconds, 0 disables ssh connection sharing
+        'CLONE_DEPTH': 0,  # number of commits of new clones, 0 clones the full history
+        'CLONE_FILTER': "",  # partial clone filter of new clones, e.g. blob:none
     },
     'Snapshot': {
         'FILE_ENDING': ".snapshot",
         'SNAPSHOT_VERSION': "0.1.0",
-        'VERSION_FILE': "snapshot.version"
+        'VERSION_FILE': "snapshot.version",
+        'STORE_DIR': os.path.join(CONFIG_DIR, "snapshots"),
+    },
+    'Check': {
+        'REMOTE_WORKSPACE_DIR': "/tmp/docker",  # on the check server, contains a workspace per user and workspace
+        'CCACHE_DIR': os.path.join(CONFIG_DIR, "check_ccache"),
     },
     'Catkin': {
         'SHOW_WARNINGS_DURING_COMPILATION': True,
@@ -33,6 +55,7 @@ default_settings = {
     },
     'Other': {
         'ALLOW_ROOT': False,
+        'MAX_PARALLEL_JOBS': 0,  # 0 means twice the number of cpu cores
         'BASE_YAML_URL': "https://raw.githubusercontent.com/KIT-MRT/mrt_cmake_modules/master/yaml/base.yaml",
         'BASE_YAML_HASH_FILE': os.path.join(CONFIG_DIR, "base_yaml_hash"),
     }
@@ -58,6 +81,8 @@ def read_settings(settings, config_file=CONFIG_FILE):
                     settings[section][key] = config.getboolean(section, key)
                 elif isinstance(value, int):
                     settings[section][key] = config.getint(section, key)
+                elif isinstance(value, float):
+                    settings[section][key] = config.getfloat(section, key)
                 else:
                     settings[section][key] = config.get(section, key)
             else:
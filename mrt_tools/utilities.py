@@ -2,7 +2,11 @@ import urllib2
 
 from mrt_tools.settings import user_settings
 from builtins import str
+import multiprocessing
+import cPickle as pickle
 import subprocess
+import tempfile
+import hashlib
 import zipfile
 import shutil
 import fnmatch
@@ -135,6 +139,55 @@ def touch(filename, times=None):
             os.utime(filename, times)
 
 
+def write_atomic(filename, data, mode=0o644):
+    """
+    Write data to a file without ever exposing a partially written file to concurrent readers.
+    The data is written to a temporary file in the same directory first, which is then renamed.
+    :param filename: Path to file
+    :param data: String to write
+    :param mode: Permissions of the file
+    """
+    dir_name = os.path.dirname(os.path.abspath(filename))
+    if not os.path.exists(dir_name):
+        os.makedirs(dir_name)
+    fd, tmp_name = tempfile.mkstemp(dir=dir_name, prefix="." + os.path.basename(filename) + ".")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_name, mode)
+        os.rename(tmp_name, filename)
+    except (IOError, OSError):
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+        raise
+
+
+def escape_like(value):
+    """Escape the special characters of an SQL LIKE pattern, for use with ESCAPE '\\'"""
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def get_job_count(tasks=None):
+    """
+    Returns the number of parallel workers to use
+    :param tasks: Number of tasks to process. There are never more workers than tasks.
+    :return: Number of workers
+    """
+    jobs = user_settings['Other']['MAX_PARALLEL_JOBS'] or 2 * multiprocessing.cpu_count()
+    if tasks is not None:
+        jobs = min(jobs, tasks)
+    return max(jobs, 1)
+
+
+def get_git_version():
+    """
+    Returns the version of the installed git
+    :return: Tuple of ints, e.g. (2, 17, 1)
+    """
+    output = subprocess.check_output(["git", "--version"])
+    return tuple(int(part) for part in re.search(r"(\d+(?:\.\d+)*)", output).group(1).split("."))
+
+
 def update_apt_and_ros_packages():
     f_null = open(os.devnull, 'w')
     subprocess.call(["sudo", "apt-get", "update", "-o", "Dir::Etc::sourcelist=", "sources.list.d/mrt.list",
@@ -172,10 +225,9 @@ def check_naming(pkg_name):
 
 
 def get_rosdeps():
-    """ Returns a list of all rosdep dependencies known"""
-    process = subprocess.Popen(['rosdep', 'db'], stdout=subprocess.PIPE)
-    output, __ = process.communicate()
-    return [line.split(" -> ")[0] for line in output.split("\n") if " -> " in line]
+    """ Returns a set of all rosdep dependencies known"""
+    from mrt_tools.RosdepResolver import RosdepResolver
+    return RosdepResolver().keys()
 
 
 def create_directories(pkg_name, pkg_type, ros):
@@ -344,13 +396,166 @@ def import_repo_names(ctx=None, incomplete=None, cwords=None, cword=None):
         with open(user_settings['Cache']['CACHE_FILE'], "r") as f:
             repos = f.read()
         return repos.split(",")[:-1]
-    except OSError:
+    except (IOError, OSError):
+        return []
+
+
+def read_topic_cache():
+    """
+    :return: Tuple (list of topics, master uri they were read from, age in seconds) or None if there is no cache
+    """
+    import time
+    cache_file = user_settings['Cache']['TOPIC_CACHE_FILE']
+    try:
+        with open(cache_file, "r") as f:
+            lines = f.read().splitlines()
+        age = time.time() - os.path.getmtime(cache_file)
+    except (IOError, OSError):
+        return None
+    if not lines:
+        return None
+    return lines[1:], lines[0], age
+
+
+def refresh_topic_cache(timeout=None):
+    """
+    Read the published topics from the ros master and write them to the topic cache.
+    :param timeout: Maximum time in seconds to wait for the master
+    :return: List of topics, empty if the master could not be reached
+    """
+    import socket
+    master_uri = os.environ.get("ROS_MASTER_URI", "")
+    timeout = user_settings['Cache']['ROS_MASTER_TIMEOUT'] if timeout is None else timeout
+    old_timeout = socket.getdefaulttimeout()
+    socket.setdefaulttimeout(timeout)
+    try:
+        import rosgraph
+        topics = sorted(name for name, _ in rosgraph.Master("/mrt").getPublishedTopics("/"))
+    except Exception:  # No ros, no master or timeout: there is nothing to complete
+        topics = []
+    finally:
+        socket.setdefaulttimeout(old_timeout)
+    write_atomic(user_settings['Cache']['TOPIC_CACHE_FILE'], "\n".join([master_uri] + topics) + "\n")
+    return topics
+
+
+def import_topic_names(ctx=None, incomplete=None, cwords=None, cword=None):
+    """
+    Returns the published topics for autocompletion, without leading slash. The topics are read from a cache and
+    never from the network. If the cache is older than TOPIC_CACHE_TTL or belongs to another master, it is refreshed
+    in a background process.
+    """
+    cached = read_topic_cache()
+    master_uri = os.environ.get("ROS_MASTER_URI", "")
+    if cached is None or cached[1] != master_uri or cached[2] > user_settings['Cache']['TOPIC_CACHE_TTL']:
+        # Touch the cache first, so that only one refresh is started at a time
+        if cached is None:
+            write_atomic(user_settings['Cache']['TOPIC_CACHE_FILE'], master_uri + "\n")
+        else:
+            touch(user_settings['Cache']['TOPIC_CACHE_FILE'])
+        devnull = open(os.devnull, 'wb')
+        subprocess.Popen(['mrt maintenance update_topic_cache --quiet'], shell=True, stdin=devnull, stdout=devnull,
+                         stderr=devnull)
+    if cached is None or cached[1] != master_uri:
+        return []
+    return [topic[1:] if topic.startswith("/") else topic for topic in cached[0]]
+
+
+def find_workspace_root(path=None):
+    """
+    Find the root directory of a catkin workspace without loading it.
+    :param path: Directory to start searching from, defaults to '.'
+    :return: Path to workspace root or None
+    """
+    current_dir = os.path.abspath(path or os.getcwd())
+    while current_dir != "/" and current_dir != "":
+        if os.path.isdir(os.path.join(current_dir, ".catkin_tools")):
+            return current_dir
+        current_dir = os.path.dirname(current_dir)
+    return None
+
+
+def get_workspace_cache_dir(ws_root):
+    """Returns the directory in which mrt tools keep cached data of a workspace"""
+    return os.path.join(ws_root, user_settings['Cache']['WORKSPACE_CACHE_DIR'])
+
+
+def get_package_names_file(ws_root):
+    """Returns the path of the file listing all package names of a workspace, used for autocompletion"""
+    return os.path.join(get_workspace_cache_dir(ws_root), "package_names")
+
+
+def get_git_url_cache_file(ws_root):
+    """Returns the path of the file caching the remote urls of all repos in a workspace"""
+    return os.path.join(get_workspace_cache_dir(ws_root), "git_urls")
+
+
+def get_clone_mode_file(ws_root):
+    """Returns the path of the file recording which repos of a workspace are shallow or partial clones"""
+    return os.path.join(get_workspace_cache_dir(ws_root), "clone_modes")
+
+
+def read_git_urls(src, pkg_names, cache_file):
+    """
+    Read the remote urls of several repos. The '.git/config' of a repo is only parsed again, if it changed since the
+    last call.
+    :param src: Directory containing the repos
+    :param pkg_names: Names of the repo directories
+    :param cache_file: File to store parsed urls in
+    :return: Dict {pkg_name: url} of all repos with a remote url
+    """
+    try:
+        with open(cache_file, "rb") as f:
+            cache = pickle.load(f)
+    except Exception:  # Missing or corrupt cache files are simply rebuilt
+        cache = {}
+
+    urls = {}
+    entries = {}
+    for pkg in pkg_names:
+        git_config = os.path.join(src, pkg, ".git", "config")
+        try:
+            stat = os.stat(git_config)
+        except OSError:
+            continue
+        key = (stat.st_mtime, stat.st_size)
+        entry = cache.get(pkg)
+        if entry is None or entry[0] != key:
+            try:
+                with open(git_config, "r") as f:
+                    entry = (key, next((line.split("=", 1)[1].strip() for line in f
+                                        if line.strip().startswith("url")), None))
+            except IOError:
+                continue
+        entries[pkg] = entry
+        if entry[1]:
+            urls[pkg] = entry[1]
+
+    if entries != cache:
+        try:
+            write_atomic(cache_file, pickle.dumps(entries, pickle.HIGHEST_PROTOCOL))
+        except (IOError, OSError):
+            pass
+    return urls
+
+
+def import_package_names(ctx=None, incomplete=None, cwords=None, cword=None):
+    """
+    Read in the package names of the current workspace from the index, that is written every time a workspace is
+    loaded. This avoids scanning the workspace during autocompletion.
+    """
+    ws_root = find_workspace_root()
+    if ws_root is None:
+        return []
+    try:
+        with open(get_package_names_file(ws_root), "r") as f:
+            return f.read().split()
+    except (IOError, OSError):
         return []
 
 
 def changed_base_yaml():
     click.echo("Testing for changes in rosdeps...")
-    import hashlib
     hasher = hashlib.md5()
 
     # Read hashes
@@ -389,10 +594,26 @@ def get_help_text(command):
     :return: Formatted help text
     """
     command_args = command.split()
+
+    # Help texts are cached, because they are needed every time a plugin is loaded. The cache is invalidated, whenever
+    # the executable changes.
+    executable = which(command_args[0])
     try:
-        help_text = subprocess.check_output(command_args)
-    except OSError:
-        help_text = "*** ERROR in get_help_text() ... please contact the package maintainer. ***"
+        exec_mtime = os.path.getmtime(executable)
+    except (OSError, TypeError):
+        exec_mtime = None
+    cache_key = hashlib.md5("{} {}".format(command, exec_mtime)).hexdigest()
+    cache_file = os.path.join(user_settings['Cache']['HELP_TEXT_CACHE_DIR'], cache_key)
+
+    try:
+        with open(cache_file, "r") as f:
+            help_text = f.read()
+    except (IOError, OSError):
+        try:
+            help_text = subprocess.check_output(command_args)
+            write_atomic(cache_file, help_text)
+        except (OSError, subprocess.CalledProcessError):
+            help_text = "*** ERROR in get_help_text() ... please contact the package maintainer. ***"
 
     # reformatted = "This is the help text for '{}':\n\n\b\n".format(command)
     reformatted = "\b\n"
@@ -52,6 +52,7 @@ setup(
                       'python-gssapi==0.6.4',
                       'pyapi-gitlab',
                       'pyparsing',
+                      'pyinotify==0.9.6',
                       'hashlib==20081119',
                       'osrf-pycommon==0.1.2',
                       'paramiko==1.16.0',
@@ -0,0 +1,33 @@
+from mrt_tools.BagWatcher import BagWatcher
+import threading
+import pytest
+
+
+@pytest.fixture(params=[True, False], ids=["inotify", "polling"])
+def use_inotify(request):
+    if request.param:
+        pytest.importorskip("pyinotify")
+    return request.param
+
+
+def test_split_bags_are_reported_when_closed(tmpdir, use_inotify):
+    tmpdir.join("rec.bag").write("old")  # Existing bags are ignored
+    tmpdir.join("other_0.bag").write("")
+    reported = []
+    watcher = BagWatcher(str(tmpdir.join("rec.bag")), reported.append, poll_interval=0.01)
+    watcher.start(use_inotify)
+
+    tmpdir.join("rec_0.bag.active").write("")
+    tmpdir.join("rec_1.bag.active").write("")
+    tmpdir.join("rec_0.bag.active").rename(tmpdir.join("rec_0.bag"))
+    timer = threading.Timer(0.1, lambda: tmpdir.join("rec_1.bag.active").rename(tmpdir.join("rec_1.bag")))
+    timer.start()
+    assert watcher.wait(timeout=10)
+    timer.join()
+    assert sorted(reported) == [str(tmpdir.join("rec_0.bag")), str(tmpdir.join("rec_1.bag"))]
+
+
+def test_wait_until_closed(tmpdir, use_inotify):
+    tmpdir.join("rec.bag.active").write("")
+    threading.Timer(0.1, lambda: tmpdir.join("rec.bag.active").rename(tmpdir.join("rec.bag"))).start()
+    assert BagWatcher.wait_until_closed(str(tmpdir.join("rec.bag")), timeout=10)
@@ -0,0 +1,38 @@
+from mrt_tools.DagScheduler import DagScheduler
+import threading
+import time
+
+
+def test_dependencies_finish_first():
+    finished = []
+    lock = threading.Lock()
+
+    def job(name):
+        time.sleep(0.05 if name == "b" else 0.01)
+        with lock:
+            finished.append(name)
+        return name.upper()
+
+    # a depends on b and c, d is independent, "boost" is not part of the schedule
+    dependencies = {"a": ["b", "c", "boost"], "b": [], "c": ["b"], "d": []}
+    results = DagScheduler(jobs=4, quiet=True).run(dependencies, job)
+    assert all(r.success for r in results.values())
+    assert results["a"].output == "A"
+    assert finished.index("a") > finished.index("c") > finished.index("b")
+    assert finished.index("d") < finished.index("b")
+
+
+def test_failed_dependencies_are_skipped():
+    def job(name):
+        if name == "b":
+            raise RuntimeError("doxygen failed")
+
+    results = DagScheduler(jobs=2, quiet=True).run({"a": ["b"], "b": [], "c": ["a"], "d": []}, job)
+    assert results["b"].error == "doxygen failed"
+    assert results["a"].skipped and results["c"].skipped
+    assert results["d"].success
+
+
+def test_cycles_do_not_deadlock():
+    results = DagScheduler(jobs=2, quiet=True).run({"a": ["b"], "b": ["a"]}, lambda name: None)
+    assert all(r.success for r in results.values())
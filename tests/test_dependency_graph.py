@@ -0,0 +1,58 @@
+from mrt_tools.DependencyGraph import DependencyGraph, DEPENDENCY_TYPES
+import pytest
+
+
+class FakeDependency(object):
+    def __init__(self, name):
+        self.name = name
+
+
+class FakePackage(object):
+    def __init__(self, name, build=(), exec_=(), test=()):
+        self.name = name
+        for attribute in DEPENDENCY_TYPES.values():
+            setattr(self, attribute, [])
+        self.build_depends = [FakeDependency(d) for d in build]
+        self.exec_depends = [FakeDependency(d) for d in exec_]
+        self.test_depends = [FakeDependency(d) for d in test]
+
+
+@pytest.fixture
+def graph():
+    # a -> b, c; b -> d; c -> d (diamond); d -> e -> d (cycle); e -> boost (system dependency)
+    packages = [FakePackage("a", build=["b"], exec_=["c"]),
+                FakePackage("b", build=["d"]),
+                FakePackage("c", build=["d"], test=["gtest"]),
+                FakePackage("d", build=["e"]),
+                FakePackage("e", build=["d", "boost"])]
+    return DependencyGraph({pkg.name: pkg for pkg in packages})
+
+
+def test_direct_dependencies(graph):
+    assert graph.dependencies("a") == {"b", "c"}
+    assert graph.dependencies("a", ["build"]) == {"b"}
+    assert graph.dependencies("boost") == set()
+
+
+def test_transitive_dependencies(graph):
+    assert graph.transitive_dependencies("a") == {"b", "c", "d", "e", "boost", "gtest"}
+    assert graph.transitive_dependencies("a", ["build"]) == {"b", "d", "e", "boost"}
+    assert graph.transitive_dependencies("d") == {"e", "boost"}
+    assert graph.transitive_dependencies("e") == {"d", "boost"}
+
+
+def test_reverse_dependencies(graph):
+    assert graph.reverse_dependencies("d") == {"b", "c", "e"}
+    assert graph.reverse_dependencies("a") == set()
+    assert graph.reverse_dependencies("gtest", ["build"]) == set()
+
+
+def test_subgraph(graph):
+    assert graph.subgraph(["b"]) == {"b": {"d"}, "d": {"e"}, "e": {"d", "boost"}}
+
+
+def test_tree_terminates_on_cycles(graph):
+    tree = graph.to_tree("a")
+    assert set(tree["a"].keys()) == {"b", "c"}
+    assert tree["a"]["b"]["d"] is tree["a"]["c"]["d"]
+    assert tree["a"]["b"]["d"]["e"]["d"] == {}
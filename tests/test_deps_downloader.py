@@ -0,0 +1,73 @@
+from mrt_tools.DepsDownloader import DepsDownloader
+from mrt_tools.GitlabCache import GitlabCache
+import hashlib
+import pytest
+import os
+
+
+class FakeGitlab(object):
+    """Serves branches, trees and blobs of repos with a single package.xml per branch"""
+
+    def __init__(self, files):
+        self.files = files  # {(repo id, branch): content}
+        self.blob_requests = 0
+
+    def get(self, url, params=None, headers=None, auth=None):
+        parts = url.split("/api/v3/projects/", 1)[1].split("/")
+        repo_id = int(parts[0])
+        if parts[-1] == "branches":
+            if params["page"] > 1:
+                return 200, {}, []
+            return 200, {}, [{"name": b} for r, b in sorted(self.files) if r == repo_id]
+        content = self.files[(repo_id, params["ref_name"])]
+        return 200, {}, [{"name": "package.xml", "type": "blob", "id": hashlib.sha1(content).hexdigest()}]
+
+    def get_raw(self, url, params=None, headers=None, auth=None):
+        self.blob_requests += 1
+        sha = url.rsplit("/", 1)[1]
+        return 200, {}, next(c for c in self.files.values() if hashlib.sha1(c).hexdigest() == sha)
+
+
+@pytest.fixture
+def server():
+    return FakeGitlab({(1, "master"): "<package>a</package>", (1, "devel"): "<package>a2</package>",
+                       (2, "master"): "<package>b</package>"})
+
+
+def test_download_changed_files(tmpdir, server):
+    cache = GitlabCache("https://gitlab.example.com/api/v3", cache_dir=str(tmpdir.join("cache")), backend=server)
+    target = str(tmpdir.join("deps"))
+    repos = [{"id": 1, "name": "a", "path_with_namespace": "ns/a", "namespace": {"name": "ns"}},
+             {"id": 2, "name": "b", "path_with_namespace": "ns/b", "namespace": {"name": "ns"}}]
+
+    results = DepsDownloader(cache, target, jobs=2).run(repos)
+    assert sum(r.downloaded for r in results) == 3
+    with open(os.path.join(target, "ns", "a", "devel", "package.xml")) as f:
+        assert f.read() == "<package>a2</package>"
+
+    server.files[(2, "master")] = "<package>b2</package>"
+    del server.files[(1, "devel")]
+    server.blob_requests = 0
+    results = DepsDownloader(cache, target, jobs=2).run(repos)
+    assert server.blob_requests == 1
+    assert sum(r.unchanged for r in results) == 1
+    assert not os.path.exists(os.path.join(target, "ns", "a", "devel", "package.xml"))
+    with open(os.path.join(target, "ns", "b", "master", "package.xml")) as f:
+        assert f.read() == "<package>b2</package>"
+
+
+def test_invalid_responses_fail_only_their_repo(tmpdir, server):
+    def get(url, params=None, headers=None, auth=None):
+        if "/projects/2/repository/tree" in url:
+            raise ValueError("No JSON object could be decoded")
+        return FakeGitlab.get(server, url, params)
+
+    server.get = get
+    cache = GitlabCache("https://gitlab.example.com/api/v3", cache_dir=str(tmpdir.join("cache")), backend=server)
+    target = str(tmpdir.join("deps"))
+    repos = [{"id": 1, "name": "a", "path_with_namespace": "ns/a", "namespace": {"name": "ns"}},
+             {"id": 2, "name": "b", "path_with_namespace": "ns/b", "namespace": {"name": "ns"}}]
+
+    results = {r.name: r for r in DepsDownloader(cache, target, jobs=2, retries=0).run(repos)}
+    assert results["ns/a"].downloaded == 2 and results["ns/a"].error is None
+    assert results["ns/b"].error == "No JSON object could be decoded"
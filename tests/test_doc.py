@@ -0,0 +1,139 @@
+import pytest
+import os
+
+pytest.importorskip("wstool")
+pytest.importorskip("catkin_tools")
+from mrt_tools.commands import mrt_doc
+
+
+class FakeGraph(object):
+    def __init__(self, dependencies):
+        self.deps = dependencies
+
+    def dependencies(self, pkg_name):
+        return self.deps[pkg_name]
+
+    def is_workspace_package(self, pkg_name):
+        return pkg_name in self.deps
+
+
+class FakeWorkspace(object):
+    def __init__(self, dependencies):
+        self.dependency_graph = FakeGraph(dependencies)
+
+
+class FakeContext(object):
+    def __init__(self, ws_root):
+        self.source_space_abs = os.path.join(ws_root, "src")
+        self.build_space_abs = os.path.join(ws_root, "build")
+
+    @staticmethod
+    def load(ws_root):
+        return FakeContext(ws_root)
+
+
+def write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(content)
+
+
+@pytest.fixture
+def workspace(tmpdir, monkeypatch):
+    """Workspace with package a depending on b. doxygen is replaced by a function writing the tag file."""
+    monkeypatch.setattr(mrt_doc, "package_paths_", {})
+    for pkg in ("a", "b"):
+        mrt_doc.package_paths_[pkg] = (str(tmpdir.join("src", pkg)), str(tmpdir.join("build", pkg)))
+        write(str(tmpdir.join("src", pkg, "include", pkg + ".h")), "int " + pkg + ";")
+
+    runs = []
+
+    def run_doxygen(config, package_src_dir):
+        runs.append(config["PROJECT_NAME"].strip('"'))
+        write(config["GENERATE_TAGFILE"].strip('"'), "run {}".format(len(runs)))
+        return ""
+
+    monkeypatch.setattr(mrt_doc, "run_doxygen_", run_doxygen)
+    return FakeWorkspace({"a": {"b", "roscpp"}, "b": set()}), runs
+
+
+def test_unchanged_packages_are_skipped(workspace, tmpdir):
+    ws, runs = workspace
+    assert mrt_doc.build_(ws, "b", force=False) == ""
+    assert mrt_doc.build_(ws, "a", force=False) == ""
+    assert runs == ["b", "a"]
+
+    assert mrt_doc.build_(ws, "b", force=False) is None
+    assert mrt_doc.build_(ws, "a", force=False, verbose=True) is None
+    assert runs == ["b", "a"]
+
+    # Changed sources of a only rebuild a
+    write(str(tmpdir.join("src", "a", "include", "a.h")), "int a2;")
+    mrt_doc.build_(ws, "b", force=False)
+    mrt_doc.build_(ws, "a", force=False)
+    assert runs == ["b", "a", "a"]
+
+    # Rebuilding b changes its tag file, which a depends on
+    write(str(tmpdir.join("src", "b", "doc", "intro.md")), "# b")
+    mrt_doc.build_(ws, "b", force=False)
+    mrt_doc.build_(ws, "a", force=False)
+    assert runs == ["b", "a", "a", "b", "a"]
+
+    mrt_doc.build_(ws, "b")
+    assert runs[-1] == "b" and len(runs) == 6
+
+
+def test_missing_tag_file_is_rebuilt(workspace, tmpdir):
+    ws, runs = workspace
+    mrt_doc.build_(ws, "b", force=False)
+    os.remove(str(tmpdir.join("build", "b", "doxygen_doc", "b.tag")))
+    mrt_doc.build_(ws, "b", force=False)
+    assert runs == ["b", "b"]
+
+
+def test_doc_build_hash(tmpdir):
+    src = str(tmpdir.join("src"))
+    tag_file = str(tmpdir.join("dep.tag"))
+    write(os.path.join(src, "include", "a.h"), "int a;")
+    write(os.path.join(src, "README.md"), "# a")
+    write(tag_file, "tags")
+    config = {"PROJECT_NAME": '"a"', "QUIET": "YES"}
+
+    def get_hash(cfg=config):
+        return mrt_doc.get_doc_build_hash_(cfg, src, ["README.md", "include"], [tag_file])
+
+    original = get_hash()
+    assert get_hash() == original
+    assert get_hash({"PROJECT_NAME": '"a"'}) == original
+    assert get_hash({"PROJECT_NAME": '"b"'}) != original
+
+    write(os.path.join(src, "include", "a.h"), "int b;")
+    changed = get_hash()
+    assert changed != original
+    write(os.path.join(src, "include", "detail", "b.h"), "")
+    assert get_hash() != changed
+
+    changed = get_hash()
+    write(tag_file, "other tags")
+    assert get_hash() != changed
+    changed = get_hash()
+    os.remove(tag_file)
+    assert get_hash() != changed
+
+
+def test_package_paths_from_index(tmpdir, monkeypatch):
+    ws_root = str(tmpdir)
+    write(os.path.join(ws_root, "src", "drivers", "camera", "package.xml"),
+          '<package format="2"><name>camera_driver</name><version>0.0.1</version><description>d</description>'
+          '<maintainer email="test@example.com">Tester</maintainer><license>BSD</license></package>')
+    monkeypatch.setattr(mrt_doc, "package_paths_", {})
+    monkeypatch.setattr(mrt_doc, "find_workspace_root", lambda: ws_root)
+    monkeypatch.setattr(mrt_doc, "Context", FakeContext)
+
+    src_dir, build_dir, output_dir = mrt_doc.check_paths_("camera_driver")
+    assert src_dir == os.path.join(ws_root, "src", "drivers", "camera")
+    assert build_dir == os.path.join(ws_root, "build", "camera_driver")
+    assert output_dir == os.path.join(build_dir, "doxygen_doc")
+    with pytest.raises(SystemExit):
+        mrt_doc.check_paths_("camera")
@@ -0,0 +1,86 @@
+from mrt_tools.GitlabCache import GitlabCache
+import pytest
+import stat
+import os
+
+
+class FakeGitlab(object):
+    """Serves paginated collections like gitlab, including ETags"""
+
+    def __init__(self, collections):
+        self.collections = collections
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, auth=None):
+        items = self.collections[url.rsplit("/api/v3/", 1)[1]]
+        if isinstance(items, dict):
+            self.requests.append((url, None))
+            return 200, {}, items
+        self.requests.append((url, params["page"]))
+        start = (params["page"] - 1) * params["per_page"]
+        page = items[start:start + params["per_page"]]
+        etag = '"{}"'.format(hash(repr(page)))
+        if headers.get("If-None-Match") == etag:
+            return 304, {}, None
+        return 200, {"ETag": etag}, page
+
+
+@pytest.fixture
+def server():
+    return FakeGitlab({"projects": [{"id": i, "name": "repo_{}".format(i)} for i in range(5)],
+                       "users": [{"username": "user"}],
+                       "projects/1/repository/branches": [{"name": "master"}],
+                       "user": {"username": "user", "private_token": "token"}})
+
+
+@pytest.fixture
+def cache(tmpdir, server):
+    return GitlabCache("https://gitlab.example.com/api/v3", headers={"PRIVATE-TOKEN": "token"},
+                       cache_dir=str(tmpdir), ttl=60, backend=server, per_page=2)
+
+
+def test_serve_from_cache(cache, server):
+    assert [p["id"] for p in cache.get_projects()] == range(5)
+    assert len(server.requests) == 3
+    assert cache.get_projects() == server.collections["projects"]
+    assert len(server.requests) == 3
+    for filename in os.listdir(cache.cache_dir):
+        assert stat.S_IMODE(os.stat(os.path.join(cache.cache_dir, filename)).st_mode) == 0o600
+
+
+def test_revalidate_changed_pages(cache, server):
+    cache.get_projects()
+    server.collections["projects"][4]["name"] = "renamed"
+    server.requests = []
+
+    projects = cache.get_projects(max_age=0)
+    assert projects[4]["name"] == "renamed"
+    assert len(server.requests) == 3
+    assert cache.not_modified == 2
+
+
+def test_current_user_is_not_cached(cache, server):
+    assert cache.get_current_user() == {"username": "user"}
+    assert cache.get_current_user() == {"username": "user"}
+    assert len(server.requests) == 2
+    assert os.listdir(cache.cache_dir) == []
+
+
+def test_evict(cache, server):
+    cache.get_projects()
+    cache.get_users()
+    cache.get_branches(1)
+    assert cache.evict("user") == 0
+    assert cache.evict("projects") == 2
+    cache.get_projects()
+    assert len(server.requests) == 8
+    assert cache.evict() == 2
+
+
+def test_stale_data_if_offline(cache, server):
+    cache.get_projects()
+
+    def offline(*args, **kwargs):
+        raise IOError("Connection refused")
+    server.get = offline
+    assert len(cache.get_projects(max_age=0)) == 5
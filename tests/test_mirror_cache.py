@@ -0,0 +1,81 @@
+from mrt_tools.MirrorCache import MirrorCache
+from mrt_tools.UpdateScheduler import UpdateScheduler
+from mrt_tools.CloneMode import CloneMode
+from test_update_scheduler import FakeElement, git
+import subprocess
+import pytest
+import os
+
+
+@pytest.fixture
+def remote(tmpdir):
+    remote = str(tmpdir.join("remote"))
+    subprocess.check_call(["git", "init", "-q", remote])
+    with open(os.path.join(remote, "file"), "w") as f:
+        f.write("content")
+    git(remote, "add", "file")
+    git(remote, "commit", "-q", "-m", "Initial commit")
+    return remote
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return MirrorCache(str(tmpdir.join("mirrors")), max_size=100, refresh_age=0, background_refresh=False)
+
+
+def test_clones_use_mirror(tmpdir, remote, cache):
+    scheduler = UpdateScheduler(jobs=2, retries=0, references=cache.use)
+    results = scheduler.run([FakeElement("a", str(tmpdir.join("ws1", "a")), remote),
+                             FakeElement("missing", str(tmpdir.join("ws1", "missing")), remote + "_missing")])
+    assert {r.name: r.success for r in results} == {"a": True, "missing": False}
+    assert os.path.isdir(cache.get_path(remote))
+
+    sha = subprocess.check_output(["git", "-C", remote, "rev-parse", "HEAD"]).strip()
+    result, = scheduler.run([FakeElement("a", str(tmpdir.join("ws2", "a")), remote, sha)])
+    assert result.success
+    assert os.path.exists(str(tmpdir.join("ws2", "a", "file")))
+    assert cache.get_stats() == {"hits": 1, "misses": 2}
+
+
+def test_refresh_and_evict(remote, cache):
+    with cache.use(remote) as path:
+        assert path == cache.get_path(remote)
+        # Mirrors in use are not evicted
+        assert cache.evict(0) == []
+
+    git(remote, "commit", "-q", "--allow-empty", "-m", "Second commit")
+    assert cache.refresh_all([remote, remote + "_missing"]) == 1
+    sha = subprocess.check_output(["git", "-C", remote, "rev-parse", "HEAD"]).strip()
+    assert subprocess.check_output(["git", "--git-dir", cache.get_path(remote), "rev-parse", "HEAD"]).strip() == sha
+
+    assert [m[0] for m in cache.get_mirrors()] == [cache.get_path(remote)]
+    assert cache.evict(0) == [cache.get_path(remote)]
+    assert cache.get_mirrors() == []
+    # The empty lock file is kept, so that concurrent processes lock the same file
+    assert os.path.exists(cache.get_path(remote) + ".lock")
+
+
+def test_stale_mirrors_are_collected(tmpdir, remote):
+    cache = MirrorCache(str(tmpdir.join("mirrors")), max_size=100, refresh_age=0)
+    cache.create(remote)
+    for _ in range(2):
+        with cache.use(remote):
+            pass
+    assert cache.stale == {remote}
+
+
+def test_shallow_clones_do_not_create_mirrors(tmpdir, remote, cache):
+    uri = "file://" + remote
+    element = FakeElement("a", str(tmpdir.join("ws1", "a")), uri)
+    scheduler = UpdateScheduler(jobs=1, retries=0, references=lambda u: cache.use(u, create=False),
+                                clone_modes={"a": CloneMode(depth=1)})
+    result, = scheduler.run([element])
+    assert result.success and UpdateScheduler.is_shallow(element.get_path())
+    assert cache.get_mirrors() == []
+
+    # Existing mirrors are used
+    cache.create(uri)
+    element = FakeElement("a", str(tmpdir.join("ws2", "a")), uri)
+    result, = scheduler.run([element])
+    assert result.success and UpdateScheduler.is_shallow(element.get_path())
+    assert cache.get_stats() == {"hits": 1, "misses": 1}
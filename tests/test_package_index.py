@@ -0,0 +1,55 @@
+from mrt_tools.PackageIndex import PackageIndex
+import pytest
+import time
+import os
+
+MANIFEST = """<?xml version="1.0"?>
+<package format="2">
+  <name>{0}</name>
+  <version>0.0.1</version>
+  <description>Test package</description>
+  <maintainer email="test@example.com">Tester</maintainer>
+  <license>BSD</license>
+  <depend>{1}</depend>
+</package>
+"""
+
+
+@pytest.fixture
+def workspace(tmpdir):
+    ws_root = str(tmpdir)
+    for name, dep in [("pkg_a", "roscpp"), ("pkg_b", "pkg_a")]:
+        os.makedirs(os.path.join(ws_root, "src", name))
+        with open(os.path.join(ws_root, "src", name, "package.xml"), "w") as f:
+            f.write(MANIFEST.format(name, dep))
+    return ws_root
+
+
+def test_index_caches_manifests(workspace):
+    index = PackageIndex(workspace, os.path.join(workspace, "src"))
+    packages = index.get_packages()
+    assert sorted(packages.keys()) == ["pkg_a", "pkg_b"]
+    assert (index.hits, index.misses) == (0, 2)
+
+    # A new index has to read everything from disk
+    index = PackageIndex(workspace, os.path.join(workspace, "src"))
+    packages = index.get_packages()
+    assert packages["pkg_b"].name == "pkg_b"
+    assert [d.name for d in packages["pkg_b"].build_depends] == ["pkg_a"]
+    assert (index.hits, index.misses) == (2, 0)
+
+
+def test_index_detects_changes(workspace):
+    index = PackageIndex(workspace, os.path.join(workspace, "src"))
+    index.get_packages()
+
+    time.sleep(0.01)
+    with open(os.path.join(workspace, "src", "pkg_a", "package.xml"), "w") as f:
+        f.write(MANIFEST.format("pkg_a", "rospy"))
+    os.remove(os.path.join(workspace, "src", "pkg_b", "package.xml"))
+
+    index = PackageIndex(workspace, os.path.join(workspace, "src"))
+    packages = index.get_packages()
+    assert list(packages.keys()) == ["pkg_a"]
+    assert [d.name for d in packages["pkg_a"].build_depends] == ["rospy"]
+    assert (index.hits, index.misses) == (0, 1)
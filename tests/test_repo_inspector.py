@@ -0,0 +1,69 @@
+from mrt_tools.RepoInspector import RepoInspector, RepoStatus
+import subprocess
+import pytest
+import os
+
+
+def git(path, *args):
+    subprocess.check_call(["git", "-C", path, "-c", "user.name=Test", "-c", "user.email=test@example.com"] +
+                          list(args), stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+
+
+@pytest.fixture
+def repos(tmpdir):
+    remote = str(tmpdir.join("remote.git"))
+    subprocess.check_call(["git", "init", "-q", "--bare", remote])
+
+    clean = str(tmpdir.join("clean"))
+    subprocess.check_call(["git", "clone", "-q", remote, clean], stderr=open(os.devnull, "w"))
+    with open(os.path.join(clean, "file"), "w") as f:
+        f.write("content")
+    git(clean, "add", "file")
+    git(clean, "commit", "-q", "-m", "Initial commit")
+    git(clean, "push", "-q", "origin", "HEAD")
+
+    changed = str(tmpdir.join("changed"))
+    subprocess.check_call(["git", "clone", "-q", remote, changed])
+    with open(os.path.join(changed, "file"), "w") as f:
+        f.write("new content")
+    git(changed, "commit", "-q", "-a", "-m", "Unpushed commit")
+    with open(os.path.join(changed, "file"), "w") as f:
+        f.write("uncommited content")
+    with open(os.path.join(changed, "untracked"), "w") as f:
+        f.write("content")
+
+    return [("clean", clean), ("changed", changed), ("missing", str(tmpdir.join("missing")))]
+
+
+def test_inspect_repos(repos):
+    clean, changed, missing = RepoInspector(jobs=2).inspect(repos)
+
+    assert clean.name == "clean"
+    assert clean.error is None
+    assert not clean.has_changes
+    assert clean.upstream is not None
+    assert (clean.ahead, clean.behind) == (0, 0)
+
+    assert changed.dirty
+    assert changed.changes == [" M file"]
+    assert changed.untracked == ["?? untracked"]
+    assert len(changed.unpushed) == 1
+    assert changed.ahead == 1
+
+    assert not missing.exists
+    assert not missing.has_changes
+
+
+def test_broken_repo_counts_as_changed(tmpdir):
+    broken = tmpdir.mkdir("broken")
+    broken.join(".git").write("gitdir: /nonexistent")
+    status, = RepoInspector().inspect([("broken", str(broken))])
+    assert status.error
+    assert status.has_changes
+
+
+def test_parse_detached_head():
+    status = RepoStatus("repo", "/nonexistent")
+    RepoInspector.parse_status(status, "## HEAD (no branch)\n")
+    assert status.branch == "HEAD (no branch)"
+    assert status.upstream is None
@@ -0,0 +1,57 @@
+from mrt_tools.ReverseDependencyIndex import ReverseDependencyIndex
+import pytest
+import os
+
+PACKAGE_XML = """<?xml version="1.0"?>
+<package format="2">
+  <name>{name}</name>
+  <version>0.0.1</version>
+  <description>Test package</description>
+  <maintainer email="test@example.com">Test</maintainer>
+  <license>BSD</license>
+  {deps}
+</package>
+"""
+
+
+def write_package(deps_ws, path, name, deps):
+    filename = os.path.join(deps_ws, path, "package.xml")
+    if not os.path.exists(os.path.dirname(filename)):
+        os.makedirs(os.path.dirname(filename))
+    with open(filename, "w") as f:
+        f.write(PACKAGE_XML.format(name=name, deps="\n  ".join(deps)))
+
+
+@pytest.fixture
+def deps_ws(tmpdir):
+    deps_ws = str(tmpdir)
+    write_package(deps_ws, "ns/foo/master", "foo", [])
+    write_package(deps_ws, "ns/foo_bar/master", "foo_bar", ["<depend>foo</depend>"])
+    write_package(deps_ws, "ns/baz/feature/new", "baz", ["<test_depend>foo_bar</test_depend>"])
+    write_package(deps_ws, "ns/prefix/master", "prefix", ["<build_depend>foo_bar_baz</build_depend>"])
+    return deps_ws
+
+
+def test_lookup(deps_ws):
+    index = ReverseDependencyIndex(deps_ws)
+    assert index.update() == 4
+
+    rdeps = index.lookup("foo")
+    assert set(r.package for r in rdeps) == {"foo_bar"}
+    assert set(r.dep_type for r in rdeps) == {"build", "build_export", "exec"}
+    assert index.lookup("foo", ["test"]) == []
+
+    baz, = index.lookup("foo_bar")
+    assert (baz.namespace, baz.repo, baz.branch, baz.dep_type) == ("ns", "baz", "feature/new", "test")
+
+    # Unchanged files are not parsed again, the index is persistent
+    assert ReverseDependencyIndex(deps_ws).update() == 0
+    assert ReverseDependencyIndex(deps_ws).lookup("foo_bar") == [baz]
+
+
+def test_lookup_transitive(deps_ws):
+    index = ReverseDependencyIndex(deps_ws)
+    index.update()
+    results = index.lookup_transitive("foo", ["exec", "test"])
+    assert [(r.package, via, distance) for r, via, distance in results] == [("foo_bar", "foo", 1),
+                                                                            ("baz", "foo_bar", 2)]
@@ -0,0 +1,99 @@
+from mrt_tools.RosbagCatalog import RosbagCatalog
+import mrt_tools.RosbagCatalog
+import pytest
+import os
+
+METADATA = {
+    "a.bag": {"Environment": {"Location": "Karlsruhe", "Weather": "Rain"}, "Platform": {"VehicleName": "Bertha"}},
+    "b.bag": {"Environment": {"Location": "Karlsruhe", "Weather": "Sunny"}, "Platform": {"VehicleName": "Annieway"}},
+    "c.bag": {"Environment": {"Location": "Munich", "Weather": "Rain"}, "Custom": {"Tags": ["night", "snow"]}},
+}
+
+
+class FakeReader(object):
+    def __init__(self):
+        self.read = []
+
+    def __call__(self, path):
+        self.read.append(os.path.basename(path))
+        return {"start": 10.0, "end": 20.0, "duration": 10.0, "messages": 5,
+                "metadata": METADATA[os.path.basename(path)],
+                "topics": {"/camera/image": ("sensor_msgs/Image", 5)}}
+
+
+@pytest.fixture
+def archive(tmpdir):
+    bags = tmpdir.mkdir("bags")
+    for name in METADATA:
+        bags.join(name).write("x")
+    return tmpdir
+
+
+def names(entries):
+    return sorted(os.path.basename(e.path) for e in entries)
+
+
+def test_find_by_metadata(archive):
+    catalog = RosbagCatalog(str(archive.join("catalog.sqlite")))
+    assert catalog.update([str(archive.join("bags"))], FakeReader()) == (3, 0, 0)
+    assert names(catalog.find(["location=karlsruhe", "weather=rain"])) == ["a.bag"]
+    assert names(catalog.find(["Environment.Weather=rain"])) == ["a.bag", "c.bag"]
+    assert names(catalog.find(["vehiclename=*a*"])) == ["a.bag", "b.bag"]
+    assert names(catalog.find(["tags=snow"])) == ["c.bag"]
+    assert names(catalog.find(["topic=camera/image", "path=*b.bag"])) == ["b.bag"]
+    assert catalog.find(["location=karls"]) == []
+    assert catalog.find(["_ehiclename=*"]) == []
+    with pytest.raises(ValueError):
+        catalog.find(["location"])
+
+
+def test_update_is_incremental(archive):
+    filename = str(archive.join("catalog.sqlite"))
+    bags = str(archive.join("bags"))
+    RosbagCatalog(filename).update([bags], FakeReader())
+
+    reader = FakeReader()
+    archive.join("bags", "b.bag").write("modified")
+    archive.join("bags", "c.bag").remove()
+    catalog = RosbagCatalog(filename)
+    assert catalog.update([bags], reader) == (1, 1, 1)
+    assert reader.read == ["b.bag"]
+    assert names(catalog.find(["location=*"])) == ["a.bag", "b.bag"]
+
+
+def test_unreadable_bags_are_reported(archive):
+    def reader(path):
+        raise IOError("not a bag")
+
+    errors = []
+    catalog = RosbagCatalog(str(archive.join("catalog.sqlite")))
+    assert catalog.update([str(archive.join("bags"))], reader, lambda path, err: errors.append(path)) == (0, 0, 0)
+    assert len(errors) == 3
+
+
+def test_unreachable_bags_outside_the_indexed_paths_are_kept(archive):
+    catalog = RosbagCatalog(str(archive.join("catalog.sqlite")))
+    catalog.update([str(archive.join("bags"))], FakeReader())
+    archive.join("bags").move(archive.join("unmounted"))
+    local = archive.mkdir("local")
+    assert catalog.update([str(local)], FakeReader()) == (0, 0, 0)
+    assert len(catalog.find(["location=*"])) == 3
+
+    # Explicitly given bags are removed, if they are missing
+    assert catalog.update([str(archive.join("bags", "a.bag"))], FakeReader()) == (0, 0, 1)
+    assert names(catalog.find(["location=*"])) == ["b.bag", "c.bag"]
+
+
+def test_interrupted_update_keeps_progress(archive, monkeypatch):
+    monkeypatch.setattr(mrt_tools.RosbagCatalog, "COMMIT_INTERVAL", 1)
+    reader = FakeReader()
+
+    def interrupting_reader(path):
+        if len(reader.read) == 2:
+            raise KeyboardInterrupt()
+        return reader(path)
+
+    filename = str(archive.join("catalog.sqlite"))
+    with pytest.raises(KeyboardInterrupt):
+        RosbagCatalog(filename).update([str(archive.join("bags"))], interrupting_reader)
+    assert names(RosbagCatalog(filename).find(["location=*"])) == ["a.bag", "b.bag"]
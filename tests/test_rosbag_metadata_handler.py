@@ -0,0 +1,81 @@
+from collections import OrderedDict
+import inspect
+import pytest
+
+pytest.importorskip("unidecode")
+from mrt_tools.RosbagMetadataHandler import RosbagMetadataHandler
+
+
+@pytest.fixture
+def data():
+    return OrderedDict([("General", OrderedDict([("LastModified", "Mon Oct  3 10:00:00 2016"),
+                                                 ("Description", "Run {stem}")])),
+                        ("Environment", OrderedDict([("Location", "{location}"), ("Weather", "rain")]))])
+
+
+def test_render_placeholders(data):
+    rendered = RosbagMetadataHandler.render(data, "/campaign/karlsruhe_2016-10-03.bag", r"(?P<location>[a-z]+)_.*")
+    assert rendered["General"]["Description"] == "Run karlsruhe_2016-10-03"
+    assert rendered["Environment"]["Location"] == "karlsruhe"
+    assert data["Environment"]["Location"] == "{location}"
+    with pytest.raises(ValueError):
+        RosbagMetadataHandler.render(data, "/campaign/2016.bag", r"(?P<location>[a-z]+)_.*")
+    with pytest.raises(ValueError):
+        RosbagMetadataHandler.render(data, "/campaign/karlsruhe.bag")
+
+
+def test_same_metadata_ignores_modification_time(data):
+    other = RosbagMetadataHandler.render(data, "a.bag", r"(?P<location>a)")
+    assert not RosbagMetadataHandler.same_metadata(data, other)
+    changed = RosbagMetadataHandler.render(other, "a.bag")
+    changed["General"]["LastModified"] = "now"
+    assert RosbagMetadataHandler.same_metadata(other, changed)
+    assert not RosbagMetadataHandler.same_metadata(None, other)
+
+
+def test_bag_report_text_matches_rosbag_info(tmpdir):
+    rosbag = pytest.importorskip("rosbag")
+    rospy = pytest.importorskip("rospy")
+    from std_msgs.msg import String
+    from mrt_tools.RosbagMetadataHandler import get_bag_report
+
+    filename = str(tmpdir.join("test.bag"))
+    with rosbag.Bag(filename, "w") as bag:
+        for i in range(20):
+            bag.write("/chatter", String(data="message {}".format(i)), rospy.Time(100 + i * 0.1))
+            if i % 2:
+                bag.write("/slow", String(data="slow"), rospy.Time(100 + i * 0.1))
+    with rosbag.Bag(filename) as bag:
+        expected = str(bag)
+
+    report = get_bag_report(filename)
+    assert report["error"] is None
+    assert report["text"] == expected
+    assert report["summary"]["topics"] == {"/chatter": ("std_msgs/String", 20), "/slow": ("std_msgs/String", 10)}
+
+    # Without text, e.g. for --json, only the index of the metadata topic is read
+    report = get_bag_report(filename, text=False)
+    assert report["error"] is None and report["text"] is None
+    assert report["summary"]["topics"]["/chatter"] == ("std_msgs/String", 20)
+
+
+def test_open_index_only_reads_the_index_of_requested_topics(tmpdir):
+    rosbag = pytest.importorskip("rosbag")
+    rospy = pytest.importorskip("rospy")
+    from std_msgs.msg import String
+
+    filename = str(tmpdir.join("test.bag"))
+    with rosbag.Bag(filename, "w", chunk_threshold=1024) as bag:
+        for i in range(200):
+            bag.write("/points", String(data="x" * 100), rospy.Time(100 + i * 0.1))
+            if i % 50 == 0:
+                bag.write("/metadata", String(data="metadata {}".format(i)), rospy.Time(100 + i * 0.1))
+
+    with RosbagMetadataHandler.open_index_only(filename, ["/metadata"]) as bag:
+        assert len(bag._chunks) > 10
+        messages = [msg.data for _, msg, _ in bag.read_messages(topics=["/metadata"])]
+        assert messages == ["metadata 0", "metadata 50", "metadata 100", "metadata 150"]
+        if "skip_index" in inspect.getargspec(rosbag.Bag.__init__).args:
+            for connection in bag._connections.values():
+                if connection.topic == "/points":
+                    assert not bag._connection_indexes.get(connection.id)
@@ -0,0 +1,98 @@
+from mrt_tools.RosdepResolver import RosdepResolver
+import pytest
+import os
+
+
+def test_resolve_from_index(tmpdir):
+    resolver = RosdepResolver(cache_file=str(tmpdir.join("rosdep_cache")))
+    resolver.index = {"boost": ("apt", ["libboost-all-dev"]),
+                      "eigen": ("apt", ["libeigen3-dev"]),
+                      "python-foo-pip": ("pip", ["foo"]),
+                      "windows_only": None}
+
+    resolved, unresolved = resolver.resolve(["boost", "eigen", "python-foo-pip", "windows_only", "mrt_pkg"])
+    assert resolved == {"apt": {"libboost-all-dev", "libeigen3-dev"}, "pip": {"foo"}}
+    assert unresolved == ["mrt_pkg", "windows_only"]
+    assert "boost" in resolver.keys()
+
+
+def test_index_is_rebuilt_when_sources_change(tmpdir, monkeypatch):
+    cache_file = str(tmpdir.join("rosdep_cache"))
+    sources_hash = ["a"]
+    builds = []
+
+    def create_resolver():
+        resolver = RosdepResolver(cache_file=cache_file)
+        monkeypatch.setattr(resolver, "get_sources_hash", lambda: sources_hash[0])
+        monkeypatch.setattr(resolver, "build_index", lambda: builds.append(sources_hash[0]) or {"boost": None})
+        return resolver
+
+    resolver = create_resolver()
+    assert resolver.keys() == {"boost"}
+    assert builds == ["a"]
+
+    # Served from the cache file
+    assert create_resolver().keys() == {"boost"}
+    assert builds == ["a"]
+
+    sources_hash[0] = "b"
+    resolver.invalidate()
+    resolver.keys()
+    assert builds == ["a", "b"]
+
+    with open(cache_file, "w") as f:
+        f.write("corrupt")
+    create_resolver().keys()
+    assert builds == ["a", "b", "b"]
+
+
+def test_failing_keys_do_not_abort_the_index(tmpdir, monkeypatch):
+    rosdep2 = pytest.importorskip("rosdep2")
+
+    class FakeDefinition(object):
+        def __init__(self, key):
+            self.key = key
+
+        def get_rule_for_platform(self, os_name, os_version, installer_keys, default_key):
+            if self.key == "broken":
+                raise rosdep2.InvalidData("rosdep value for [broken] must be a dictionary")
+            if self.key == "windows_only":
+                raise rosdep2.ResolutionError(self.key, {}, os_name, os_version, "No definition for OS")
+            return "apt", ["lib{}-dev".format(self.key)]
+
+    class FakeView(object):
+        def keys(self):
+            return ["boost", "broken", "windows_only"]
+
+        def lookup(self, key):
+            return FakeDefinition(key)
+
+    class FakeInstaller(object):
+        def resolve(self, rule):
+            return rule
+
+    class FakeInstallerContext(object):
+        def get_installer(self, installer_key):
+            return FakeInstaller()
+
+    class FakeLookup(object):
+        def get_rosdep_view(self, view_key):
+            return FakeView()
+
+    monkeypatch.setattr(rosdep2.RosdepLookup, "create_from_rospkg", staticmethod(lambda: FakeLookup()))
+    resolver = RosdepResolver(cache_file=str(tmpdir.join("rosdep_cache")))
+    resolver.platform = ("ubuntu", "focal", ["apt"], "apt")
+    resolver.installer_context = FakeInstallerContext()
+    assert resolver.build_index() == {"boost": ("apt", ["libboost-dev"]), "broken": None, "windows_only": None}
+
+
+def test_underlay_packages(tmpdir, monkeypatch):
+    pytest.importorskip("rospkg")
+    for path in ("underlay/share/roscpp", "overlay/src/mrt_cmake_modules", "overlay/src/no_package"):
+        tmpdir.join(path).ensure(dir=True)
+    tmpdir.join("underlay/share/roscpp/package.xml").write("<package><name>roscpp</name></package>")
+    tmpdir.join("overlay/src/mrt_cmake_modules/package.xml").write("<package><name>mrt_cmake_modules</name></package>")
+    monkeypatch.delenv("ROS_ROOT", raising=False)
+    monkeypatch.setenv("ROS_PACKAGE_PATH", os.pathsep.join([str(tmpdir.join("underlay", "share")),
+                                                            str(tmpdir.join("overlay", "src"))]))
+    assert RosdepResolver.get_underlay_packages() == {"roscpp", "mrt_cmake_modules"}
@@ -0,0 +1,85 @@
+from mrt_tools.SnapshotStore import SnapshotStore
+import zipfile
+import pytest
+import os
+
+ROSINSTALL = """- git:
+    local-name: {0}
+    uri: git@gitlab.example.com:mrt/{0}.git
+    version: {1}
+"""
+
+
+def create_snapshot(path, repos, config="profile: default\n"):
+    zf = zipfile.ZipFile(str(path), "w")
+    zf.writestr("src/.rosinstall", "".join(ROSINSTALL.format(name, sha) for name, sha in repos))
+    zf.writestr(".catkin_tools/profiles/default/config.yaml", config)
+    zf.writestr("snapshot.version", "0.1.0")
+    zf.close()
+    return str(path)
+
+
+@pytest.fixture
+def store(tmpdir):
+    return SnapshotStore(str(tmpdir.join("store")))
+
+
+def test_diff_and_find(tmpdir, store):
+    a = create_snapshot(tmpdir.join("a_161001.snapshot"), [("lanelet", "aaaa1111"), ("mrt_cmake", "bbbb2222")])
+    b = create_snapshot(tmpdir.join("b_161002.snapshot"), [("lanelet", "aaaa3333"), ("tracking", "cccc4444")],
+                        config="profile: release\n")
+    assert store.add_archive(a) == "a_161001"
+    assert store.add_archive(b) == "b_161002"
+
+    changes, files = store.diff("a_161001", "b_161002")
+    assert [(c.local_name, c.status) for c in changes] == [("lanelet", "changed"), ("mrt_cmake", "removed"),
+                                                           ("tracking", "added")]
+    assert changes[0].old[1] == "aaaa1111" and changes[0].new[1] == "aaaa3333"
+    assert files == [".catkin_tools/profiles/default/config.yaml"]
+
+    assert store.find("lanelet", "aaa") == []  # too short for a prefix, needs an exact match
+    assert [r[0] for r in store.find("lanelet", "aaaa11")] == ["a_161001"]
+    assert [r[0] for r in store.find("mrt/tracking", "cccc4444")] == ["b_161002"]
+    assert store.find("mrt_tracking", "cccc4444") == []  # '_' is no wildcard
+    assert sorted(r[0] for r in store.find("", "aaaa")) == ["a_161001", "b_161002"]
+    with pytest.raises(KeyError):
+        store.diff("a_161001", "missing")
+
+
+def test_identical_files_are_stored_once(tmpdir, store):
+    for i in range(3):
+        store.add_archive(create_snapshot(tmpdir.join("s{}.snapshot".format(i)), [("lanelet", "aaaa{}".format(i))]))
+    objects = [f for _, _, files in os.walk(store.objects_dir) for f in files]
+    assert len(objects) == 3 + 2  # three rosinstall files, one config and one version file
+
+    store.export("s1", str(tmpdir.join("exported.snapshot")))
+    assert store.diff("s1", store.add_archive(str(tmpdir.join("exported.snapshot")))) == ([], [])
+
+    store.remove("s0")
+    store.remove("s1")
+    assert sorted(s[0] for s in store.get_snapshots()) == ["exported", "s2"]
+    assert len([f for _, _, files in os.walk(store.objects_dir) for f in files]) == 4
+
+
+def test_replaced_snapshot_objects_are_removed(tmpdir, store):
+    store.add_archive(create_snapshot(tmpdir.join("s.snapshot"), [("lanelet", "aaaa1111")]))
+    store.add_archive(create_snapshot(tmpdir.join("s.snapshot"), [("lanelet", "aaaa2222")]))
+    assert store.get_repos("s") == {"lanelet": ("git@gitlab.example.com:mrt/lanelet.git", "aaaa2222")}
+    assert len([f for _, _, files in os.walk(store.objects_dir) for f in files]) == 3
+
+
+def test_restore_from_store(tmpdir, store, monkeypatch):
+    mrt_snapshot = pytest.importorskip("mrt_tools.commands.mrt_snapshot")
+    store.add_archive(create_snapshot(tmpdir.join("a_161001.snapshot"), [("lanelet", "aaaa1111")]))
+    os.remove(str(tmpdir.join("a_161001.snapshot")))
+    monkeypatch.chdir(str(tmpdir))
+
+    zf = mrt_snapshot.open_snapshot_("a_161001", store)
+    # The exported file is removed already, the archive is still readable
+    assert zf.read("snapshot.version") == "0.1.0"
+    zf.extractall(str(tmpdir.join("ws")))
+    with open(str(tmpdir.join("ws", "src", ".rosinstall"))) as f:
+        assert "aaaa1111" in f.read()
+    assert os.path.isfile(str(tmpdir.join("ws", ".catkin_tools", "profiles", "default", "config.yaml")))
+    with pytest.raises(IOError):
+        mrt_snapshot.open_snapshot_("missing", store)
@@ -0,0 +1,25 @@
+from mrt_tools.TopicStatistics import compute_statistics
+import pytest
+
+
+def test_frequencies_and_gaps():
+    # 10 Hz lidar with one dropped second, camera with a single message
+    stamps = [0.1 * i for i in range(10)] + [2.0 + 0.1 * i for i in range(10)]
+    messages = [("/lidar", "sensor_msgs/PointCloud2", 100 + i, t) for i, t in enumerate(stamps)]
+    messages.append(("/camera", "sensor_msgs/Image", 5000, 0.5))
+    statistics = compute_statistics(sorted(messages, key=lambda m: m[3]), gap_threshold=0.5)
+
+    assert list(statistics) == ["/camera", "/lidar"]
+    lidar = statistics["/lidar"]
+    assert lidar["Messages"] == 20
+    assert lidar["Bytes"] == sum(100 + i for i in range(20))
+    assert (lidar["MinSize"], lidar["MaxSize"]) == (100, 119)
+    assert lidar["MaxFrequency"] == pytest.approx(10.0)
+    assert lidar["MinFrequency"] == pytest.approx(1 / 1.1, abs=1e-3)
+    assert lidar["MeanFrequency"] == pytest.approx(19 / 2.9, abs=1e-3)
+    assert lidar["Gaps"] == 1
+    assert lidar["GapList"] == [{"Start": 0.9, "Duration": 1.1}]
+
+    camera = statistics["/camera"]
+    assert camera["Messages"] == 1
+    assert camera["MeanFrequency"] is None and camera["Gaps"] == 0
@@ -0,0 +1,212 @@
+from mrt_tools.UpdateScheduler import UpdateScheduler, local_reference
+from mrt_tools.CloneMode import CloneMode
+import mrt_tools.UpdateScheduler
+import mrt_tools.CloneMode
+import subprocess
+import socket
+import pytest
+import os
+
+
+class FakePathSpec(object):
+    def __init__(self, uri, version=None):
+        self.uri = uri
+        self.version = version
+
+    def get_uri(self):
+        return self.uri
+
+    def get_version(self):
+        return self.version
+
+
+class FakeElement(object):
+    def __init__(self, name, path, uri, version=None):
+        self.name = name
+        self.path = path
+        self.path_spec = FakePathSpec(uri, version)
+
+    def get_local_name(self):
+        return self.name
+
+    def get_path(self):
+        return self.path
+
+    def get_path_spec(self):
+        return self.path_spec
+
+
+def git(path, *args):
+    subprocess.check_call(["git", "-C", path, "-c", "user.name=Test", "-c", "user.email=test@example.com"] +
+                          list(args), stdout=open(os.devnull, "w"), stderr=subprocess.STDOUT)
+
+
+@pytest.fixture
+def remote(tmpdir):
+    remote = str(tmpdir.join("remote"))
+    subprocess.check_call(["git", "init", "-q", remote])
+    with open(os.path.join(remote, "file"), "w") as f:
+        f.write("content")
+    git(remote, "add", "file")
+    git(remote, "commit", "-q", "-m", "Initial commit")
+    return remote
+
+
+def test_clone_and_update(tmpdir, remote):
+    scheduler = UpdateScheduler(jobs=2, retries=0)
+    element = FakeElement("repo", str(tmpdir.join("src", "repo")), remote)
+    missing = FakeElement("missing", str(tmpdir.join("src", "missing")), str(tmpdir.join("nonexistent")))
+
+    results = scheduler.run([element, missing])
+    assert {r.name: r.success for r in results} == {"repo": True, "missing": False}
+    assert os.path.exists(os.path.join(element.get_path(), "file"))
+
+    with open(os.path.join(remote, "file"), "w") as f:
+        f.write("new content")
+    git(remote, "commit", "-q", "-a", "-m", "Second commit")
+
+    result, = scheduler.run([element])
+    assert result.success and result.action == "update"
+    with open(os.path.join(element.get_path(), "file")) as f:
+        assert f.read() == "new content"
+
+
+FAKE_SSH = """#!/bin/sh
+# Behaves like ssh with ControlMaster: -O check succeeds while a master is running
+case " $* " in
+    *" -O check "*) test -e {0}.socket ;;
+    *" -MNf "*) echo "$@" >> {0}.masters && touch {0}.socket ;;
+esac
+"""
+
+
+def test_open_connections_reuses_masters(tmpdir):
+    ssh = str(tmpdir.join("ssh"))
+    with open(ssh, "w") as f:
+        f.write(FAKE_SSH.format(ssh))
+    os.chmod(ssh, 0o755)
+    server = socket.socket()
+    server.bind(("localhost", 0))
+    server.listen(5)
+    uri = "ssh://git@localhost:{}/group/repo.git".format(server.getsockname()[1])
+
+    scheduler = UpdateScheduler()
+    scheduler.env["GIT_SSH_COMMAND"] = ssh + " -o ControlMaster=auto"
+    try:
+        scheduler.open_connections([uri])
+        scheduler.open_connections([uri])
+    finally:
+        server.close()
+    with open(ssh + ".masters") as f:
+        assert f.read().splitlines() == ["-o ControlMaster=auto -o ConnectTimeout=5 -MNf -p {} git@localhost".format(
+            uri.split(":")[2].split("/")[0])]
+
+
+def test_get_host():
+    assert UpdateScheduler.get_host("git@gitlab.example.com:group/repo.git") == ("ssh", "gitlab.example.com", 22)
+    assert UpdateScheduler.get_host("https://gitlab.example.com/group/repo.git") == \
+        ("https", "gitlab.example.com", 443)
+
+
+def test_clone_pinned_commit_from_reference(tmpdir, remote):
+    sha = subprocess.check_output(["git", "-C", remote, "rev-parse", "HEAD"]).strip()
+    reference_dir = tmpdir.mkdir("reference")
+    subprocess.check_call(["git", "clone", "-q", "--mirror", remote, str(reference_dir.join("repo.git"))])
+    references = UpdateScheduler.find_local_repos(str(reference_dir))
+    assert references == {UpdateScheduler.get_repo_key(remote): str(reference_dir.join("repo.git"))}
+
+    # The pinned commit is cloned from the reference, even though the remote is gone
+    uri = remote + "_moved"
+    os.rename(remote, uri)
+    key = UpdateScheduler.get_repo_key(remote)
+    scheduler = UpdateScheduler(jobs=1, retries=0, references=lambda u: local_reference(references.get(key)))
+    element = FakeElement("repo", str(tmpdir.join("src", "repo")), uri, sha)
+    result, = scheduler.run([element])
+    assert result.success
+    assert subprocess.check_output(["git", "-C", element.get_path(), "rev-parse", "HEAD"]).strip() == sha
+    assert subprocess.check_output(["git", "-C", element.get_path(), "config", "remote.origin.url"]).strip() == uri
+    # Branches of the reference do not pretend to be the state of the server
+    assert subprocess.check_output(["git", "-C", element.get_path(), "for-each-ref", "refs/heads/",
+                                    "refs/remotes/"]) == ""
+
+
+def test_get_repo_key():
+    assert UpdateScheduler.get_repo_key("git@gitlab.example.com:Group/repo.git") == \
+        UpdateScheduler.get_repo_key("https://gitlab.example.com/group/repo") == "gitlab.example.com/group/repo"
+
+
+def test_shallow_and_partial_clone(tmpdir, remote):
+    old_sha = subprocess.check_output(["git", "-C", remote, "rev-parse", "HEAD"]).strip()
+    for i in range(3):
+        with open(os.path.join(remote, "file"), "w") as f:
+            f.write("content {}".format(i))
+        git(remote, "commit", "-q", "-a", "-m", "Commit {}".format(i))
+    git(remote, "config", "uploadpack.allowFilter", "true")
+    git(remote, "config", "uploadpack.allowAnySHA1InWant", "true")
+    uri = "file://" + remote  # Local paths are always cloned fully
+
+    shallow = FakeElement("shallow", str(tmpdir.join("src", "shallow")), uri)
+    pinned = FakeElement("pinned", str(tmpdir.join("src", "pinned")), uri, old_sha)
+    partial = FakeElement("partial", str(tmpdir.join("src", "partial")), uri)
+    scheduler = UpdateScheduler(jobs=1, retries=0, clone_modes={
+        "shallow": CloneMode(depth=1), "pinned": CloneMode(depth=1), "partial": CloneMode(blob_filter="blob:none")})
+    assert all(r.success for r in scheduler.run([shallow, pinned, partial]))
+
+    def commit_count(element):
+        return int(subprocess.check_output(["git", "-C", element.get_path(), "rev-list", "--count", "HEAD"]))
+
+    assert commit_count(shallow) == 1 and UpdateScheduler.is_shallow(shallow.get_path())
+    assert subprocess.check_output(["git", "-C", pinned.get_path(), "rev-parse", "HEAD"]).strip() == old_sha
+    assert commit_count(partial) == 4 and not UpdateScheduler.is_shallow(partial.get_path())
+
+    # Updates only fetch new commits
+    git(remote, "commit", "-q", "--allow-empty", "-m", "Another commit")
+    assert all(r.success for r in scheduler.run([shallow]))
+    assert commit_count(shallow) == 2 and UpdateScheduler.is_shallow(shallow.get_path())
+
+    assert scheduler.make_full_clone(shallow.get_path())
+    assert commit_count(shallow) == 5 and not UpdateScheduler.is_shallow(shallow.get_path())
+    assert scheduler.make_full_clone(partial.get_path())
+    assert not scheduler.make_full_clone(partial.get_path())
+
+
+def test_make_full_clone_without_refetch(tmpdir, remote, monkeypatch):
+    for i in range(3):
+        with open(os.path.join(remote, "file"), "w") as f:
+            f.write("content {}".format(i))
+        git(remote, "commit", "-q", "-a", "-m", "Commit {}".format(i))
+    git(remote, "config", "uploadpack.allowFilter", "true")
+    git(remote, "config", "uploadpack.allowAnySHA1InWant", "true")
+    partial = FakeElement("partial", str(tmpdir.join("src", "partial")), "file://" + remote)
+    scheduler = UpdateScheduler(jobs=1, retries=0, clone_modes={"partial": CloneMode(blob_filter="blob:none")})
+    assert all(r.success for r in scheduler.run([partial]))
+
+    def missing_objects():
+        objects = subprocess.check_output(["git", "-C", partial.get_path(), "rev-list", "--objects", "--all",
+                                           "--missing=print"])
+        return [line for line in objects.splitlines() if line.startswith("?")]
+
+    assert missing_objects()
+    monkeypatch.setattr(mrt_tools.UpdateScheduler, "get_git_version", lambda: (2, 17, 1))
+    assert scheduler.make_full_clone(partial.get_path())
+    assert missing_objects() == []
+    assert not scheduler.make_full_clone(partial.get_path())
+    assert not [n for n in os.listdir(os.path.join(partial.get_path(), ".git")) if n.startswith("refetch.")]
+
+
+def test_clone_modes_file(tmpdir):
+    filename = str(tmpdir.join(".mrt", "clone_modes"))
+    assert CloneMode.load(filename) == {}
+    CloneMode.save(filename, {"a": CloneMode(depth=5), "b": CloneMode(), "c": CloneMode(blob_filter="blob:none")})
+    assert CloneMode.load(filename) == {"a": CloneMode(depth=5), "c": CloneMode(blob_filter="blob:none")}
+    assert str(CloneMode(5, "blob:none")) == "depth 5, filter blob:none"
+    assert CloneMode.from_options(None, None, False) is None
+    assert CloneMode.from_options(3, None, True).is_full
+
+
+def test_filter_needs_recent_git(monkeypatch):
+    monkeypatch.setattr(mrt_tools.CloneMode, "get_git_version", lambda: (2, 17, 1))
+    assert CloneMode.from_options(3, None, False) == CloneMode(depth=3)
+    assert CloneMode.from_options(None, "blob:none", True).is_full
+    with pytest.raises(SystemExit):
+        CloneMode.from_options(None, "blob:none", False)
@@ -57,6 +57,69 @@ def test_find_by_pattern(working_directory):
                      os.path.join(os.getcwd(), "dir1/dir2/dir3/lkj.test")]
     assert test_files == correct_files
 
+
+def test_write_atomic(working_directory):
+    os.chdir(working_directory)
+    write_atomic("atomic/test.txt", "first")
+    write_atomic("atomic/test.txt", "second")
+    with open("atomic/test.txt") as f:
+        assert f.read() == "second"
+    assert os.listdir("atomic") == ["test.txt"]
+
+
+def test_import_package_names(working_directory):
+    ws_root = os.path.join(working_directory, "ws")
+    os.makedirs(os.path.join(ws_root, ".catkin_tools"))
+    os.makedirs(os.path.join(ws_root, "src", "pkg_a"))
+    os.chdir(os.path.join(ws_root, "src", "pkg_a"))
+    assert find_workspace_root() == ws_root
+    assert import_package_names() == []
+    write_atomic(get_package_names_file(ws_root), "pkg_a\npkg_b\n")
+    assert import_package_names() == ["pkg_a", "pkg_b"]
+
+
+def test_read_git_urls(working_directory):
+    src = os.path.join(working_directory, "git_urls_src")
+    cache_file = os.path.join(working_directory, "git_urls_cache")
+    os.makedirs(os.path.join(src, "repo", ".git"))
+    os.makedirs(os.path.join(src, "no_repo"))
+    with open(os.path.join(src, "repo", ".git", "config"), "w") as f:
+        f.write('[remote "origin"]\n\turl = git@example.com:group/repo.git\n')
+
+    expected = {"repo": "git@example.com:group/repo.git"}
+    assert read_git_urls(src, ["repo", "no_repo"], cache_file) == expected
+    assert os.path.exists(cache_file)
+
+    # Unchanged configs are served from the cache
+    mtime = os.path.getmtime(cache_file)
+    assert read_git_urls(src, ["repo", "no_repo"], cache_file) == expected
+    assert os.path.getmtime(cache_file) == mtime
+
+    with open(os.path.join(src, "repo", ".git", "config"), "w") as f:
+        f.write('[remote "origin"]\n\turl = https://example.com/group/other_repo.git\n')
+    assert read_git_urls(src, ["repo"], cache_file) == {"repo": "https://example.com/group/other_repo.git"}
+
+
+def test_import_topic_names(working_directory, monkeypatch):
+    started = []
+    monkeypatch.setitem(user_settings['Cache'], 'TOPIC_CACHE_FILE', os.path.join(working_directory, "topic_cache"))
+    monkeypatch.setitem(user_settings['Cache'], 'TOPIC_CACHE_TTL', 10)
+    monkeypatch.setenv("ROS_MASTER_URI", "http://localhost:11311")
+    monkeypatch.setattr(subprocess, "Popen", lambda *args, **kwargs: started.append(args))
+
+    # Without cache, a refresh is started in the background and nothing is completed
+    assert import_topic_names() == []
+    assert len(started) == 1
+
+    write_atomic(user_settings['Cache']['TOPIC_CACHE_FILE'], "http://localhost:11311\n/rosout\n/velodyne/points\n")
+    assert import_topic_names() == ["rosout", "velodyne/points"]
+    assert len(started) == 1
+
+    # Topics of another master are not used
+    monkeypatch.setenv("ROS_MASTER_URI", "http://robot:11311")
+    assert import_topic_names() == []
+    assert len(started) == 2
+
 # Untested functions
 # def get_userinfo():
 #     return
@@ -85,4 +148,4 @@ def test_find_by_pattern(working_directory):
 # def set_git_credentials(username, password):
 #     return
 # def test_git_credentials():
-#     return
\ No newline at end of file
+#     return
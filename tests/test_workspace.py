@@ -0,0 +1,40 @@
+import pytest
+
+pytest.importorskip("wstool")
+pytest.importorskip("catkin_tools")
+import mrt_tools.Workspace
+from mrt_tools.Workspace import Workspace
+
+
+class FakeGraph(object):
+    packages_by_name = {"mrt_pkg": None}
+
+    def dependencies(self, pkg_name, dep_types=None):
+        return {"roscpp", "boost"}
+
+
+class FakeResolver(object):
+    def __init__(self):
+        self.requested = None
+
+    @staticmethod
+    def get_underlay_packages():
+        return {"roscpp", "rospy"}
+
+    def resolve(self, keys):
+        self.requested = set(keys)
+        return {"apt": {"libboost-all-dev"}}, []
+
+    def get_packages_to_install(self, installer_key, packages):
+        return []
+
+
+def test_underlay_packages_are_not_resolved(monkeypatch):
+    monkeypatch.setattr(mrt_tools.Workspace, "is_ros_sourced", lambda: True)
+    monkeypatch.setattr(mrt_tools.Workspace, "changed_base_yaml", lambda: False)
+    ws = Workspace.__new__(Workspace)
+    ws.get_dependency_graph = lambda: FakeGraph()
+    resolver = FakeResolver()
+
+    ws.resolve_dependencies(resolver=resolver)
+    assert resolver.requested == {"boost"}
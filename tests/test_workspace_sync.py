@@ -0,0 +1,108 @@
+from mrt_tools.WorkspaceSync import WorkspaceSync, build_manifest, diff_manifests
+import mrt_tools.WorkspaceSync
+import subprocess
+import os
+
+
+class FakeChannel(object):
+    def __init__(self, process):
+        self.process = process
+
+    def shutdown_write(self):
+        self.process.stdin.close()
+
+    def recv_exit_status(self):
+        return self.process.wait()
+
+
+class FakeChannelFile(object):
+    def __init__(self, f, channel):
+        self.f = f
+        self.channel = channel
+
+    def write(self, data):
+        self.f.write(data)
+
+    def flush(self):
+        self.f.flush()
+
+    def read(self):
+        return self.f.read()
+
+
+class FakeSSH(object):
+    """Executes commands locally instead of on a remote host"""
+
+    def __init__(self):
+        self.commands = []
+
+    def exec_command(self, command):
+        self.commands.append(command)
+        process = subprocess.Popen(["bash", "-c", command], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        channel = FakeChannel(process)
+        return tuple(FakeChannelFile(f, channel) for f in (process.stdin, process.stdout, process.stderr))
+
+
+def write(path, content):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+        f.write(content)
+
+
+def test_sync_transfers_only_changes(tmpdir):
+    local = str(tmpdir.join("local"))
+    remote = str(tmpdir.join("remote", "src"))
+    cache_file = str(tmpdir.join("hashes"))
+    write(os.path.join(local, "pkg_a", "package.xml"), "a")
+    write(os.path.join(local, "pkg_b", "script.sh"), "#!/bin/sh")
+    os.chmod(os.path.join(local, "pkg_b", "script.sh"), 0o755)
+    write(os.path.join(local, "pkg_b", ".git", "config"), "hidden")
+    os.symlink("pkg_a/package.xml", os.path.join(local, "link.xml"))
+
+    sync = WorkspaceSync(FakeSSH(), remote)
+    changed, removed, sent = sync.sync(local, cache_file)
+    assert (changed, removed) == (3, 0) and sent > 0
+    assert open(os.path.join(remote, "pkg_a", "package.xml")).read() == "a"
+    assert os.access(os.path.join(remote, "pkg_b", "script.sh"), os.X_OK)
+    assert os.readlink(os.path.join(remote, "link.xml")) == "pkg_a/package.xml"
+    assert not os.path.exists(os.path.join(remote, "pkg_b", ".git"))
+    assert sync.read_remote_manifest() == build_manifest(local)
+
+    assert sync.sync(local, cache_file) == (0, 0, 0)
+
+    write(os.path.join(local, "pkg_b", "script.sh"), "#!/bin/bash")
+    os.remove(os.path.join(local, "pkg_a", "package.xml"))
+    os.remove(os.path.join(local, "link.xml"))
+    assert sync.sync(local, cache_file)[:2] == (1, 2)
+    assert open(os.path.join(remote, "pkg_b", "script.sh")).read() == "#!/bin/bash"
+    assert not os.path.exists(os.path.join(remote, "pkg_a"))
+
+
+def test_files_deleted_during_the_sync_are_skipped(tmpdir, monkeypatch):
+    local = str(tmpdir.join("local"))
+    remote = str(tmpdir.join("remote", "src"))
+    write(os.path.join(local, "pkg_a", "package.xml"), "a")
+    write(os.path.join(local, "pkg_a", "build.log"), "old")
+    sync = WorkspaceSync(FakeSSH(), remote)
+    sync.sync(local)
+
+    def build_manifest_and_delete(src, cache_file=None):
+        manifest = build_manifest(src, cache_file)
+        os.remove(os.path.join(local, "pkg_a", "build.log"))
+        return manifest
+
+    write(os.path.join(local, "pkg_a", "package.xml"), "b")
+    write(os.path.join(local, "pkg_a", "build.log"), "new")
+    monkeypatch.setattr(mrt_tools.WorkspaceSync, "build_manifest", build_manifest_and_delete)
+    assert sync.sync(local)[:2] == (1, 0)
+    assert open(os.path.join(remote, "pkg_a", "package.xml")).read() == "b"
+    assert not os.path.exists(os.path.join(remote, "pkg_a", "build.log"))
+    assert sorted(sync.read_remote_manifest()) == ["pkg_a/package.xml"]
+
+
+def test_diff_manifests():
+    local = {"a": "1 644", "b": "2 755", "c": "3 644"}
+    remote = {"a": "1 644", "b": "2 644", "d": "4 644"}
+    assert diff_manifests(local, remote) == (["b", "c"], ["d"])